@@ -1,12 +1,14 @@
-from passlib.context import CryptContext
 from jose import JWTError, jwt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 import os
-from app.database.database import get_db
+from app.database.database import ReplicaSessionLocal, get_db
+from app.database.replica import use_replica
 from app.database.models import User
 from app.schemas.user import TokenData
 from loguru import logger
@@ -17,17 +19,21 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Built on first use: passlib and its bcrypt backend are slow to import
+@lru_cache(maxsize=None)
+def password_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 # Checks if the plain text password matches the hashed password in the DB.
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_context().verify(plain_password, hashed_password)
 
 # Hashes the password using bcrypt.
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return password_context().hash(password)
 
 # Verifies if the provided password is correct.
 def create_access_token(data: dict) -> str:
@@ -36,18 +42,8 @@ def create_access_token(data: dict) -> str:
     payload.update({"exp": expiration_time})
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
-# Retrieves the current user from the token.
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> User:
-    # If token is invalid, this exception will be raised
-    invalid_credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Invalid or expired token.",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-
+# Decodes and verifies a token; None if it is invalid or expired.
+def decode_token(token: str) -> Optional[TokenData]:
     try:
         # Decode the token using the secret key and algorithm
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -56,16 +52,48 @@ def get_current_user(
 
         if not email or not user_id:
             logger.warning("Missing 'sub' or 'user_id' in token.")
-            raise invalid_credentials_exception
+            return None
 
-        token_data = TokenData(email=email, user_id=user_id)
+        expires = payload.get("exp")
+        expires_at = datetime.fromtimestamp(expires, timezone.utc) if expires is not None else None
+        return TokenData(email=email, user_id=user_id, expires_at=expires_at)
 
     except JWTError as e:
         logger.error(f"JWT decoding failed: {e}")
+        return None
+
+# Looks the user up on the replica when it is safe, in a session that ends
+# with the lookup. A replica session kept for the whole request would hold a
+# pooled connection through the LLM call, after the handler has handed back
+# its own (see app/routers/ai.py).
+def _load_user(db: Session, user_id: str) -> Optional[User]:
+    if not use_replica(user_id):
+        return db.query(User).filter(User.id == user_id).first()
+    replica = ReplicaSessionLocal()
+    try:
+        return replica.query(User).filter(User.id == user_id).first()
+    finally:
+        # The user stays usable detached; its columns are loaded
+        replica.close()
+
+# Retrieves the current user from the token.
+def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+) -> User:
+    # If token is invalid, this exception will be raised
+    invalid_credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid or expired token.",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+    token_data = decode_token(token)
+    if token_data is None:
         raise invalid_credentials_exception
 
     # Fetch the user from the database using the ID from the token
-    user = db.query(User).filter(User.id == token_data.user_id).first()
+    user = _load_user(db, token_data.user_id)
 
     if user is None:
         logger.warning(f"User not found: {token_data.email}")
@@ -0,0 +1,208 @@
+# python3 -m app.database.compression
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from loguru import logger
+from sqlalchemy import Table, bindparam, select, text
+from sqlalchemy.engine import Engine
+
+from app.database.models import SavedStrategy, Message
+from app.database.types import COMPRESSION_MIN_BYTES, NIL_KEY, UUIDKey
+
+# Columns stored with CompressedText, as (table, column)
+COMPRESSED_COLUMNS = [
+    (SavedStrategy.__table__, "content"),
+    (Message.__table__, "content"),
+]
+
+
+# Postgres databases from before compression have these columns as text,
+# and this version writes codec-tagged bytes, so it won't start against them.
+# Convert them without blocking traffic, like app.database.uuid_keys:
+#   python3 -m app.database.compression prepare
+#     1. prepare: add a bytea shadow column per text column, kept in sync by a trigger
+#     2. backfill: fill the shadow columns in small batches
+#   Safe while the previous version is serving; it keeps writing text, which the trigger copies.
+#   python3 -m app.database.compression
+#     3. swap: one short transaction replaces the old columns with the shadows
+#     4. compress existing rows in small batches
+#   Start this version right after the swap.
+# Existing values get the raw codec tag, so they stay readable before step 4
+# compresses them. SQLite stores blobs in a TEXT column as-is and needs no
+# schema change.
+
+BATCH_SIZE = 1000
+
+# Raw codec tag in front of the UTF-8 text
+_RAW_SQL = "('\\x00'::bytea || convert_to({column}, 'UTF8'))"
+
+
+def _pending_text_columns(engine: Engine) -> List[Tuple[Table, str]]:
+    pending = []
+    with engine.connect() as connection:
+        for table, column in COMPRESSED_COLUMNS:
+            data_type = connection.execute(text(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_name = :table AND column_name = :column"
+            ), {"table": table.name, "column": column}).scalar()
+            if data_type == "text":
+                pending.append((table, column))
+    return pending
+
+
+# Called from run_migrations. Cheap when there is nothing to do.
+def ensure_compressed_columns(engine: Engine) -> None:
+    if engine.dialect.name != "postgresql":
+        return
+    pending = _pending_text_columns(engine)
+    if pending:
+        described = ", ".join(f"{table.name}.{column}" for table, column in pending)
+        # Writing bytes to a text column stores their escaped form, so don't serve against it
+        raise RuntimeError(f"{described} still text; run python3 -m app.database.compression to convert online")
+
+
+def prepare_postgres(engine: Engine, pending: List[Tuple[Table, str]]) -> None:
+    with engine.begin() as connection:
+        for table, column in pending:
+            connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {column}_bytes bytea"))
+            connection.execute(text(
+                f"CREATE OR REPLACE FUNCTION {table.name}_{column}_bytes_sync() RETURNS trigger AS $$ "
+                f"BEGIN NEW.{column}_bytes := {_RAW_SQL.format(column=f'NEW.{column}')}; RETURN NEW; END $$ LANGUAGE plpgsql"
+            ))
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {table.name}_{column}_bytes_sync ON {table.name}"))
+            connection.execute(text(
+                f"CREATE TRIGGER {table.name}_{column}_bytes_sync BEFORE INSERT OR UPDATE ON {table.name} "
+                f"FOR EACH ROW EXECUTE FUNCTION {table.name}_{column}_bytes_sync()"
+            ))
+
+
+def backfill_postgres(
+    engine: Engine, pending: List[Tuple[Table, str]], batch_size: int = BATCH_SIZE, pause: float = 0.05
+) -> None:
+    for table, column in pending:
+        fill = text(
+            f"UPDATE {table.name} SET {column}_bytes = {_RAW_SQL.format(column=column)} "
+            f"WHERE id IN (SELECT id FROM {table.name} WHERE id > :last_id AND {column}_bytes IS NULL "
+            f"ORDER BY id LIMIT :limit) RETURNING id"
+        )
+        last_id = NIL_KEY
+        total = 0
+        while True:
+            with engine.begin() as connection:
+                ids = [row[0] for row in connection.execute(fill, {"last_id": last_id, "limit": batch_size})]
+            if not ids:
+                break
+            last_id = max(ids)
+            total += len(ids)
+            logger.debug(f"Backfilled {total} rows in {table.name}.{column}_bytes")
+            time.sleep(pause)
+        logger.info(f"Backfilled {total} rows in {table.name}.{column}_bytes")
+
+    # A validated CHECK lets SET NOT NULL skip the table scan during the swap,
+    # and fails here, not there, if a row was missed
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for table, column in pending:
+            constraint = f"{table.name}_{column}_bytes_not_null"
+            connection.execute(text(f"ALTER TABLE {table.name} DROP CONSTRAINT IF EXISTS {constraint}"))
+            connection.execute(text(
+                f"ALTER TABLE {table.name} ADD CONSTRAINT {constraint} CHECK ({column}_bytes IS NOT NULL) NOT VALID"
+            ))
+            connection.execute(text(f"ALTER TABLE {table.name} VALIDATE CONSTRAINT {constraint}"))
+
+
+def swap_postgres(engine: Engine, pending: List[Tuple[Table, str]]) -> None:
+    with engine.begin() as connection:
+        connection.execute(text("SET LOCAL lock_timeout = '5s'"))
+        for table, column in pending:
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {table.name}_{column}_bytes_sync ON {table.name}"))
+            connection.execute(text(f"DROP FUNCTION IF EXISTS {table.name}_{column}_bytes_sync()"))
+            connection.execute(text(f"ALTER TABLE {table.name} DROP COLUMN {column}"))
+            connection.execute(text(f"ALTER TABLE {table.name} RENAME COLUMN {column}_bytes TO {column}"))
+            connection.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {column} SET NOT NULL"))
+            connection.execute(text(f"ALTER TABLE {table.name} DROP CONSTRAINT {table.name}_{column}_bytes_not_null"))
+
+
+def convert_compressed_columns(engine: Engine, swap: bool = True, batch_size: int = BATCH_SIZE, pause: float = 0.05) -> None:
+    if engine.dialect.name != "postgresql":
+        return
+    pending = _pending_text_columns(engine)
+    if not pending:
+        logger.info("Compressed columns already use bytea")
+        return
+    logger.info(f"Converting to bytea: {', '.join(f'{table.name}.{column}' for table, column in pending)}")
+    prepare_postgres(engine, pending)
+    backfill_postgres(engine, pending, batch_size, pause)
+    if swap:
+        swap_postgres(engine, pending)
+        logger.info("Compressed columns converted to bytea")
+
+
+def _uncompressed_predicate(dialect: str, column: str) -> str:
+    if dialect == "postgresql":
+        return f"get_byte({column}, 0) = 0 AND octet_length({column}) > :min_bytes"
+    return (
+        f"(typeof({column}) = 'text' OR hex(substr({column}, 1, 1)) = '00') "
+        f"AND length(CAST({column} AS BLOB)) > :min_bytes"
+    )
+
+
+def _compress_table(engine: Engine, table: Table, column: str, batch_size: int, pause: float) -> int:
+    predicate = _uncompressed_predicate(engine.dialect.name, column)
+    update = table.update().where(table.c.id == bindparam("row_id")).values({column: bindparam("value")})
+    pending = text(
+        f"SELECT id FROM {table.name} WHERE id > :last_id AND {predicate} ORDER BY id LIMIT :limit"
+    ).bindparams(bindparam("last_id", type_=UUIDKey())).columns(table.c.id)
+    last_id = NIL_KEY
+    total = 0
+
+    while True:
+        with engine.begin() as connection:
+            ids = [row[0] for row in connection.execute(pending, {
+                "last_id": last_id, "min_bytes": COMPRESSION_MIN_BYTES, "limit": batch_size
+            })]
+            if not ids:
+                return total
+
+            # Reading through the table decodes the values; writing them back
+            # through CompressedText re-encodes them compressed
+            rows = connection.execute(select(table.c.id, table.c[column]).where(table.c.id.in_(ids))).all()
+            connection.execute(update, [{"row_id": row_id, "value": value} for row_id, value in rows])
+
+        last_id = ids[-1]
+        total += len(rows)
+        logger.debug(f"Compressed {total} rows in {table.name}.{column}")
+        time.sleep(pause)
+
+
+# Compresses existing rows in small batches, each in its own transaction,
+# pausing between batches so it can run next to live traffic
+# Postgres columns have to be converted to bytea first (see above)
+def compress_existing_rows(engine: Engine, batch_size: int = 200, pause: float = 0.05) -> Dict[str, int]:
+    results = {}
+    for table, column in COMPRESSED_COLUMNS:
+        results[f"{table.name}.{column}"] = _compress_table(engine, table, column, batch_size, pause)
+        logger.info(f"Compressed {results[f'{table.name}.{column}']} existing rows in {table.name}.{column}")
+    return results
+
+
+def start_background_compression(engine: Engine, batch_size: int = 200, pause: float = 0.05) -> threading.Thread:
+    def run():
+        try:
+            compress_existing_rows(engine, batch_size, pause)
+        except Exception as e:
+            logger.error(f"Background compression failed: {str(e)}")
+
+    thread = threading.Thread(target=run, name="compress-existing-rows", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    import sys
+    from app.database.database import engine
+    if sys.argv[1:] == ["prepare"]:
+        convert_compressed_columns(engine, swap=False)
+    else:
+        convert_compressed_columns(engine)
+        print(compress_existing_rows(engine))
@@ -1,23 +1,118 @@
 # source venvAnkitaTiwari/bin/activate
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional, Union
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import StaticPool
 from dotenv import load_dotenv
-import os
 from loguru import logger
 Base = declarative_base()
 load_dotenv()
 
-# check
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    logger.error("Oops! DATABASE_URL environment variable not set!")
-    raise ValueError("DATABASE_URL environment variable not set!")
+# The engines are created on first use, not at import, so importing the
+# models, the schemas or the app needs neither DATABASE_URL nor a database
+# driver. Scripts and tests can call configure_database("sqlite://") first
+# to run against a private in-memory database.
+
+
+@dataclass(frozen=True)
+class DatabaseSettings:
+    url: str
+    # Optional streaming replica for read-only endpoints (see app/database/replica.py)
+    replica_url: Optional[str] = None
+
+    @classmethod
+    def from_env(cls) -> "DatabaseSettings":
+        url = os.getenv("DATABASE_URL")
+        if not url:
+            logger.error("Oops! DATABASE_URL environment variable not set!")
+            raise ValueError("DATABASE_URL environment variable not set!")
+        return cls(url=url, replica_url=os.getenv("DATABASE_REPLICA_URL") or None)
+
+
+def _is_sqlite_memory(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and (
+        parsed.database in (None, "", ":memory:") or parsed.query.get("mode") == "memory"
+    )
+
+
+def create_db_engine(url: str, **kwargs) -> Engine:
+    """create_engine, plus what an in-memory SQLite database needs."""
+    if _is_sqlite_memory(url):
+        # Every session and thread shares the one connection; each new
+        # connection would otherwise open its own empty database
+        kwargs.setdefault("poolclass", StaticPool)
+        kwargs.setdefault("connect_args", {"check_same_thread": False})
+    return create_engine(url, **kwargs)
+
+
+class _LazySessionmaker(sessionmaker):
+    """A sessionmaker that binds to its engine when the first session is made."""
+
+    def __init__(self, get_bind, **kw):
+        super().__init__(**kw)
+        self._get_bind = get_bind
 
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=self._get_bind())
+        return super().__call__(**local_kw)
+
+
+_engine: Optional[Engine] = None
+_replica_engine: Optional[Engine] = None
+_configure_lock = threading.Lock()
+
+
+def configure_database(settings: Union[DatabaseSettings, str, None] = None) -> Engine:
+    """Create the engines (from the environment by default) and bind the session factories to them."""
+    if isinstance(settings, str):
+        settings = DatabaseSettings(url=settings)
+    settings = settings or DatabaseSettings.from_env()
+    with _configure_lock:
+        _configure(settings)
+    return _engine
+
+
+def _configure(settings: DatabaseSettings) -> None:
+    global _engine, _replica_engine
+    _engine = create_db_engine(settings.url)
+    _replica_engine = create_db_engine(settings.replica_url, pool_pre_ping=True) if settings.replica_url else None
+    SessionLocal.configure(bind=_engine)
+    ReplicaSessionLocal.configure(bind=_replica_engine)
+
+
+def get_engine() -> Engine:
+    if _engine is None:
+        with _configure_lock:
+            if _engine is None:
+                _configure(DatabaseSettings.from_env())
+    return _engine
+
+
+def get_replica_engine() -> Optional[Engine]:
+    """The replica engine, or None when no replica is configured."""
+    get_engine()
+    return _replica_engine
 
-engine = create_engine(DATABASE_URL)
 
 # Create session factory to interact with the database
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = _LazySessionmaker(get_engine, autocommit=False, autoflush=False)
+ReplicaSessionLocal = _LazySessionmaker(get_replica_engine, autocommit=False, autoflush=False)
+
+
+def __getattr__(name: str):
+    # engine and replica_engine used to be created at import; they stay importable
+    if name == "engine":
+        return get_engine()
+    if name == "replica_engine":
+        return get_replica_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 Base = declarative_base()
 
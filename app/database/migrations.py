@@ -0,0 +1,205 @@
+# python3 -m app.database.migrations
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from loguru import logger
+from sqlalchemy import inspect, text, select, bindparam
+from sqlalchemy.engine import Engine
+
+from app.database.database import Base
+from app.database.models import SavedStrategy, Conversation, Message, make_excerpt
+from app.database.types import NIL_KEY
+from app.services.structured_output import normalize_strategy
+from app.database.compression import ensure_compressed_columns, start_background_compression
+from app.database.search import ensure_search_schema, start_background_indexing
+from app.database.uuid_keys import ensure_uuid_keys
+from app.database.partitions import ensure_message_partitions
+
+# Lightweight, idempotent schema updates for databases created before a
+# column/index existed. Base.metadata.create_all only creates missing tables.
+
+BATCH_SIZE = 500
+
+# Rows from before full-text search are indexed in the background; off, they
+# wait for python3 -m app.database.search
+SEARCH_BACKFILL_ON_STARTUP = os.getenv("SEARCH_BACKFILL_ON_STARTUP", "true").lower() == "true"
+COMPRESSION_BACKFILL_ON_STARTUP = os.getenv("COMPRESSION_BACKFILL_ON_STARTUP", "false").lower() == "true"
+
+# Postgres advisory lock key held while migrating, so processes sharing a
+# database (workers, replicas of the service) migrate one at a time
+MIGRATION_LOCK_KEY = 4_187_203_951
+MIGRATION_LOCK_POLL_SECONDS = 1.0
+
+
+def _add_column_if_missing(engine: Engine, table: str, column: str, ddl_type: str) -> bool:
+    existing = {c["name"] for c in inspect(engine).get_columns(table)}
+    if column in existing:
+        return False
+    with engine.begin() as connection:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+    logger.info(f"Added column {table}.{column}")
+    return True
+
+
+# Adds saved_strategies.excerpt and fills it for existing rows
+def ensure_strategy_excerpts(engine: Engine) -> None:
+    _add_column_if_missing(engine, "saved_strategies", "excerpt", "VARCHAR")
+
+    table = SavedStrategy.__table__
+    update = table.update().where(table.c.id == bindparam("row_id")).values(excerpt=bindparam("value"))
+    total = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select(table.c.id, table.c.content).where(table.c.excerpt.is_(None)).limit(BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            connection.execute(update, [{"row_id": row_id, "value": make_excerpt(content)} for row_id, content in rows])
+        total += len(rows)
+
+    if total:
+        logger.info(f"Filled excerpts for {total} saved strategies")
+
+
+# Adds saved_strategies.document and, the first time, moves JSON content into it
+def ensure_strategy_documents(engine: Engine) -> None:
+    ddl_type = "JSONB" if engine.dialect.name == "postgresql" else "JSON"
+    if _add_column_if_missing(engine, "saved_strategies", "document", ddl_type):
+        convert_strategy_documents(engine)
+
+
+# Moves strategies whose content is a JSON object into the document column.
+# Free-text strategies are left as they are. Resumable: python3 -m app.database.migrations
+def convert_strategy_documents(engine: Engine) -> int:
+    table = SavedStrategy.__table__
+    update = table.update().where(table.c.id == bindparam("row_id")).values(
+        document=bindparam("document"), content=bindparam("content")
+    )
+    last_id = NIL_KEY
+    total = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select(table.c.id, table.c.business_name, table.c.content)
+                .where(table.c.document.is_(None), table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+
+            converted = []
+            for row_id, business_name, content in rows:
+                try:
+                    parsed = json.loads(content)
+                except ValueError:
+                    continue
+                if isinstance(parsed, dict):
+                    document = normalize_strategy(parsed, business_name or "")
+                    converted.append({"row_id": row_id, "document": document, "content": ""})
+
+            if converted:
+                connection.execute(update, converted)
+        last_id = rows[-1][0]
+        total += len(converted)
+
+    if total:
+        logger.info(f"Moved {total} saved strategies to structured documents")
+    return total
+
+
+# Adds the change numbers delta sync and incremental exports order by.
+# Existing rows get 0: they sort before everything written since, by id
+def ensure_change_numbers(engine: Engine) -> None:
+    for table in ("users", "saved_strategies", "conversations", "messages"):
+        _add_column_if_missing(engine, table, "change_seq", "BIGINT NOT NULL DEFAULT 0")
+
+
+# Creates the delta sync indexes on existing tables and gives conversations
+# from before updated_at was always set a value, so sync cursors can see them
+def ensure_sync_indexes(engine: Engine) -> None:
+    for table in (Conversation.__table__, Message.__table__):
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+    with engine.begin() as connection:
+        filled = connection.execute(text(
+            "UPDATE conversations SET updated_at = COALESCE("
+            "(SELECT MAX(messages.created_at) FROM messages WHERE messages.conversation_id = conversations.id), "
+            "conversations.created_at) "
+            "WHERE updated_at IS NULL"
+        )).rowcount
+    if filled:
+        logger.info(f"Filled updated_at for {filled} conversations")
+
+
+# Adds conversations.archived_at for conversation archival
+def ensure_conversation_archiving(engine: Engine) -> None:
+    ddl_type = "TIMESTAMP WITH TIME ZONE" if engine.dialect.name == "postgresql" else "DATETIME"
+    _add_column_if_missing(engine, "conversations", "archived_at", ddl_type)
+
+
+# Adds the columns recording which Gemini model produced a message or draft
+def ensure_model_columns(engine: Engine) -> None:
+    _add_column_if_missing(engine, "messages", "model", "VARCHAR")
+    _add_column_if_missing(engine, "strategy_drafts", "model", "VARCHAR")
+
+
+@contextmanager
+def _migration_lock(engine: Engine):
+    if engine.dialect.name != "postgresql":
+        # SQLite serialises the writes itself
+        yield
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        # Polled rather than waited for: a session blocked in pg_advisory_lock
+        # holds a snapshot, which CREATE INDEX CONCURRENTLY in the holder would wait on
+        while not connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY}).scalar():
+            logger.info("Waiting for another process to finish migrating")
+            time.sleep(MIGRATION_LOCK_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+
+# Runs every schema update in order, one process at a time. Safe to run repeatedly.
+def run_migrations(engine: Engine) -> None:
+    with _migration_lock(engine):
+        # Creates tables added since the database was initialized
+        Base.metadata.create_all(bind=engine)
+        # Keys first: the steps below look rows up by id
+        ensure_uuid_keys(engine)
+        # Stops here while compressed columns are still text; they are converted online
+        ensure_compressed_columns(engine)
+        ensure_strategy_excerpts(engine)
+        ensure_strategy_documents(engine)
+        # Before the sync indexes, which include change_seq
+        ensure_change_numbers(engine)
+        ensure_sync_indexes(engine)
+        ensure_conversation_archiving(engine)
+        ensure_model_columns(engine)
+        ensure_search_schema(engine)
+        # After the search column exists, so the partitioned table inherits it
+        ensure_message_partitions(engine)
+
+
+# What the server runs once before its workers start (app.server), or each
+# process when started another way (app.main's startup). Raises on failure,
+# so nothing serves against a half-migrated schema.
+def prepare_database(engine: Engine) -> None:
+    run_migrations(engine)
+    if SEARCH_BACKFILL_ON_STARTUP:
+        start_background_indexing(engine)
+    if COMPRESSION_BACKFILL_ON_STARTUP:
+        start_background_compression(engine)
+
+
+if __name__ == "__main__":
+    from app.database.database import engine
+    run_migrations(engine)
+    convert_strategy_documents(engine)
+    print("Migrations complete")
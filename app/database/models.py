@@ -1,20 +1,54 @@
 # python3 -m app.database.models
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import BigInteger, Boolean, Column, ForeignKey, Integer, String, Text, Date, DateTime, Index, UniqueConstraint
+from sqlalchemy.orm import relationship, deferred, validates
 from sqlalchemy.sql import func
-import uuid
+import json
+from datetime import datetime, timezone
 from app.database.database import Base
+from app.database.types import CompressedText, JSONDocument, UUIDKey, uuid7
 
 # Generate a UUID as strings
 #  ensures every user/message/strategy has a globally unique ID (
+# Time-ordered (v7), so new rows append to the primary key index
 def generate_uuid():
-    return str(uuid.uuid4())
+    return str(uuid7())
+
+# Set from Python rather than the database so timestamps keep microseconds
+# everywhere (SQLite's CURRENT_TIMESTAMP only has seconds); sync cursors need that
+def utc_now():
+    return datetime.now(timezone.utc)
+
+EXCERPT_LENGTH = 200
+
+# Short plain-text preview of a strategy for list views.
+# Generated strategies are JSON, so prefer their summary when there is one.
+def make_excerpt(content):
+    if not content:
+        return ""
+    text = content
+    try:
+        parsed = json.loads(content) if isinstance(content, str) else content
+        if isinstance(parsed, dict):
+            text = parsed["summary"] if isinstance(parsed.get("summary"), str) else json.dumps(parsed)
+    except ValueError:
+        pass
+
+    text = " ".join(text.split())
+    if len(text) <= EXCERPT_LENGTH:
+        return text
+    return text[:EXCERPT_LENGTH].rsplit(" ", 1)[0] + "..."
+
+
+def strategy_text(content, document):
+    if content or document is None:
+        return content or ""
+    return json.dumps(document)
 
 
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(UUIDKey, primary_key=True, default=generate_uuid)
     email = Column(String, unique=True, index=True, nullable=False)
     full_name = Column(String)
     hashed_password = Column(String, nullable=False)
@@ -22,6 +56,8 @@ class User(Base):
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Last change number handed out for this user's strategies, conversations and messages (app/services/sync.py)
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
 
     strategies = relationship("SavedStrategy", back_populates="user")
     conversations = relationship("Conversation", back_populates="user")
@@ -30,27 +66,72 @@ class User(Base):
 class SavedStrategy(Base):
     __tablename__ = "saved_strategies"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(UUIDKey, primary_key=True, default=generate_uuid)
     title = Column(String, nullable=False)
     business_name = Column(String)
     industry = Column(String)
-    content = Column(Text, nullable=False)
-
-    user_id = Column(String, ForeignKey("users.id"))
+    # Full content is only loaded when accessed; list views use the excerpt.
+    # Structured strategies live in document (JSONB on Postgres) and leave
+    # content empty; content only holds free-text strategies.
+    content = deferred(Column(CompressedText, nullable=False))
+    document = deferred(Column(JSONDocument))
+    excerpt = Column(String)
+
+    user_id = Column(UUIDKey, ForeignKey("users.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Commit-ordered position for incremental exports (app/services/export.py)
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
     
     # Link back with user who saves the strategy
     user = relationship("User", back_populates="strategies")
 
+    @validates("content", "document")
+    def _sync_excerpt(self, key, value):
+        if value:
+            self.excerpt = make_excerpt(value)
+        return value
+
+    # The strategy as the text the API returns, whichever column holds it
+    @property
+    def content_text(self):
+        return strategy_text(self.content, self.document)
+
+
+class StrategyDraft(Base):
+    __tablename__ = "strategy_drafts"
+
+    # Every generated strategy is kept here for a while so it can be saved
+    # by id instead of being uploaded again
+    id = Column(UUIDKey, primary_key=True, default=generate_uuid)
+    user_id = Column(UUIDKey, ForeignKey("users.id"), index=True)
+    business_name = Column(String)
+    industry = Column(String)
+    document = Column(JSONDocument, nullable=False)
+    # Gemini model that generated it
+    model = Column(String)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
 
 class Conversation(Base):
     __tablename__ = "conversations"
+    # Delta sync scans a user's conversations by change number
+    __table_args__ = (
+        Index("ix_conversations_user_id_updated_at", "user_id", "updated_at"),
+        Index("ix_conversations_user_id_change_seq", "user_id", "change_seq"),
+    )
     
-    id = Column(String, primary_key=True, default=generate_uuid)
-    user_id = Column(String, ForeignKey("users.id"))
+    id = Column(UUIDKey, primary_key=True, default=generate_uuid)
+    user_id = Column(UUIDKey, ForeignKey("users.id"))
     title = Column(String, default="New Conversation")
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    created_at = Column(DateTime(timezone=True), default=utc_now, server_default=func.now())
+    # Bumped on every chat turn, so it is never older than the newest message
+    updated_at = Column(DateTime(timezone=True), default=utc_now, onupdate=utc_now)
+    # Set while the messages live in conversation_archives instead of messages
+    archived_at = Column(DateTime(timezone=True))
+    # Set on every chat turn to the turn's last change number, so it is never
+    # lower than any of its messages'; 0 for rows written before change numbers
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
     
     # Every conversation is tied to a user
     user = relationship("User", back_populates="conversations")
@@ -60,15 +141,67 @@ class Conversation(Base):
 
 
 class Message(Base):
+    # Range-partitioned by month on created_at on Postgres (app/database/partitions.py)
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_conversation_id_created_at", "conversation_id", "created_at"),
+        Index("ix_messages_conversation_id_change_seq", "conversation_id", "change_seq"),
+    )
     
-    id = Column(String, primary_key=True, default=generate_uuid)
-    conversation_id = Column(String, ForeignKey("conversations.id"))
-    content = Column(Text, nullable=False)
+    id = Column(UUIDKey, primary_key=True, default=generate_uuid)
+    conversation_id = Column(UUIDKey, ForeignKey("conversations.id"))
+    content = Column(CompressedText, nullable=False)
     role = Column(String, nullable=False)  # 'user' or 'assistant'
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Gemini model that wrote an assistant message (null for cached replies)
+    model = Column(String)
+    created_at = Column(DateTime(timezone=True), default=utc_now, server_default=func.now())
+    # Commit-ordered position for delta sync (app/services/sync.py)
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
     
     conversation = relationship("Conversation", back_populates="messages")
 
+
+class ConversationArchive(Base):
+    __tablename__ = "conversation_archives"
+
+    # Messages of an idle conversation, moved out of the messages table as
+    # one compressed JSON document; restored when the conversation is opened
+    conversation_id = Column(UUIDKey, ForeignKey("conversations.id"), primary_key=True)
+    messages = deferred(Column(CompressedText, nullable=False))
+    message_count = Column(Integer, nullable=False)
+    # Kept so conversation lists can still show a preview
+    last_message = Column(String)
+    archived_at = Column(DateTime(timezone=True), default=utc_now, nullable=False)
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    # Keys are chosen by clients, so they are only unique per user
+    __table_args__ = (UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_id_key"),)
+
+    id = Column(UUIDKey, primary_key=True, default=generate_uuid)
+    user_id = Column(UUIDKey, ForeignKey("users.id"), nullable=False)
+    key = Column(String, nullable=False)
+    # Hash of the endpoint and request body; a reused key must match it
+    request_hash = Column(String, nullable=False)
+    # Both null while the original request is still running
+    status_code = Column(Integer)
+    response = Column(CompressedText)
+    created_at = Column(DateTime(timezone=True), default=utc_now, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class UserUsage(Base):
+    __tablename__ = "user_usage"
+
+    # LLM consumption per user, per UTC day and kind ('chat' or 'strategy')
+    user_id = Column(UUIDKey, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    kind = Column(String, primary_key=True)
+    requests = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    output_tokens = Column(Integer, nullable=False, default=0)
+
+
 if __name__ == "__main__":
     print("Models module is running")
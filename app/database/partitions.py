@@ -0,0 +1,194 @@
+# python3 -m app.database.partitions
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from app.database.compression import _pending_text_columns
+from app.database.uuid_keys import _pending_postgres_columns
+
+# Postgres only: messages is range-partitioned by month on created_at.
+#
+#   messages_legacy    every row from before partitioning (MINVALUE .. boundary)
+#   messages_YYYY_MM   one partition per month from the boundary on
+#   messages_default   anything else, so an insert never fails for lack of a partition
+#
+# Message queries also filter on created_at (a conversation's messages are
+# never older than the conversation), so active conversations only touch
+# recent partitions.
+#
+# An empty messages table is partitioned automatically by run_migrations.
+# An existing one is converted without a long lock by: python3 -m app.database.partitions
+# Either waits until app.database.uuid_keys and app.database.compression have
+# converted their columns: their online steps don't work on a partitioned table.
+
+MESSAGE_PARTITION_MONTHS_AHEAD = int(os.getenv("MESSAGE_PARTITION_MONTHS_AHEAD", "3"))
+
+# Slack for clock differences between app servers and second-resolution legacy timestamps
+_MESSAGE_TIME_SLACK = timedelta(days=1)
+
+
+def message_time_floor(conversation_created_at: Optional[datetime]) -> Optional[datetime]:
+    """Lower bound on a conversation's message timestamps, for partition pruning."""
+    if conversation_created_at is None:
+        return None
+    return conversation_created_at - _MESSAGE_TIME_SLACK
+
+
+def _month_start(day: date, months: int = 0) -> date:
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _is_partitioned(connection: Connection, table: str) -> bool:
+    return connection.execute(text(
+        "SELECT relkind FROM pg_class WHERE relname = :table AND pg_table_is_visible(oid)"
+    ), {"table": table}).scalar() == "p"
+
+
+def ensure_monthly_partitions(engine: Engine, months_ahead: int = MESSAGE_PARTITION_MONTHS_AHEAD) -> None:
+    """Create partitions for the current month and the next few. Safe to run repeatedly."""
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT"))
+        # Months below the legacy partition's upper bound are already covered
+        bound = connection.execute(text(
+            "SELECT pg_get_expr(c.relpartbound, c.oid) FROM pg_class c "
+            "WHERE c.relname = 'messages_legacy' AND c.relispartition"
+        )).scalar()
+
+    first = _month_start(datetime.now(timezone.utc).date())
+    if bound:
+        legacy_end = date.fromisoformat(bound.split("TO ('")[1][:10])
+        first = max(first, legacy_end)
+
+    for offset in range(months_ahead + 1):
+        start = _month_start(first, offset)
+        end = _month_start(start, 1)
+        name = f"messages_{start:%Y_%m}"
+        with engine.begin() as connection:
+            exists = connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+            if exists:
+                continue
+            # Postgres refuses to carve a range out of the default partition if it holds rows for it
+            stray = connection.execute(text(
+                "SELECT 1 FROM messages_default WHERE created_at >= :start AND created_at < :end LIMIT 1"
+            ), {"start": start, "end": end}).first()
+            if stray:
+                logger.warning(f"messages_default has rows for {start:%Y-%m}; not creating {name}")
+                continue
+            connection.execute(text(
+                f"CREATE TABLE {name} PARTITION OF messages "
+                f"FOR VALUES FROM ('{start.isoformat()} 00:00:00+00') TO ('{end.isoformat()} 00:00:00+00')"
+            ))
+            logger.info(f"Created partition {name}")
+
+
+def partition_messages(engine: Engine) -> None:
+    """Turn a plain messages table into a partitioned one.
+
+    The existing table becomes the messages_legacy partition. Everything slow
+    (the unique index, validating the range check) happens first without
+    blocking writes, so the final swap only touches the catalog.
+    """
+    boundary = _month_start(datetime.now(timezone.utc).date(), 2)
+    bound = f"'{boundary.isoformat()} 00:00:00+00'"
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        # The partitioned table's primary key has to include the partition key
+        connection.execute(text(
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS messages_id_created_at_key ON messages (id, created_at)"
+        ))
+        connection.execute(text("ALTER TABLE messages DROP CONSTRAINT IF EXISTS messages_partition_bound"))
+        connection.execute(text(
+            f"ALTER TABLE messages ADD CONSTRAINT messages_partition_bound "
+            f"CHECK (created_at IS NOT NULL AND created_at < {bound}) NOT VALID"
+        ))
+        # Lets ATTACH PARTITION and SET NOT NULL skip their table scans
+        connection.execute(text("ALTER TABLE messages VALIDATE CONSTRAINT messages_partition_bound"))
+        has_search_vector = connection.execute(text(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = 'messages' AND column_name = 'search_vector'"
+        )).first() is not None
+
+    with engine.begin() as connection:
+        connection.execute(text("SET LOCAL lock_timeout = '5s'"))
+        connection.execute(text("ALTER TABLE messages RENAME TO messages_legacy"))
+        connection.execute(text(
+            "ALTER INDEX IF EXISTS ix_messages_conversation_id_created_at RENAME TO messages_legacy_conversation_id_created_at"
+        ))
+        connection.execute(text(
+            "ALTER INDEX IF EXISTS ix_messages_conversation_id_change_seq RENAME TO messages_legacy_conversation_id_change_seq"
+        ))
+        connection.execute(text("ALTER INDEX IF EXISTS ix_messages_search_vector RENAME TO messages_legacy_search_vector"))
+        connection.execute(text("ALTER TABLE messages_legacy ALTER COLUMN created_at SET NOT NULL"))
+
+        connection.execute(text(
+            "CREATE TABLE messages (LIKE messages_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"
+        ))
+        connection.execute(text("ALTER TABLE messages ADD CONSTRAINT messages_partitioned_pkey PRIMARY KEY (id, created_at)"))
+        connection.execute(text(
+            "ALTER TABLE messages ADD CONSTRAINT messages_partitioned_conversation_id_fkey "
+            "FOREIGN KEY (conversation_id) REFERENCES conversations (id)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX ix_messages_conversation_id_created_at ON messages (conversation_id, created_at)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX ix_messages_conversation_id_change_seq ON messages (conversation_id, change_seq)"
+        ))
+        if has_search_vector:
+            connection.execute(text("CREATE INDEX ix_messages_search_vector ON messages USING GIN (search_vector)"))
+
+        # Matching indexes on the legacy table are attached as they are, not rebuilt
+        connection.execute(text(
+            f"ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO ({bound})"
+        ))
+        connection.execute(text("ALTER TABLE messages_legacy DROP CONSTRAINT messages_partition_bound"))
+
+    logger.info(f"Partitioned messages; rows before {boundary} are in messages_legacy")
+    ensure_monthly_partitions(engine)
+
+
+def _pending_conversion(engine: Engine) -> Optional[str]:
+    """The conversion that has to finish before messages can be partitioned, if any."""
+    if _pending_postgres_columns(engine):
+        return "python3 -m app.database.uuid_keys"
+    if _pending_text_columns(engine):
+        return "python3 -m app.database.compression"
+    return None
+
+
+# Called from run_migrations
+def ensure_message_partitions(engine: Engine) -> None:
+    if engine.dialect.name != "postgresql":
+        return
+
+    with engine.connect() as connection:
+        partitioned = _is_partitioned(connection, "messages")
+        empty = partitioned or connection.execute(text("SELECT 1 FROM messages LIMIT 1")).first() is None
+
+    if partitioned:
+        ensure_monthly_partitions(engine)
+        return
+    pending = _pending_conversion(engine)
+    if pending:
+        logger.warning(f"Not partitioning messages until {pending} has converted its columns")
+    elif empty:
+        partition_messages(engine)
+    else:
+        logger.warning("messages is not partitioned; run python3 -m app.database.partitions to convert it online")
+
+
+if __name__ == "__main__":
+    from app.database.database import engine
+    with engine.connect() as conn:
+        already_partitioned = _is_partitioned(conn, "messages")
+    if already_partitioned:
+        ensure_monthly_partitions(engine)
+    else:
+        pending_first = _pending_conversion(engine)
+        if pending_first:
+            raise SystemExit(f"Run {pending_first} first")
+        partition_messages(engine)
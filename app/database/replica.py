@@ -0,0 +1,189 @@
+# python3 -m app.database.replica
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from fastapi import Depends, Request
+from jose import JWTError, jwt
+from loguru import logger
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.database.database import SessionLocal, ReplicaSessionLocal, get_replica_engine, get_db
+from app.database.models import User
+
+# Read-only endpoints use get_read_db, which hands out a replica session when
+# DATABASE_REPLICA_URL is set and the primary session otherwise. A request
+# stays on the primary when:
+#   - the replica is down or more than REPLICA_MAX_LAG_SECONDS behind
+#   - the same user wrote something in the last REPLICA_READ_YOUR_WRITES_SECONDS,
+#     so they never read back a state older than their own write
+# Recent writes are tracked per process; a user's next request landing on
+# another worker right after a write can still see the replica's view.
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "2"))
+REPLICA_READ_YOUR_WRITES_SECONDS = float(os.getenv("REPLICA_READ_YOUR_WRITES_SECONDS", "5"))
+REPLICA_HEALTH_CHECK_SECONDS = float(os.getenv("REPLICA_HEALTH_CHECK_SECONDS", "5"))
+
+# Replay lag in seconds. A standby that has replayed everything it received
+# counts as current even if the primary has been idle for a while.
+_POSTGRES_LAG_SQL = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+_PRUNE_THRESHOLD = 10_000
+
+
+class ReplicaMonitor:
+    """Cached replica health: usable means reachable and not lagging too far."""
+
+    def __init__(
+        self,
+        get_engine: Callable[[], Optional[Engine]],
+        max_lag: float = REPLICA_MAX_LAG_SECONDS,
+        check_interval: float = REPLICA_HEALTH_CHECK_SECONDS
+    ):
+        # A getter, so the engine is only created once it is needed
+        self.get_engine = get_engine
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._usable = False
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def _measure_lag(self) -> float:
+        engine = self.get_engine()
+        with engine.connect() as connection:
+            if engine.dialect.name == "postgresql":
+                return float(connection.execute(_POSTGRES_LAG_SQL).scalar() or 0)
+            connection.execute(text("SELECT 1"))
+            return 0.0
+
+    def check(self) -> bool:
+        try:
+            lag = self._measure_lag()
+            usable = lag <= self.max_lag
+            if not usable and self._usable:
+                logger.warning(f"Read replica is {lag:.1f}s behind; reading from the primary")
+        except Exception as e:
+            usable = False
+            if self._usable or self._checked_at == float("-inf"):
+                logger.warning(f"Read replica unavailable; reading from the primary: {str(e)}")
+        if usable and not self._usable:
+            logger.info("Read replica is usable")
+        self._usable = usable
+        self._checked_at = time.monotonic()
+        return usable
+
+    def usable(self) -> bool:
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return self._usable
+        # One request re-checks; the rest keep the previous answer meanwhile
+        if not self._lock.acquire(blocking=False):
+            return self._usable
+        try:
+            return self.check()
+        finally:
+            self._lock.release()
+
+
+class RecentWrites:
+    """Users who wrote through the primary within the last window seconds."""
+
+    def __init__(self, window: float = REPLICA_READ_YOUR_WRITES_SECONDS):
+        self.window = window
+        self._until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, user_id: Optional[str]) -> None:
+        if not user_id or self.window <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._until[str(user_id)] = now + self.window
+            if len(self._until) > _PRUNE_THRESHOLD:
+                self._until = {key: until for key, until in self._until.items() if until > now}
+
+    def active(self, user_id: Optional[str]) -> bool:
+        if not user_id:
+            return False
+        return self._until.get(str(user_id), 0) > time.monotonic()
+
+
+replica_monitor = ReplicaMonitor(get_replica_engine)
+recent_writes = RecentWrites()
+
+
+def record_write(user_id: Optional[str]) -> None:
+    """Keep this user's reads on the primary for a while.
+
+    ORM writes of rows with a user_id are recorded automatically on commit;
+    call this for writes that don't carry one (Core updates, messages).
+    """
+    recent_writes.record(user_id)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_written_users(session, flush_context):
+    users = session.info.setdefault("written_users", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        user_id = getattr(obj, "user_id", None)
+        if user_id is None and isinstance(obj, User):
+            user_id = obj.id
+        if user_id is not None:
+            users.add(user_id)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _record_written_users(session):
+    for user_id in session.info.pop("written_users", ()):
+        record_write(user_id)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _forget_written_users(session):
+    session.info.pop("written_users", None)
+
+
+def _token_user_id(request: Request) -> Optional[str]:
+    # Only picks a database; get_current_user still verifies the token
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return jwt.get_unverified_claims(token).get("user_id")
+    except JWTError:
+        return None
+
+
+def use_replica(user_id: Optional[str]) -> bool:
+    if get_replica_engine() is None or recent_writes.active(user_id):
+        return False
+    return replica_monitor.usable()
+
+
+def open_read_session(user_id: Optional[str]) -> Session:
+    """A new session for a read that outlives the request's own, e.g. a streamed export. The caller closes it."""
+    return ReplicaSessionLocal() if use_replica(user_id) else SessionLocal()
+
+
+def get_read_db(request: Request, db: Session = Depends(get_db)):
+    """Session for read-only endpoints: the replica when it is safe, else the request's primary session."""
+    if not use_replica(_token_user_id(request)):
+        yield db
+        return
+
+    replica = ReplicaSessionLocal()
+    try:
+        yield replica
+    finally:
+        replica.close()
+
+
+if __name__ == "__main__":
+    if get_replica_engine() is None:
+        print("DATABASE_REPLICA_URL is not set")
+    else:
+        print(f"Replica usable: {replica_monitor.check()}")
@@ -0,0 +1,268 @@
+# python3 -m app.database.search
+import html
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from loguru import logger
+from sqlalchemy import Float, bindparam, column, event, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session, undefer
+
+from app.database.models import SavedStrategy, Message
+from app.database.types import NIL_KEY, UUIDKey
+
+# Full-text search over saved strategies and chat messages.
+#
+# Postgres: a tsvector column on each source table with a GIN index.
+# SQLite: an FTS5 table per source table sharing the source row's rowid.
+#
+# Both are kept in sync by ORM events from the plaintext values, so the
+# search index doesn't depend on how the source columns are stored.
+
+BATCH_SIZE = 500
+
+
+# Raw SQL needs the key type spelled out so ids are bound/read like the ORM does
+def _keyed(sql: str, *names: str):
+    return text(sql).bindparams(*[bindparam(name, type_=UUIDKey()) for name in names])
+
+
+def _strategy_text(strategy: SavedStrategy) -> str:
+    return " ".join(filter(None, [strategy.title, strategy.business_name, strategy.industry, strategy.content_text]))
+
+
+def _message_text(message: Message) -> str:
+    return message.content or ""
+
+
+# model -> (table name, function building the indexed text)
+SEARCH_SOURCES: Dict[type, Tuple[str, Callable[[Any], str]]] = {
+    SavedStrategy: ("saved_strategies", _strategy_text),
+    Message: ("messages", _message_text),
+}
+
+
+def _index_row(connection: Connection, table: str, row_id: str, body: str) -> None:
+    if connection.dialect.name == "postgresql":
+        connection.execute(
+            _keyed(f"UPDATE {table} SET search_vector = to_tsvector('english', :body) WHERE id = :id", "id"),
+            {"body": body, "id": row_id},
+        )
+    elif connection.dialect.name == "sqlite":
+        rowid = f"(SELECT rowid FROM {table} WHERE id = :id)"
+        connection.execute(_keyed(f"DELETE FROM {table}_fts WHERE rowid = {rowid}", "id"), {"id": row_id})
+        connection.execute(_keyed(f"INSERT INTO {table}_fts (rowid, body) VALUES ({rowid}, :body)", "id"), {"body": body, "id": row_id})
+
+
+def index_rows(connection: Connection, table: str, rows: List[Tuple[str, str]]) -> None:
+    """Index (id, text) pairs written with Core inserts, which the ORM events below don't see."""
+    if not rows:
+        return
+    params = [{"id": row_id, "body": body} for row_id, body in rows]
+    if connection.dialect.name == "postgresql":
+        connection.execute(
+            _keyed(f"UPDATE {table} SET search_vector = to_tsvector('english', :body) WHERE id = :id", "id"),
+            params,
+        )
+    elif connection.dialect.name == "sqlite":
+        # New rows have no FTS row to replace
+        connection.execute(
+            _keyed(f"INSERT INTO {table}_fts (rowid, body) VALUES ((SELECT rowid FROM {table} WHERE id = :id), :body)", "id"),
+            params,
+        )
+
+
+def _unindex_row(connection: Connection, table: str, row_id: str) -> None:
+    # Postgres drops the tsvector together with the row
+    if connection.dialect.name == "sqlite":
+        connection.execute(
+            _keyed(f"DELETE FROM {table}_fts WHERE rowid = (SELECT rowid FROM {table} WHERE id = :id)", "id"),
+            {"id": row_id},
+        )
+
+
+def _register_events(model: type, table: str, build_text: Callable[[Any], str]) -> None:
+    def after_write(mapper, connection, target):
+        _index_row(connection, table, target.id, build_text(target))
+
+    # The SQLite FTS row is located through the source rowid, so it has to go
+    # before the source row does
+    def before_delete(mapper, connection, target):
+        _unindex_row(connection, table, target.id)
+
+    event.listen(model, "after_insert", after_write)
+    event.listen(model, "after_update", after_write)
+    event.listen(model, "before_delete", before_delete)
+
+
+for _model, (_table, _build_text) in SEARCH_SOURCES.items():
+    _register_events(_model, _table, _build_text)
+
+
+# Creates the search columns/tables if missing. Safe to run on every startup.
+# Existing rows are indexed afterwards, by index_existing_rows.
+def ensure_search_schema(engine: Engine) -> None:
+    dialect = engine.dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        logger.warning(f"Full-text search is not supported on {dialect}")
+        return
+
+    for table, _ in SEARCH_SOURCES.values():
+        with engine.begin() as connection:
+            if dialect == "postgresql":
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector"))
+                connection.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{table}_search_vector ON {table} USING GIN (search_vector)"
+                ))
+            else:
+                connection.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(body, tokenize = 'porter unicode61')"
+                ))
+
+
+def _unindexed_predicate(dialect: str, table: str) -> str:
+    if dialect == "postgresql":
+        return "search_vector IS NULL"
+    return f"rowid NOT IN (SELECT rowid FROM {table}_fts)"
+
+
+def _index_table(engine: Engine, model: type, table: str, build_text: Callable[[Any], str], batch_size: int, pause: float) -> int:
+    pending = _keyed(
+        f"SELECT id FROM {table} WHERE id > :last_id AND {_unindexed_predicate(engine.dialect.name, table)} "
+        f"ORDER BY id LIMIT :limit",
+        "last_id"
+    ).columns(column("id", UUIDKey()))
+    last_id = NIL_KEY
+    total = 0
+
+    while True:
+        with Session(engine) as session, session.begin():
+            ids = [row[0] for row in session.execute(pending, {"last_id": last_id, "limit": batch_size})]
+            if not ids:
+                return total
+            connection = session.connection()
+            for row in session.query(model).options(undefer("*")).filter(model.id.in_(ids)):
+                _index_row(connection, table, row.id, build_text(row))
+
+        last_id = ids[-1]
+        total += len(ids)
+        logger.debug(f"Indexed {total} {table} rows for full-text search")
+        time.sleep(pause)
+
+
+# Indexes rows written before search existed in small batches, each in its
+# own transaction, pausing between batches so it can run next to live traffic
+def index_existing_rows(engine: Engine, batch_size: int = BATCH_SIZE, pause: float = 0.05) -> Dict[str, int]:
+    results = {}
+    if engine.dialect.name not in ("postgresql", "sqlite"):
+        return results
+    for model, (table, build_text) in SEARCH_SOURCES.items():
+        results[table] = _index_table(engine, model, table, build_text, batch_size, pause)
+        if results[table]:
+            logger.info(f"Indexed {results[table]} existing {table} rows for full-text search")
+    return results
+
+
+def start_background_indexing(engine: Engine, batch_size: int = BATCH_SIZE, pause: float = 0.05) -> threading.Thread:
+    def run():
+        try:
+            index_existing_rows(engine, batch_size, pause)
+        except Exception as e:
+            logger.error(f"Background search indexing failed: {str(e)}")
+
+    thread = threading.Thread(target=run, name="index-existing-rows", daemon=True)
+    thread.start()
+    return thread
+
+
+# Turns free text into an FTS5 query: every term quoted, all terms required
+def _fts5_query(query: str) -> str:
+    terms = re.findall(r"\w+", query)
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+# Returns [(id, rank)] for the user's matching rows, best first.
+# Ranks are comparable across sources of the same dialect (higher is better).
+def search_ids(db: Session, model: type, user_id: str, query: str, limit: int) -> List[Tuple[str, float]]:
+    table = SEARCH_SOURCES[model][0]
+    dialect = db.get_bind().dialect.name
+
+    # Messages are owned through their conversation
+    if model is Message:
+        owner_join = "JOIN conversations c ON c.id = t.conversation_id"
+        owner = "c.user_id"
+    else:
+        owner_join = ""
+        owner = "t.user_id"
+
+    if dialect == "postgresql":
+        sql = f"""
+            SELECT t.id, ts_rank_cd(t.search_vector, q) AS rank
+            FROM {table} t {owner_join}, websearch_to_tsquery('english', :query) q
+            WHERE {owner} = :user_id AND t.search_vector @@ q
+            ORDER BY rank DESC
+            LIMIT :limit
+        """
+        params = {"query": query, "user_id": user_id, "limit": limit}
+    elif dialect == "sqlite":
+        fts_query = _fts5_query(query)
+        if not fts_query:
+            return []
+        # bm25() is lower-is-better, so flip it
+        sql = f"""
+            SELECT t.id, -bm25({table}_fts) AS rank
+            FROM {table}_fts JOIN {table} t ON t.rowid = {table}_fts.rowid {owner_join}
+            WHERE {table}_fts MATCH :query AND {owner} = :user_id
+            ORDER BY rank DESC
+            LIMIT :limit
+        """
+        params = {"query": fts_query, "user_id": user_id, "limit": limit}
+    else:
+        return []
+
+    statement = _keyed(sql, "user_id").columns(column("id", UUIDKey()), column("rank", Float()))
+    return [(row[0], float(row[1])) for row in db.execute(statement, params)]
+
+
+# Crude suffix stripping so "growing" still highlights "grow"/"growth",
+# roughly following the stemmed matches the index found
+def _stem_prefix(term: str) -> str:
+    for suffix in ("ing", "ed", "es", "ly", "s"):
+        if term.lower().endswith(suffix) and len(term) - len(suffix) >= 3:
+            return term[:-len(suffix)]
+    return term
+
+
+# Builds an HTML-escaped snippet around the first match with <mark> highlights
+def highlight(content: str, query: str, width: int = 160) -> str:
+    terms = [re.escape(_stem_prefix(term)) for term in re.findall(r"\w+", query)]
+    if not content:
+        return ""
+    if not terms:
+        return html.escape(content[:width])
+
+    pattern = re.compile(r"\b(" + "|".join(terms) + r")\w*", re.IGNORECASE)
+    first = pattern.search(content)
+    start = max(0, first.start() - width // 3) if first else 0
+    end = min(len(content), start + width)
+
+    snippet = content[start:end]
+    parts = []
+    position = 0
+    for match in pattern.finditer(snippet):
+        parts.append(html.escape(snippet[position:match.start()]))
+        parts.append(f"<mark>{html.escape(match.group(0))}</mark>")
+        position = match.end()
+    parts.append(html.escape(snippet[position:]))
+
+    prefix = "..." if start > 0 else ""
+    suffix = "..." if end < len(content) else ""
+    return prefix + "".join(parts) + suffix
+
+
+if __name__ == "__main__":
+    from app.database.database import engine
+    ensure_search_schema(engine)
+    print(index_existing_rows(engine))
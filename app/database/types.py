@@ -0,0 +1,170 @@
+# python3 -m app.database.types
+import os
+import secrets
+import threading
+import time
+import uuid
+
+import zstandard
+from sqlalchemy import JSON, LargeBinary
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy.types import TypeDecorator
+
+# Values at least this many bytes long are compressed
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "512"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "3"))
+
+# First byte of every stored value says how the rest is encoded
+CODEC_RAW = b"\x00"
+CODEC_ZSTD = b"\x01"
+
+# zstd contexts aren't thread-safe, so keep one pair per thread
+_local = threading.local()
+
+
+def _compressor() -> zstandard.ZstdCompressor:
+    if not hasattr(_local, "compressor"):
+        _local.compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+    return _local.compressor
+
+
+def _decompressor() -> zstandard.ZstdDecompressor:
+    if not hasattr(_local, "decompressor"):
+        _local.decompressor = zstandard.ZstdDecompressor()
+    return _local.decompressor
+
+
+def encode_text(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    if len(raw) >= COMPRESSION_MIN_BYTES:
+        compressed = _compressor().compress(raw)
+        if len(compressed) < len(raw):
+            return CODEC_ZSTD + compressed
+    return CODEC_RAW + raw
+
+
+def decode_text(value) -> str:
+    # Rows written before the column was compressed come back as plain text on SQLite
+    if isinstance(value, str):
+        return value
+    value = bytes(value)
+    codec, payload = value[:1], value[1:]
+    if codec == CODEC_ZSTD:
+        return _decompressor().decompress(payload).decode("utf-8")
+    if codec == CODEC_RAW:
+        return payload.decode("utf-8")
+    raise ValueError(f"Unknown text codec tag: {codec!r}")
+
+
+class CompressedText(TypeDecorator):
+    """Text stored as codec-tagged bytes, zstd-compressed above a size threshold.
+
+    Python code always sees str; only the stored representation changes.
+    Values are decompressed when the column is loaded, so queries that don't
+    select the column never pay for it.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return encode_text(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decode_text(value)
+
+
+# Never generated, so it matches no row; stands in for ids that aren't UUIDs
+NIL_KEY = "00000000-0000-0000-0000-000000000000"
+
+_uuid7_lock = threading.Lock()
+_uuid7_last_ms = 0
+_uuid7_counter = 0
+
+
+def uuid7() -> uuid.UUID:
+    """Time-ordered UUID (RFC 9562 version 7).
+
+    48-bit millisecond timestamp, then a 12-bit counter that keeps ids from
+    the same millisecond increasing within this process, then random bits.
+    New keys land at the right edge of the index instead of random pages.
+    """
+    global _uuid7_last_ms, _uuid7_counter
+    with _uuid7_lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms > _uuid7_last_ms:
+            _uuid7_last_ms = now_ms
+            # Random start, leaving room to count up within the millisecond
+            _uuid7_counter = secrets.randbits(11)
+        else:
+            _uuid7_counter += 1
+            if _uuid7_counter > 0xFFF:
+                _uuid7_last_ms += 1
+                _uuid7_counter = 0
+        timestamp, counter = _uuid7_last_ms, _uuid7_counter
+
+    value = (
+        (timestamp & 0xFFFF_FFFF_FFFF) << 80
+        | 0x7 << 76
+        | counter << 64
+        | 0b10 << 62
+        | secrets.randbits(62)
+    )
+    return uuid.UUID(int=value)
+
+
+def _as_uuid(value) -> uuid.UUID:
+    if isinstance(value, uuid.UUID):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)) and len(value) == 16:
+        return uuid.UUID(bytes=bytes(value))
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return uuid.UUID(NIL_KEY)
+
+
+class UUIDKey(TypeDecorator):
+    """UUID primary/foreign key: native uuid on Postgres, 16 bytes elsewhere.
+
+    Python code and the API always see the canonical string form. Strings
+    that aren't UUIDs (e.g. a mistyped id in a URL) are bound as NIL_KEY, so
+    lookups find nothing instead of failing.
+    """
+
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(UUID(as_uuid=False))
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        key = _as_uuid(value)
+        return str(key) if dialect.name == "postgresql" else key.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        # Postgres returns strings; so does SQLite for rows not converted yet
+        if isinstance(value, str):
+            return value
+        return str(_as_uuid(value))
+
+
+# Structured JSON documents: JSONB on Postgres, JSON elsewhere. None is stored as SQL NULL.
+JSONDocument = JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql")
+
+
+if __name__ == "__main__":
+    sample = "Grow your Instagram following with consistent posting. " * 40
+    encoded = encode_text(sample)
+    print(f"{len(sample)} -> {len(encoded)} bytes, round trip ok: {decode_text(encoded) == sample}")
+    print([str(uuid7()) for _ in range(3)])
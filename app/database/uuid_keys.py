@@ -0,0 +1,209 @@
+# python3 -m app.database.uuid_keys
+import time
+import uuid
+from typing import Dict, List
+
+from loguru import logger
+from sqlalchemy import Table, text
+from sqlalchemy.engine import Engine
+
+from app.database.database import Base
+from app.database.types import UUIDKey
+
+# Moves id and foreign key columns from uuid strings to UUIDKey storage.
+#
+# SQLite: key values become 16-byte blobs in place, in one transaction at
+# startup. Rowids don't change, so the FTS tables stay valid.
+#
+# Postgres: varchar columns become native uuid without blocking traffic.
+# The app binds keys as strings, which works against either column type, so
+# this can run next to live traffic: python3 -m app.database.uuid_keys
+#   1. prepare: add a uuid shadow column per key column, kept in sync by a trigger
+#   2. backfill: fill the shadow columns in small batches
+#   3. index: build the new primary key indexes concurrently
+#   4. swap: one short transaction replaces the old columns with the shadows
+#   5. finish: validate foreign keys and rebuild secondary indexes concurrently
+#
+# Existing rows keep their (random) uuid4 values; only new rows are time-ordered.
+
+BATCH_SIZE = 1000
+
+
+def key_columns() -> Dict[Table, List[str]]:
+    """Every UUIDKey column, grouped by table, referenced tables first."""
+    columns = {}
+    for table in Base.metadata.sorted_tables:
+        names = [column.name for column in table.columns if isinstance(column.type, UUIDKey)]
+        if names:
+            columns[table] = names
+    return columns
+
+
+def _uuid_bytes(value):
+    try:
+        return uuid.UUID(value).bytes
+    except (TypeError, ValueError):
+        return value
+
+
+def convert_sqlite_keys(engine: Engine) -> int:
+    """Rewrite text keys as 16-byte blobs. Returns the number of values converted."""
+    total = 0
+    with engine.begin() as connection:
+        connection.connection.driver_connection.create_function("uuid_bytes", 1, _uuid_bytes, deterministic=True)
+        for table, names in key_columns().items():
+            for name in names:
+                total += connection.execute(text(
+                    f"UPDATE {table.name} SET {name} = uuid_bytes({name}) WHERE typeof({name}) = 'text'"
+                )).rowcount
+    if total:
+        logger.info(f"Converted {total} text keys to binary UUIDs")
+    return total
+
+
+def _pending_postgres_columns(engine: Engine) -> Dict[Table, List[str]]:
+    pending = {}
+    with engine.connect() as connection:
+        for table, names in key_columns().items():
+            varchar = [name for name in names if connection.execute(text(
+                "SELECT data_type FROM information_schema.columns WHERE table_name = :table AND column_name = :column"
+            ), {"table": table.name, "column": name}).scalar() == "character varying"]
+            if varchar:
+                pending[table] = varchar
+    return pending
+
+
+# Called from run_migrations. Cheap when there is nothing to do.
+def ensure_uuid_keys(engine: Engine) -> None:
+    if engine.dialect.name == "sqlite":
+        convert_sqlite_keys(engine)
+    elif engine.dialect.name == "postgresql" and _pending_postgres_columns(engine):
+        # Too slow for startup on a large database; see the steps above
+        logger.warning("Key columns are still varchar; run python3 -m app.database.uuid_keys to convert them online")
+
+
+def prepare_postgres(engine: Engine, pending: Dict[Table, List[str]]) -> None:
+    with engine.begin() as connection:
+        for table, names in pending.items():
+            assignments = []
+            for name in names:
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {name}_uuid uuid"))
+                assignments.append(f"NEW.{name}_uuid := NEW.{name}::uuid;")
+            connection.execute(text(
+                f"CREATE OR REPLACE FUNCTION {table.name}_uuid_sync() RETURNS trigger AS $$ "
+                f"BEGIN {' '.join(assignments)} RETURN NEW; END $$ LANGUAGE plpgsql"
+            ))
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {table.name}_uuid_sync ON {table.name}"))
+            connection.execute(text(
+                f"CREATE TRIGGER {table.name}_uuid_sync BEFORE INSERT OR UPDATE ON {table.name} "
+                f"FOR EACH ROW EXECUTE FUNCTION {table.name}_uuid_sync()"
+            ))
+
+
+def backfill_postgres(engine: Engine, pending: Dict[Table, List[str]], batch_size: int = BATCH_SIZE, pause: float = 0.05) -> None:
+    for table, names in pending.items():
+        missing = " OR ".join(f"({name}_uuid IS NULL AND {name} IS NOT NULL)" for name in names)
+        assignments = ", ".join(f"{name}_uuid = {name}::uuid" for name in names)
+        total = 0
+        while True:
+            with engine.begin() as connection:
+                updated = connection.execute(text(
+                    f"UPDATE {table.name} SET {assignments} "
+                    f"WHERE ctid IN (SELECT ctid FROM {table.name} WHERE {missing} LIMIT :limit)"
+                ), {"limit": batch_size}).rowcount
+            if not updated:
+                break
+            total += updated
+            logger.debug(f"Backfilled {total} rows in {table.name}")
+            time.sleep(pause)
+        logger.info(f"Backfilled uuid keys for {total} rows in {table.name}")
+
+
+def index_postgres(engine: Engine, pending: Dict[Table, List[str]]) -> None:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for table, names in pending.items():
+            if "id" not in names:
+                continue
+            # A validated CHECK lets SET NOT NULL skip the table scan during the swap
+            connection.execute(text(
+                f"ALTER TABLE {table.name} DROP CONSTRAINT IF EXISTS {table.name}_id_uuid_not_null"
+            ))
+            connection.execute(text(
+                f"ALTER TABLE {table.name} ADD CONSTRAINT {table.name}_id_uuid_not_null "
+                f"CHECK (id_uuid IS NOT NULL) NOT VALID"
+            ))
+            connection.execute(text(f"ALTER TABLE {table.name} VALIDATE CONSTRAINT {table.name}_id_uuid_not_null"))
+            connection.execute(text(
+                f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {table.name}_id_uuid_key ON {table.name} (id_uuid)"
+            ))
+
+
+def swap_postgres(engine: Engine, pending: Dict[Table, List[str]]) -> None:
+    with engine.begin() as connection:
+        connection.execute(text("SET LOCAL lock_timeout = '5s'"))
+        for table, names in pending.items():
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {table.name}_uuid_sync ON {table.name}"))
+            connection.execute(text(f"DROP FUNCTION IF EXISTS {table.name}_uuid_sync()"))
+            for name in names:
+                # Rows written between the backfill and the trigger drop
+                connection.execute(text(
+                    f"UPDATE {table.name} SET {name}_uuid = {name}::uuid WHERE {name}_uuid IS NULL AND {name} IS NOT NULL"
+                ))
+                # CASCADE also drops the old primary key and the foreign keys and indexes using it
+                connection.execute(text(f"ALTER TABLE {table.name} DROP COLUMN {name} CASCADE"))
+                connection.execute(text(f"ALTER TABLE {table.name} RENAME COLUMN {name}_uuid TO {name}"))
+            if "id" in names:
+                connection.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN id SET NOT NULL"))
+                connection.execute(text(f"ALTER TABLE {table.name} DROP CONSTRAINT {table.name}_id_uuid_not_null"))
+                connection.execute(text(
+                    f"ALTER TABLE {table.name} ADD CONSTRAINT {table.name}_pkey PRIMARY KEY USING INDEX {table.name}_id_uuid_key"
+                ))
+
+        # Checked afterwards by finish_postgres, without blocking writes
+        for table in pending:
+            for column in table.columns:
+                for foreign_key in column.foreign_keys:
+                    target = foreign_key.column
+                    connection.execute(text(
+                        f"ALTER TABLE {table.name} ADD CONSTRAINT {table.name}_{column.name}_fkey "
+                        f"FOREIGN KEY ({column.name}) REFERENCES {target.table.name} ({target.name}) NOT VALID"
+                    ))
+
+
+def finish_postgres(engine: Engine, pending: Dict[Table, List[str]]) -> None:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for table, names in pending.items():
+            for column in table.columns:
+                if column.foreign_keys:
+                    connection.execute(text(f"ALTER TABLE {table.name} VALIDATE CONSTRAINT {table.name}_{column.name}_fkey"))
+            for index in table.indexes:
+                index_columns = [c.name for c in index.columns]
+                if set(index_columns) & set(names):
+                    unique = "UNIQUE " if index.unique else ""
+                    connection.execute(text(
+                        f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index.name} "
+                        f"ON {table.name} ({', '.join(index_columns)})"
+                    ))
+
+
+def migrate_postgres_keys(engine: Engine, batch_size: int = BATCH_SIZE, pause: float = 0.05) -> None:
+    pending = _pending_postgres_columns(engine)
+    if not pending:
+        logger.info("Key columns already use uuid")
+        return
+    described = ", ".join(f"{table.name}({', '.join(names)})" for table, names in pending.items())
+    logger.info(f"Converting key columns: {described}")
+    prepare_postgres(engine, pending)
+    backfill_postgres(engine, pending, batch_size, pause)
+    index_postgres(engine, pending)
+    swap_postgres(engine, pending)
+    finish_postgres(engine, pending)
+    logger.info("Key columns converted to uuid")
+
+
+if __name__ == "__main__":
+    from app.database.database import engine
+    if engine.dialect.name == "postgresql":
+        migrate_postgres_keys(engine)
+    else:
+        ensure_uuid_keys(engine)
@@ -4,7 +4,9 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from app.routers import auth, ai, strategies
+from app.routers import auth, ai, strategies, search, chat_ws, export
+from app.middleware.compression import CompressionMiddleware
+from app.middleware.admission import AdmissionMiddleware, admission_controller
 import uvicorn
 from loguru import logger
 import sys
@@ -31,10 +33,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large JSON (strategies, conversation histories) and streamed responses
+app.add_middleware(CompressionMiddleware)
+
+# Shed low-priority requests with 503 before the worker is saturated
+app.add_middleware(AdmissionMiddleware, controller=admission_controller)
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(ai.router)
 app.include_router(strategies.router)
+app.include_router(search.router)
+app.include_router(chat_ws.router)
+app.include_router(export.router)
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
@@ -56,6 +67,61 @@ async def log_requests(request: Request, call_next):
             }
         )
 
+@app.on_event("startup")
+def prepare_database():
+    """Apply pending schema updates, unless app.server already did before starting the workers."""
+    import os
+    if os.getenv("MIGRATE_ON_STARTUP", "true").lower() != "true":
+        return
+    from app.database import migrations
+    from app.database.database import get_engine
+    # Failing here fails the startup, rather than serving against a half-migrated schema
+    migrations.prepare_database(get_engine())
+
+@app.on_event("startup")
+def warm_up_worker():
+    """Pay cold-start costs before the worker starts accepting connections."""
+    from app.services.lifecycle import warm_up
+    warm_up()
+
+@app.on_event("startup")
+async def start_background_tasks():
+    """Start periodic maintenance tasks."""
+    import asyncio
+    from app.services.lifecycle import install_drain_handlers
+    from app.database.database import SessionLocal
+    from app.services.drafts import run_draft_cleanup
+    from app.services.chat_writer import chat_writer
+    from app.services.archive import run_archival
+    from app.services.idempotency import run_idempotency_cleanup
+    app.state.draft_cleanup_task = asyncio.create_task(run_draft_cleanup(SessionLocal))
+    app.state.archival_task = asyncio.create_task(run_archival(SessionLocal))
+    app.state.idempotency_cleanup_task = asyncio.create_task(run_idempotency_cleanup(SessionLocal))
+    if admission_controller is not None:
+        app.state.loop_lag_task = asyncio.create_task(admission_controller.monitor_loop_lag())
+    install_drain_handlers()
+    if chat_writer is not None:
+        chat_writer.start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    """Cancel periodic maintenance tasks."""
+    from app.services.chat_writer import chat_writer
+    for name in ("draft_cleanup_task", "archival_task", "idempotency_cleanup_task", "loop_lag_task"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    # Queued chat turns are written before the process exits
+    if chat_writer is not None:
+        await chat_writer.stop()
+
+@app.on_event("shutdown")
+def persist_caches():
+    """Flush in-process caches to disk on shutdown."""
+    from app.services.services import chat_response_cache
+    if chat_response_cache is not None:
+        chat_response_cache.save()
+
 @app.get("/", tags=["Welcome"])
 async def root():
     """Welcome to Aspire!"""
@@ -94,7 +160,45 @@ async def health_check():
         "openai_api": openai_status
     }
 
+@app.get("/health/live", tags=["System"])
+async def liveness():
+    """Liveness probe: the process is up and its event loop is running."""
+    return {"status": "alive"}
+
+def _ping_database() -> None:
+    from sqlalchemy import text
+    from app.database.database import get_engine
+    with get_engine().connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+@app.get("/health/ready", tags=["System"])
+async def readiness():
+    """Readiness probe: 503 while the database is unreachable or the worker is shedding load or draining."""
+    import asyncio
+    from app.services.lifecycle import is_draining
+    if is_draining():
+        return JSONResponse(status_code=503, content={"status": "draining"})
+
+    try:
+        # In a thread: a slow database would otherwise stall the loop (and raise the lag admission sheds on)
+        await asyncio.to_thread(_ping_database)
+    except Exception as e:
+        logger.error(f"Readiness check failed, database unreachable: {str(e)}")
+        return JSONResponse(status_code=503, content={"status": "unavailable", "database": "unreachable"})
+
+    if admission_controller is None:
+        return {"status": "ready"}
+    admission = admission_controller.stats()
+    if not admission_controller.ready():
+        return JSONResponse(
+            status_code=503,
+            content={"status": "overloaded", "admission": admission},
+            headers={"Retry-After": "5"}
+        )
+    return {"status": "ready", "admission": admission}
+
 if __name__ == "__main__":
+    # Development server with auto-reload; production uses python3 -m app.server
     logger.info("🌟 Starting Aspire API server...")
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
 
@@ -0,0 +1,185 @@
+# python3 -m app.middleware.admission
+import asyncio
+import json
+import os
+from typing import Dict, Optional
+
+from loguru import logger
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.services.lifecycle import is_draining
+
+# Load shedding. Requests fall into three classes, from first to last shed:
+#   strategy  POST /ai/generate-strategy
+#   chat      POST /ai/chatbot (and new chat WebSockets)
+#   read      everything else
+#
+# A class is saturated when its in-flight requests reach its limit or the
+# event loop lags behind by its threshold. A saturated class is refused with
+# 503 and Retry-After, and so is every class below it: once chat is
+# saturated, strategy generation is refused too, long before reads are.
+#
+# The limits are per worker. /health/ready reports the worker as not ready
+# while chat is being shed, so the load balancer routes around it until it
+# catches up. A draining worker sheds chat and strategy but still serves reads.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_IN_FLIGHT = {
+    "strategy": int(os.getenv("ADMISSION_MAX_STRATEGY", "16")),
+    "chat": int(os.getenv("ADMISSION_MAX_CHAT", "64")),
+    "read": int(os.getenv("ADMISSION_MAX_READ", "256")),
+}
+ADMISSION_MAX_LOOP_LAG_SECONDS = {
+    "strategy": float(os.getenv("ADMISSION_STRATEGY_MAX_LAG_SECONDS", "0.25")),
+    "chat": float(os.getenv("ADMISSION_CHAT_MAX_LAG_SECONDS", "0.5")),
+    "read": float(os.getenv("ADMISSION_READ_MAX_LAG_SECONDS", "1.0")),
+}
+# What a refused client is told to wait; lower-priority work backs off longer
+ADMISSION_RETRY_AFTER_SECONDS = {"strategy": 30, "chat": 10, "read": 2}
+
+# Lowest priority first
+PRIORITY = ("strategy", "chat", "read")
+
+LOOP_LAG_INTERVAL_SECONDS = 0.25
+# The measured lag is a decaying peak: a stall counts at once and fades over a few seconds
+LOOP_LAG_DECAY = 0.8
+
+# Never shed: health checks, docs and the landing page
+EXEMPT_PATHS = ("/health", "/docs", "/redoc", "/openapi.json")
+# Long polls spend most of their time idle, so they don't count as in flight
+UNCOUNTED_PATHS = ("/ai/sync",)
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """The route class of a request, or None if it is never shed."""
+    if path == "/" or path.startswith(EXEMPT_PATHS):
+        return None
+    if method == "POST" and path == "/ai/generate-strategy":
+        return "strategy"
+    if path in ("/ai/chatbot", "/ai/ws/chat"):
+        return "chat"
+    return "read"
+
+
+class AdmissionController:
+    """Counts in-flight requests per route class and decides which to refuse."""
+
+    def __init__(
+        self,
+        max_in_flight: Dict[str, int] = ADMISSION_MAX_IN_FLIGHT,
+        max_loop_lag: Dict[str, float] = ADMISSION_MAX_LOOP_LAG_SECONDS
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_loop_lag = max_loop_lag
+        self.in_flight = {route_class: 0 for route_class in PRIORITY}
+        self.shed = {route_class: 0 for route_class in PRIORITY}
+        self.loop_lag = 0.0
+
+    def saturated(self, route_class: str) -> bool:
+        return (
+            self.in_flight[route_class] >= self.max_in_flight[route_class]
+            or self.loop_lag >= self.max_loop_lag[route_class]
+        )
+
+    def shedding(self, route_class: str) -> bool:
+        """Whether this class is refused: it, or a class that outranks it, is saturated."""
+        if route_class != "read" and is_draining():
+            return True
+        return any(self.saturated(other) for other in PRIORITY[PRIORITY.index(route_class):])
+
+    def admit(self, route_class: str, counted: bool = True) -> bool:
+        # Runs on the event loop, so no lock is needed
+        if self.shedding(route_class):
+            self.shed[route_class] += 1
+            return False
+        if counted:
+            self.in_flight[route_class] += 1
+        return True
+
+    def release(self, route_class: str) -> None:
+        self.in_flight[route_class] -= 1
+
+    def ready(self) -> bool:
+        return not self.shedding("chat")
+
+    async def monitor_loop_lag(self, interval: float = LOOP_LAG_INTERVAL_SECONDS) -> None:
+        """Measure how late the event loop wakes up from a sleep. Runs until cancelled."""
+        loop = asyncio.get_running_loop()
+        overloaded = False
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - start - interval)
+            self.loop_lag = max(lag, self.loop_lag * LOOP_LAG_DECAY)
+            if self.ready() == overloaded:
+                overloaded = not overloaded
+                if overloaded:
+                    logger.warning(f"Overloaded, shedding chat and strategy requests: {self.stats()}")
+                else:
+                    logger.info("No longer overloaded")
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": dict(self.in_flight),
+            "loop_lag_seconds": round(self.loop_lag, 3),
+            "shedding": [route_class for route_class in PRIORITY if self.shedding(route_class)],
+            "shed_total": dict(self.shed),
+        }
+
+
+admission_controller = AdmissionController() if ADMISSION_ENABLED else None
+
+
+class AdmissionMiddleware:
+    """Refuses requests with 503 while their route class is being shed."""
+
+    def __init__(self, app: ASGIApp, controller: Optional[AdmissionController] = None):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.controller is None or scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        method = scope.get("method", "GET")
+        route_class = classify(method, scope["path"])
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        # Open WebSockets are mostly idle, so only the handshake is checked
+        counted = scope["type"] == "http" and scope["path"] not in UNCOUNTED_PATHS
+        if not self.controller.admit(route_class, counted):
+            logger.debug(f"Shedding {method} {scope['path']} ({route_class})")
+            if scope["type"] == "websocket":
+                await send({"type": "websocket.close", "code": 1013})
+            else:
+                await self._refuse(route_class, send)
+            return
+
+        if not counted:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route_class)
+
+    async def _refuse(self, route_class: str, send: Send) -> None:
+        retry_after = ADMISSION_RETRY_AFTER_SECONDS[route_class]
+        body = json.dumps({"detail": f"The server is overloaded. Try again in {retry_after} seconds."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+if __name__ == "__main__":
+    controller = AdmissionController({"strategy": 1, "chat": 2, "read": 4}, ADMISSION_MAX_LOOP_LAG_SECONDS)
+    print([controller.admit("chat") for _ in range(3)], controller.stats())
@@ -0,0 +1,223 @@
+# python3 -m app.middleware.compression
+import os
+import zlib
+from typing import Dict, List, Optional
+
+import zstandard
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Brotli is optional; without it clients that prefer br get zstd or gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent as-is: the framing overhead and CPU aren't worth it
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_ZSTD_LEVEL = int(os.getenv("RESPONSE_ZSTD_LEVEL", "3"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "4"))
+
+# Streamed line by line; every chunk is flushed so clients see each event immediately
+STREAMING_CONTENT_TYPES = ("text/event-stream", "application/x-ndjson")
+
+# Already compressed, so compressing again only costs CPU
+INCOMPRESSIBLE_CONTENT_TYPES = (
+    "image/", "video/", "audio/", "font/woff",
+    "application/zip", "application/gzip", "application/zstd", "application/x-brotli",
+)
+
+
+class GzipEncoder:
+    encoding = "gzip"
+
+    def __init__(self, level: int = RESPONSE_GZIP_LEVEL):
+        # wbits=31 writes a gzip header rather than a raw zlib stream
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class ZstdEncoder:
+    encoding = "zstd"
+
+    def __init__(self, level: int = RESPONSE_ZSTD_LEVEL):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    encoding = "br"
+
+    def __init__(self, quality: int = RESPONSE_BROTLI_QUALITY):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+# Server preference when the client accepts several equally
+ENCODERS = {"zstd": ZstdEncoder, "gzip": GzipEncoder}
+if brotli is not None:
+    ENCODERS = {"zstd": ZstdEncoder, "br": BrotliEncoder, "gzip": GzipEncoder}
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick the best supported encoding from an Accept-Encoding header."""
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                continue
+        if name:
+            weights[name.strip()] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in ENCODERS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class CompressionMiddleware:
+    """Compresses responses with zstd, brotli or gzip, whichever the client prefers.
+
+    Regular responses are buffered until they reach minimum_size; smaller ones
+    go out untouched. SSE and NDJSON streams are compressed from the first
+    chunk and flushed after every chunk, so events aren't held back.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = RESPONSE_COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    def __init__(self, send: Send, encoding: str, minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message: Optional[Message] = None
+        self.buffer: List[bytes] = []
+        self.buffered_size = 0
+        self.encoder = None
+        self.streaming = False
+        self.passthrough = False
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "").lower()
+            self.passthrough = (
+                message["status"] < 200
+                or message["status"] in (204, 304)
+                or "content-encoding" in headers
+                or content_type.startswith(INCOMPRESSIBLE_CONTENT_TYPES)
+            )
+            self.streaming = content_type.startswith(STREAMING_CONTENT_TYPES)
+            if self.passthrough:
+                await self._send(message)
+            elif self.streaming:
+                await self._start(content_length=None)
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.encoder is not None:
+            data = self.encoder.compress(body)
+            data += self.encoder.flush() if more_body and self.streaming else b""
+            if not more_body:
+                data += self.encoder.finish()
+            await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
+            return
+
+        self.buffer.append(body)
+        self.buffered_size += len(body)
+
+        if not more_body:
+            raw = b"".join(self.buffer)
+            if self.buffered_size < self.minimum_size:
+                # Small response: send it exactly as the app produced it
+                await self._send(self.start_message)
+                await self._send({"type": "http.response.body", "body": raw})
+                return
+            encoder = ENCODERS[self.encoding]()
+            data = encoder.compress(raw) + encoder.finish()
+            await self._start(content_length=len(data))
+            await self._send({"type": "http.response.body", "body": data})
+            return
+
+        if self.buffered_size >= self.minimum_size:
+            # Large streamed response: compress what we have and keep going
+            await self._start(content_length=None)
+            data = self.encoder.compress(b"".join(self.buffer))
+            self.buffer = []
+            await self._send({"type": "http.response.body", "body": data, "more_body": True})
+
+    async def _start(self, content_length: Optional[int]) -> None:
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if content_length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(content_length)
+        # The compressed bytes differ from the identity ones, so a strong
+        # validator would be wrong; the weak form still matches on revalidation
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+        if self.encoder is None and content_length is None:
+            self.encoder = ENCODERS[self.encoding]()
+        await self._send(self.start_message)
+
+
+if __name__ == "__main__":
+    print(choose_encoding("gzip, deflate, br, zstd"), list(ENCODERS))
@@ -2,20 +2,59 @@
 # source .venv/bin/activate
 
 import json
-from typing import List, Dict
-
-from fastapi import APIRouter, Depends, HTTPException, status
+import os
+import time
+from datetime import datetime, timezone
+from typing import List, Dict, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
 from loguru import logger
 
 from app.database.database import get_db
-from app.database.models import User, Conversation, Message
+from app.database.replica import get_read_db, record_write
+from app.database.models import User, Conversation, ConversationArchive, Message, generate_uuid
+from app.database.partitions import message_time_floor
 from app.auth.utils import get_active_user
-from app.schemas.strategy import StrategyRequest, StrategyResponse
-from app.schemas.chat import ChatRequest, ChatResponse, ChatMessage
+from app.schemas.strategy import StrategyRequest, GeneratedStrategyResponse
+from app.schemas.chat import ChatRequest, ChatResponse, ChatMessage, SyncResponse
+from app.schemas.usage import UsageResponse, UsageDay, UsageTotals, RateLimitInfo
+from app.services.similarity import strategy_index
+from app.services.drafts import create_draft
+from app.services.etags import make_etag, etag_matches, not_modified, set_etag
+from app.services.archive import restore_conversation
+from app.services.chat_writer import ChatTurn, save_chat_turns, chat_writer
+from app.services.chat_sessions import chat_sessions, AFFINITY_HEADER
+from app.services.idempotency import (
+    run_idempotent,
+    IdempotencyClaim,
+    IdempotencyKeyMismatchError,
+    IdempotencyKeyInProgressError,
+    IDEMPOTENCY_KEY_MAX_LENGTH
+)
+from app.services.rate_limit import rate_limit, rate_limiter
+from app.services.usage import track_usage, record_usage, get_usage
+from app.services.deadlines import (
+    Deadline,
+    request_deadline,
+    run_with_deadline,
+    RequestAbandonedError,
+    ClientDisconnectedError,
+    CLIENT_CLOSED_REQUEST
+)
+from app.services.sync import (
+    fetch_changes,
+    sync_notifier,
+    InvalidCursorError,
+    SYNC_MAX_WAIT_SECONDS,
+    SYNC_POLL_INTERVAL_SECONDS
+)
 from app.services import (
     generate_business_strategy,
     generate_chatbot_response,
+    format_history,
     GeminiQuotaExceededError,
     GeminiAPIError,
     GeminiContentFilterError
@@ -27,48 +66,101 @@ router = APIRouter(
     responses={401: {"description": "Unauthorized"}},
 )
 
-@router.post("/generate-strategy", response_model=StrategyResponse)
+# Saved strategies scoring at least this much count as "already have one"
+STRATEGY_SIMILARITY_THRESHOLD = float(os.getenv("STRATEGY_SIMILARITY_THRESHOLD", "0.6"))
+
+def idempotency_errors(e: Exception) -> HTTPException:
+    if isinstance(e, IdempotencyKeyMismatchError):
+        return HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e), headers={"Retry-After": "1"})
+
+def abandoned_request_error(e: RequestAbandonedError) -> HTTPException:
+    if isinstance(e, ClientDisconnectedError):
+        return HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(e))
+    return HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+
+@router.post("/generate-strategy", response_model=GeneratedStrategyResponse, dependencies=[Depends(rate_limit("strategy"))])
 async def generate_strategy(
     strategy_request: StrategyRequest,
+    request: Request,
+    allow_similar: bool = Query(True, description="Set to false to get a 409 instead of generating when a similar saved strategy exists"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=IDEMPOTENCY_KEY_MAX_LENGTH),
+    deadline: Deadline = Depends(request_deadline("strategy")),
     current_user: User = Depends(get_active_user),
     db: Session = Depends(get_db)
 ):
     """
     Generate a business strategy using AI.
+
+    Send an Idempotency-Key header to make retries safe: a repeated key
+    returns the first response instead of generating again. X-Request-Timeout
+    (seconds) shortens the deadline; past it the request fails with 504 and
+    nothing is saved.
     """
     try:
-        logger.info(f"Generating strategy for {strategy_request.business_name}, user: {current_user.email}")
-        strategy = generate_business_strategy(strategy_request)
-
-       # Fix action_plan if it's a list of dicts
-        if isinstance(strategy.get('action_plan'), list):
-            new_action_plan = []
-            for step in strategy['action_plan']:
-                if isinstance(step, dict):
-                    # Format dict into a readable string
-                    formatted_step = f"Step {step.get('step')}: {step.get('action')} (Timeline: {step.get('timeline')}, Budget: {step.get('budget')})"
-                    new_action_plan.append(formatted_step)
-                else:
-                    new_action_plan.append(str(step))  # If already a string, just keep
-                strategy['action_plan'] = new_action_plan
-
-        # Fix resources similarly if needed (optional, depends on your model)
-        if isinstance(strategy.get('resources'), list):
-            new_resources = []
-            for res in strategy['resources']:
-                if isinstance(res, dict):
-                    name = res.get('type') or res.get('name') or "Unknown Resource"
-                    purpose = res.get('purpose') or f"Purpose for {name}"  # Default/fallback
-                    items = res.get('items') or []
-
-                    new_resources.append({
-                        "name": name,
-                        "purpose": purpose,
-                        "items": items
-                    })
-            strategy['resources'] = new_resources
-
-        return strategy
+        return await run_idempotent(
+            db, current_user.id, idempotency_key, "generate-strategy",
+            {"request": strategy_request, "allow_similar": allow_similar},
+            lambda claim: _generate_strategy(strategy_request, allow_similar, request, deadline, current_user, db, claim),
+            response_model=GeneratedStrategyResponse
+        )
+    except (IdempotencyKeyMismatchError, IdempotencyKeyInProgressError) as e:
+        raise idempotency_errors(e)
+
+async def _generate_strategy(
+    strategy_request: StrategyRequest,
+    allow_similar: bool,
+    request: Request,
+    deadline: Deadline,
+    current_user: User,
+    db: Session,
+    claim: Optional[IdempotencyClaim] = None
+):
+    user_id, user_email = current_user.id, current_user.email
+    if not allow_similar:
+        strategy_index.ensure_loaded(db, current_user.id)
+        matches = [
+            match for match in strategy_index.similar_to_request(current_user.id, strategy_request)
+            if match[1] >= STRATEGY_SIMILARITY_THRESHOLD
+        ]
+        similar = strategy_index.resolve(db, current_user.id, matches)
+        if similar:
+            logger.info(f"Skipping generation for {current_user.email}: {len(similar)} similar saved strategies")
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=jsonable_encoder({
+                    "message": "You already have saved strategies similar to this request.",
+                    "similar_strategies": similar
+                })
+            )
+
+    try:
+        logger.info(f"Generating strategy for {strategy_request.business_name}, user: {user_email}")
+        # Hand the pooled connection back before the slow LLM call
+        db.close()
+
+        # The service already returns a normalized StrategyResponse-shaped dict
+        usage = track_usage()
+        strategy = await run_with_deadline(request, deadline, generate_business_strategy, strategy_request)
+
+        # Keep the result server-side so it can be saved by generation_id;
+        # the usage and the idempotent response land in the same transaction
+        try:
+            record_usage(db, user_id, "strategy", usage)
+            draft = create_draft(
+                db, user_id, strategy_request.business_name, strategy_request.industry, strategy, usage.model,
+                commit=False
+            )
+            result = {**strategy, "generation_id": draft.id, "model": usage.model}
+            if claim is not None:
+                claim.store(db, result)
+            db.commit()
+            return result
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to store strategy draft: {str(e)}")
+
+        return {**strategy, "model": usage.model}
 
     except GeminiQuotaExceededError as e:
         logger.error(f"Gemini quota exceeded or rate limited: {e}")
@@ -77,6 +169,10 @@ async def generate_strategy(
             detail="Gemini API quota exceeded or rate limited. This may be due to free tier limitations. Please try again later."
         )
 
+    except RequestAbandonedError as e:
+        logger.warning(f"Strategy generation abandoned for {user_email}: {e}")
+        raise abandoned_request_error(e)
+
     except GeminiContentFilterError as e:
         logger.error(f"Gemini content filter blocked the request: {e}")
         raise HTTPException(
@@ -121,22 +217,62 @@ async def generate_strategy(
             detail="Failed to generate strategy. Please try again later."
         )
 
-@router.post("/chatbot", response_model=ChatResponse)
+@router.post("/chatbot", response_model=ChatResponse, dependencies=[Depends(rate_limit("chat"))])
 async def chatbot(
     chat_request: ChatRequest,
+    request: Request,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=IDEMPOTENCY_KEY_MAX_LENGTH),
+    deadline: Deadline = Depends(request_deadline("chat")),
     current_user: User = Depends(get_active_user),
     db: Session = Depends(get_db)
 ):
     """
     Chat with the AI business consultant.
+
+    Send an Idempotency-Key header to make retries safe: a repeated key
+    returns the first reply instead of adding the messages again. X-Request-Timeout
+    (seconds) shortens the deadline; past it the request fails with 504 and
+    neither message is saved.
     """
     try:
-        conversation = None
+        return await run_idempotent(
+            db, current_user.id, idempotency_key, "chatbot", chat_request,
+            lambda claim: _chatbot(chat_request, request, response, deadline, current_user, db, claim),
+            response_model=ChatResponse
+        )
+    except (IdempotencyKeyMismatchError, IdempotencyKeyInProgressError) as e:
+        raise idempotency_errors(e)
+
+async def _chatbot(
+    chat_request: ChatRequest,
+    request: Request,
+    response: Response,
+    deadline: Deadline,
+    current_user: User,
+    db: Session,
+    claim: Optional[IdempotencyClaim] = None
+):
+    try:
+        # Read now: the session is closed (and may have committed) before these are used
+        user_id, user_email = current_user.id, current_user.email
+        history = None
+        new_title = None
 
         if chat_request.conversation_id:
-            conversation = db.query(Conversation).filter(
-                Conversation.id == chat_request.conversation_id,
-                Conversation.user_id == current_user.id
+            conversation_id = chat_request.conversation_id
+            # Turns still queued for write-behind must land before we read the history
+            if chat_writer is not None:
+                await chat_writer.wait_for(conversation_id)
+
+            conversation = db.query(
+                Conversation.id,
+                Conversation.created_at,
+                Conversation.updated_at,
+                Conversation.archived_at
+            ).filter(
+                Conversation.id == conversation_id,
+                Conversation.user_id == user_id
             ).first()
 
             if not conversation:
@@ -144,54 +280,85 @@ async def chatbot(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail="Conversation not found."
                 )
-        else:
-            # New conversation
-            conversation = Conversation(
-                user_id=current_user.id,
-                title=chat_request.message[:30] + "..." if len(chat_request.message) > 30 else chat_request.message
-            )
-            db.add(conversation)
-            db.commit()
-            db.refresh(conversation)
 
-        # Fetch conversation history
-        history = []
-        if conversation.id:
-            messages = db.query(Message).filter(
-                Message.conversation_id == conversation.id
-            ).order_by(Message.created_at).all()
+            if conversation.archived_at is not None:
+                restore_conversation(db, conversation_id)
+            elif chat_sessions is not None:
+                # Back-to-back turns reuse the live session instead of reloading the history
+                history = chat_sessions.get(conversation_id, user_id, conversation.updated_at)
 
-            for msg in messages:
-                history.append({"role": msg.role, "content": msg.content})
+            if history is None:
+                # Fetch conversation history; the time floor keeps Postgres to recent partitions
+                messages_query = db.query(Message.role, Message.content).filter(
+                    Message.conversation_id == conversation_id
+                )
+                floor = message_time_floor(conversation.created_at)
+                if floor is not None:
+                    messages_query = messages_query.filter(Message.created_at >= floor)
+                messages = messages_query.order_by(Message.created_at).all()
 
-        # Generate AI response
-        response_text = generate_chatbot_response(chat_request.message, history)
+                history = format_history([{"role": msg.role, "content": msg.content} for msg in messages])
+        else:
+            # New conversation; it is written together with the first messages
+            conversation_id = generate_uuid()
+            new_title = chat_request.message[:30] + "..." if len(chat_request.message) > 30 else chat_request.message
+            history = []
 
-        # Save user message
-        user_message = Message(
-            conversation_id=conversation.id,
-            content=chat_request.message,
-            role="user"
-        )
-        db.add(user_message)
+        # Hand the pooled connection back before the slow LLM call
+        db.close()
 
-        # Save AI response
-        ai_message = Message(
-            conversation_id=conversation.id,
-            content=response_text,
-            role="assistant"
+        # Generate AI response
+        usage = track_usage()
+        response_text = await run_with_deadline(request, deadline, generate_chatbot_response, chat_request.message, history)
+
+        chat_response = ChatResponse(message=response_text, conversation_id=conversation_id, model=usage.model)
+        turn = ChatTurn(
+            conversation_id=conversation_id,
+            user_id=user_id,
+            user_message=chat_request.message,
+            reply=response_text,
+            reply_at=datetime.now(timezone.utc),
+            new_title=new_title,
+            usage=usage,
+            idempotency=claim,
+            response=chat_response
         )
-        db.add(ai_message)
-
-        db.commit()
+        if chat_writer is not None:
+            written = chat_writer.submit(turn)
+            if claim is not None:
+                # The stored response commits with the turn; a retry mustn't see
+                # it before the turn lands, or miss that the write failed
+                await written
+        else:
+            # Conversation, both messages and the updated_at bump in one transaction
+            save_chat_turns(db, [turn])
+            sync_notifier.notify(user_id)
+
+        # The next turn's version check expects updated_at to be this reply's time
+        if chat_sessions is not None:
+            chat_sessions.put(
+                conversation_id,
+                user_id,
+                history + format_history([
+                    {"role": "user", "content": chat_request.message},
+                    {"role": "assistant", "content": response_text}
+                ]),
+                turn.reply_at
+            )
+        response.headers[AFFINITY_HEADER] = conversation_id
 
-        logger.info(f"Chatbot response generated for user {current_user.email}, conversation {conversation.id}")
+        logger.info(f"Chatbot response generated for user {user_email}, conversation {conversation_id}")
 
-        return ChatResponse(message=response_text, conversation_id=conversation.id)
+        return chat_response
 
     except HTTPException:
         raise 
 
+    except RequestAbandonedError as e:
+        # Neither message is saved, so a retry starts from the same history
+        logger.warning(f"Chatbot request abandoned for user {user_email}: {e}")
+        raise abandoned_request_error(e)
+
     except Exception as e:
         db.rollback()
         logger.error(f"Error in chatbot endpoint: {str(e)}")
@@ -200,26 +367,52 @@ async def chatbot(
             detail="Failed to process chatbot request. Please try again later."
         )
 
-@router.get("/conversations", response_model=List[Dict])
+@router.get("/conversations", response_model=List[Dict], dependencies=[Depends(rate_limit("ai"))])
 async def get_conversations(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get all conversations for the current user.
     """
     try:
-        conversations = db.query(Conversation).filter(
+        # Cheap version check first: idle clients get a 304 without the list query
+        version = db.query(
+            func.count(Conversation.id),
+            func.max(Conversation.updated_at),
+            func.max(Conversation.created_at)
+        ).filter(Conversation.user_id == current_user.id).one()
+        etag = make_etag("conversations", current_user.id, *version)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
+
+        # Only the latest message per conversation is loaded, in the same query
+        last_message_subquery = select(Message.content).where(
+            Message.conversation_id == Conversation.id
+        ).order_by(Message.created_at.desc()).limit(1).scalar_subquery()
+        # Archived conversations keep a preview next to the archive
+        archived_last_message = select(ConversationArchive.last_message).where(
+            ConversationArchive.conversation_id == Conversation.id
+        ).scalar_subquery()
+
+        conversations = db.query(
+            Conversation.id,
+            Conversation.title,
+            Conversation.created_at,
+            Conversation.updated_at,
+            Conversation.archived_at,
+            last_message_subquery.label("last_message"),
+            archived_last_message.label("archived_last_message")
+        ).filter(
             Conversation.user_id == current_user.id
         ).order_by(Conversation.updated_at.desc()).all()
 
         result = []
         for conv in conversations:
-            messages = db.query(Message).filter(
-                Message.conversation_id == conv.id
-            ).order_by(Message.created_at).all()
-
-            last_message = messages[-1].content if messages else ""
+            last_message = (conv.last_message if conv.archived_at is None else conv.archived_last_message) or ""
 
             result.append({
                 "id": conv.id,
@@ -238,20 +431,34 @@ async def get_conversations(
             detail="Failed to retrieve conversations."
         )
 
-@router.get("/conversations/{conversation_id}", response_model=List[ChatMessage])
+@router.get("/conversations/{conversation_id}", response_model=List[ChatMessage], dependencies=[Depends(rate_limit("ai"))])
 async def get_conversation_messages(
     conversation_id: str,
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db),
+    primary_db: Session = Depends(get_db)
 ):
     """
     Get all messages in a conversation.
     """
     try:
-        conversation = db.query(Conversation).filter(
+        # Ownership check and version in one query, before loading any messages
+        message_count = select(func.count(Message.id)).where(
+            Message.conversation_id == Conversation.id
+        ).scalar_subquery()
+        version_query = db.query(
+            Conversation.id,
+            Conversation.created_at,
+            Conversation.updated_at,
+            Conversation.archived_at,
+            message_count.label("message_count")
+        ).filter(
             Conversation.id == conversation_id,
             Conversation.user_id == current_user.id
-        ).first()
+        )
+        conversation = version_query.first()
 
         if not conversation:
             raise HTTPException(
@@ -259,15 +466,33 @@ async def get_conversation_messages(
                 detail="Conversation not found."
             )
 
-        messages = db.query(Message).filter(
+        # Opening an archived conversation brings its messages back. That is a
+        # write, so it and the rest of this request go through the primary.
+        if conversation.archived_at is not None:
+            db = primary_db
+            record_write(current_user.id)
+            restore_conversation(db, conversation_id)
+            conversation = version_query.with_session(db).first()
+
+        etag = make_etag("conversation", conversation.id, conversation.updated_at, conversation.message_count)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
+
+        messages_query = db.query(Message).filter(
             Message.conversation_id == conversation_id
-        ).order_by(Message.created_at).all()
+        )
+        floor = message_time_floor(conversation.created_at)
+        if floor is not None:
+            messages_query = messages_query.filter(Message.created_at >= floor)
+        messages = messages_query.order_by(Message.created_at).all()
 
         return [
             ChatMessage(
                 role=msg.role,
                 content=msg.content,
-                created_at=msg.created_at
+                created_at=msg.created_at,
+                model=msg.model
             ) for msg in messages
         ]
 
@@ -281,5 +506,92 @@ async def get_conversation_messages(
             detail="Failed to retrieve conversation messages."
         )
 
+@router.get("/sync", response_model=SyncResponse, dependencies=[Depends(rate_limit("ai"))])
+async def sync_changes(
+    since: Optional[str] = Query(None, description="Cursor from a previous sync; omit for a full sync"),
+    wait: float = Query(0, ge=0, le=SYNC_MAX_WAIT_SECONDS, description="Seconds to wait for changes before returning an empty result"),
+    current_user: User = Depends(get_active_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get conversations and messages that changed since the given cursor.
+    """
+    try:
+        deadline = time.monotonic() + wait
+        while True:
+            conversations, messages, cursor, has_more = fetch_changes(db, current_user.id, since)
+            remaining = deadline - time.monotonic()
+            if conversations or messages or remaining <= 0:
+                break
+            # End the transaction so the connection goes back to the pool while waiting
+            db.rollback()
+            await sync_notifier.wait(current_user.id, min(remaining, SYNC_POLL_INTERVAL_SECONDS))
+
+        return SyncResponse(
+            conversations=conversations,
+            messages=messages,
+            cursor=cursor,
+            has_more=has_more
+        )
+
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    except Exception as e:
+        logger.error(f"Error syncing conversations: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to sync conversations."
+        )
+
+@router.get("/usage", response_model=UsageResponse, dependencies=[Depends(rate_limit("ai"))])
+async def get_my_usage(
+    days: int = Query(30, ge=1, le=366),
+    current_user: User = Depends(get_active_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get the current user's AI usage per day and the state of their rate limits.
+    """
+    try:
+        rows = get_usage(db, current_user.id, days)
+        totals: Dict[str, UsageTotals] = {}
+        for row in rows:
+            total = totals.setdefault(row.kind, UsageTotals())
+            total.requests += row.requests
+            total.prompt_tokens += row.prompt_tokens
+            total.output_tokens += row.output_tokens
+
+        limits = {}
+        if rate_limiter is not None:
+            limits = {
+                bucket: RateLimitInfo(limit=state.limit, remaining=state.remaining, reset_seconds=state.reset_seconds)
+                for bucket, state in rate_limiter.status(current_user.id).items()
+            }
+
+        return UsageResponse(
+            days=[
+                UsageDay(
+                    day=row.day,
+                    kind=row.kind,
+                    requests=row.requests,
+                    prompt_tokens=row.prompt_tokens,
+                    output_tokens=row.output_tokens
+                ) for row in rows
+            ],
+            totals=totals,
+            limits=limits
+        )
+
+    except Exception as e:
+        logger.error(f"Error getting usage: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve usage."
+        )
+
 if __name__ == "__main__":
     print("AI Router script is running")
\ No newline at end of file
@@ -0,0 +1,416 @@
+# python3 -m app.routers.chat_ws
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Query, WebSocket, WebSocketDisconnect, status
+from loguru import logger
+
+from app.database.database import SessionLocal
+from app.database.models import User, Conversation, Message, generate_uuid
+from app.database.partitions import message_time_floor
+from app.auth.utils import decode_token
+from app.services.archive import restore_conversation
+from app.services.chat_writer import ChatTurn, save_chat_turns, chat_writer
+from app.services.chat_sessions import chat_sessions
+from app.services.rate_limit import rate_limiter
+from app.services.sync import sync_notifier
+from app.services.usage import track_usage
+from app.services.lifecycle import is_draining, track_work
+from app.services import (
+    format_history,
+    stream_chatbot_response,
+    GeminiQuotaExceededError,
+    GeminiContentFilterError
+)
+
+# Chat over one WebSocket: authenticated at connect, then any number of
+# turns. The socket is closed with 1008 when the token expires, or when a
+# message arrives after the user was deactivated. JSON text frames:
+#
+#   client -> {"type": "message", "id": "<client id>", "message": "...", "conversation_id": "..."}
+#             {"type": "cancel", "id": "<client id>"}
+#             {"type": "ping"} / {"type": "pong"}
+#   server -> {"type": "start", "id", "conversation_id"}
+#             {"type": "token", "id", "text"}            one per streamed chunk
+#             {"type": "done", "id", "conversation_id", "message", "model"}
+#             {"type": "cancelled", "id"}                cancelled turns are not saved
+#             {"type": "error", "id", "status", "detail"}
+#             {"type": "ping"} / {"type": "pong"}
+#
+# Binary frames close the socket with 1003.
+#
+# One generation runs at a time per connection. The connection keeps the
+# history of its current conversation, so follow-up turns don't touch the
+# database until the reply is saved. Turns added to that conversation from
+# elsewhere show up after switching conversations or reconnecting.
+#
+# An idle connection holds no database connection and no thread. The server
+# pings after WS_HEARTBEAT_SECONDS of silence and closes connections that
+# stay silent past WS_IDLE_TIMEOUT_SECONDS. Streaming is backpressured: the
+# Gemini reader waits while WS_STREAM_BUFFER chunks are unsent, and a client
+# that doesn't read for WS_SEND_TIMEOUT_SECONDS is disconnected.
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "5000"))
+WS_HEARTBEAT_SECONDS = float(os.getenv("WS_HEARTBEAT_SECONDS", "30"))
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "75"))
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+WS_STREAM_BUFFER = 32
+WS_MAX_MESSAGE_CHARS = 20_000
+
+router = APIRouter(
+    prefix="/ai",
+    tags=["AI Services"],
+)
+
+_open_connections = 0
+
+
+class TurnError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _authenticate(token: Optional[str]) -> Optional[Tuple[str, str, Optional[datetime]]]:
+    """(user id, email, token expiry) for a valid token of an active user."""
+    token_data = decode_token(token) if token else None
+    if token_data is None:
+        return None
+    db = SessionLocal()
+    try:
+        user = db.query(User.id, User.email, User.is_active).filter(User.id == token_data.user_id).first()
+        if user is None or not user.is_active:
+            return None
+        return user.id, user.email, token_data.expires_at
+    finally:
+        db.close()
+
+
+def _is_active(user_id: str) -> bool:
+    db = SessionLocal()
+    try:
+        return bool(db.query(User.is_active).filter(User.id == user_id).scalar())
+    finally:
+        db.close()
+
+
+def _load_conversation(user_id: str, conversation_id: str) -> List[Dict[str, Any]]:
+    """Ownership check and Gemini-formatted history, like the HTTP chatbot."""
+    db = SessionLocal()
+    try:
+        conversation = db.query(
+            Conversation.id,
+            Conversation.created_at,
+            Conversation.updated_at,
+            Conversation.archived_at
+        ).filter(
+            Conversation.id == conversation_id,
+            Conversation.user_id == user_id
+        ).first()
+        if not conversation:
+            raise TurnError(status.HTTP_404_NOT_FOUND, "Conversation not found.")
+
+        if conversation.archived_at is not None:
+            restore_conversation(db, conversation_id)
+        elif chat_sessions is not None:
+            history = chat_sessions.get(conversation_id, user_id, conversation.updated_at)
+            if history is not None:
+                return history
+
+        messages_query = db.query(Message.role, Message.content).filter(
+            Message.conversation_id == conversation_id
+        )
+        floor = message_time_floor(conversation.created_at)
+        if floor is not None:
+            messages_query = messages_query.filter(Message.created_at >= floor)
+        messages = messages_query.order_by(Message.created_at).all()
+        return format_history([{"role": msg.role, "content": msg.content} for msg in messages])
+    finally:
+        db.close()
+
+
+def _save_turn(turn: ChatTurn) -> None:
+    db = SessionLocal()
+    try:
+        save_chat_turns(db, [turn])
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class ChatConnection:
+    def __init__(self, websocket: WebSocket, user_id: str, user_email: str, expires_at: Optional[datetime] = None):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.user_email = user_email
+        # When the token the socket was opened with expires
+        self.expires_at = expires_at.timestamp() if expires_at is not None else None
+        self.last_seen = time.monotonic()
+        self._send_lock = asyncio.Lock()
+        # The conversation this connection is in, and its history
+        self.conversation_id: Optional[str] = None
+        self.history: Optional[List[Dict[str, Any]]] = None
+        # The running generation
+        self.generation: Optional[asyncio.Task] = None
+        self.generation_id: Optional[str] = None
+        self.cancelled: Optional[threading.Event] = None
+
+    async def send(self, frame: Dict[str, Any]) -> None:
+        # A client that stops reading is dropped instead of buffering for it
+        async with self._send_lock:
+            await asyncio.wait_for(self.websocket.send_text(json.dumps(frame)), WS_SEND_TIMEOUT_SECONDS)
+
+    async def _receive_text(self, timeout: float) -> Optional[str]:
+        """The next text frame; None after a binary frame has closed the socket."""
+        message = await asyncio.wait_for(self.websocket.receive(), timeout)
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE), message.get("reason"))
+        if message.get("text") is not None:
+            return message["text"]
+        await self.websocket.close(code=status.WS_1003_UNSUPPORTED_DATA, reason="Frames must be JSON text")
+        return None
+
+    def _expired(self) -> bool:
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    async def run(self) -> None:
+        try:
+            while True:
+                timeout = WS_HEARTBEAT_SECONDS
+                if self.expires_at is not None:
+                    # Wake up when the token expires, even on a silent socket
+                    timeout = max(0.0, min(timeout, self.expires_at - time.time()))
+                try:
+                    text = await self._receive_text(timeout)
+                except asyncio.TimeoutError:
+                    if self._expired():
+                        await self.websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Token expired")
+                        return
+                    if time.monotonic() - self.last_seen > WS_IDLE_TIMEOUT_SECONDS:
+                        await self.websocket.close(code=status.WS_1001_GOING_AWAY, reason="Idle timeout")
+                        return
+                    await self.send({"type": "ping"})
+                    continue
+                if text is None:
+                    return
+                if self._expired():
+                    await self.websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Token expired")
+                    return
+                self.last_seen = time.monotonic()
+                await self.handle(text)
+        except (WebSocketDisconnect, asyncio.TimeoutError):
+            pass
+        finally:
+            if self.generation is not None and not self.generation.done():
+                self.cancelled.set()
+                self.generation.cancel()
+
+    async def handle(self, text: str) -> None:
+        try:
+            frame = json.loads(text)
+            kind = frame.get("type")
+        except (ValueError, AttributeError):
+            await self.send({"type": "error", "id": None, "status": status.HTTP_400_BAD_REQUEST, "detail": "Frames must be JSON objects."})
+            return
+
+        if kind == "ping":
+            await self.send({"type": "pong"})
+        elif kind == "pong":
+            pass
+        elif kind == "cancel":
+            if self.generation is not None and not self.generation.done() and frame.get("id") in (None, self.generation_id):
+                self.cancelled.set()
+        elif kind == "message":
+            if self.generation is not None and not self.generation.done():
+                await self.send({
+                    "type": "error", "id": frame.get("id"), "status": status.HTTP_409_CONFLICT,
+                    "detail": "A reply is still being generated; cancel it or wait for it to finish."
+                })
+                return
+            if not await asyncio.to_thread(_is_active, self.user_id):
+                await self.websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="This user account is inactive.")
+                raise WebSocketDisconnect(status.WS_1008_POLICY_VIOLATION)
+            if is_draining():
+                await self.send({
+                    "type": "error", "id": frame.get("id"), "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+                    "detail": "The server is restarting; reconnect to continue."
+                })
+                return
+            self.generation_id = frame.get("id")
+            self.cancelled = threading.Event()
+            self.generation = asyncio.create_task(self.turn(frame, self.cancelled))
+        else:
+            await self.send({"type": "error", "id": frame.get("id"), "status": status.HTTP_400_BAD_REQUEST, "detail": f"Unknown frame type: {kind}"})
+
+    async def turn(self, frame: Dict[str, Any], cancelled: threading.Event) -> None:
+        request_id = frame.get("id")
+        try:
+            # A shutting-down worker finishes this reply before closing the socket
+            with track_work():
+                await self._turn(request_id, frame, cancelled)
+        except TurnError as e:
+            await self._send_quietly({"type": "error", "id": request_id, "status": e.status_code, "detail": e.detail})
+        except GeminiQuotaExceededError as e:
+            logger.error(f"Gemini quota exceeded or rate limited: {e}")
+            await self._send_quietly({
+                "type": "error", "id": request_id, "status": status.HTTP_402_PAYMENT_REQUIRED,
+                "detail": "Gemini API quota exceeded or rate limited. Please try again later."
+            })
+        except (GeminiContentFilterError, ValueError) as e:
+            await self._send_quietly({"type": "error", "id": request_id, "status": status.HTTP_400_BAD_REQUEST, "detail": str(e)})
+        except Exception as e:
+            logger.error(f"Error in chat socket turn: {str(e)}")
+            await self._send_quietly({
+                "type": "error", "id": request_id, "status": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                "detail": "Failed to process chatbot request. Please try again later."
+            })
+
+    async def _send_quietly(self, frame: Dict[str, Any]) -> None:
+        try:
+            await self.send(frame)
+        except Exception:
+            pass
+
+    async def _turn(self, request_id: Optional[str], frame: Dict[str, Any], cancelled: threading.Event) -> None:
+        message = frame.get("message")
+        if not isinstance(message, str) or not message.strip() or len(message) > WS_MAX_MESSAGE_CHARS:
+            raise TurnError(status.HTTP_400_BAD_REQUEST, f"message must be 1 to {WS_MAX_MESSAGE_CHARS} characters.")
+
+        if rate_limiter is not None:
+            # The shared SQLite store can wait on its lock; keep that off the event loop
+            limit = await asyncio.to_thread(rate_limiter.check, self.user_id, "chat")
+            if limit is not None and not limit.allowed:
+                raise TurnError(status.HTTP_429_TOO_MANY_REQUESTS, f"Too many chat requests. Try again in {limit.retry_after} seconds.")
+
+        conversation_id = frame.get("conversation_id")
+        new_title = None
+        if not conversation_id:
+            conversation_id = generate_uuid()
+            new_title = message[:30] + "..." if len(message) > 30 else message
+            history = []
+        elif conversation_id == self.conversation_id and self.history is not None:
+            history = self.history
+        else:
+            # Turns still queued for write-behind must land before we read the history
+            if chat_writer is not None:
+                await chat_writer.wait_for(conversation_id)
+            history = await asyncio.to_thread(_load_conversation, self.user_id, conversation_id)
+        self.conversation_id, self.history = conversation_id, history
+
+        await self.send({"type": "start", "id": request_id, "conversation_id": conversation_id})
+        usage = track_usage()
+        parts = await self._stream(request_id, message, history, cancelled)
+        if cancelled.is_set():
+            await self.send({"type": "cancelled", "id": request_id})
+            return
+
+        reply = "".join(parts)
+        turn = ChatTurn(
+            conversation_id=conversation_id,
+            user_id=self.user_id,
+            user_message=message,
+            reply=reply,
+            reply_at=datetime.now(timezone.utc),
+            new_title=new_title,
+            usage=usage
+        )
+        if chat_writer is not None:
+            chat_writer.submit(turn)
+        else:
+            await asyncio.to_thread(_save_turn, turn)
+            sync_notifier.notify(self.user_id)
+
+        self.history = history + format_history([
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": reply}
+        ])
+        if chat_sessions is not None:
+            chat_sessions.put(conversation_id, self.user_id, self.history, turn.reply_at)
+
+        logger.info(f"Chat socket response generated for user {self.user_email}, conversation {conversation_id}")
+        await self.send({"type": "done", "id": request_id, "conversation_id": conversation_id, "message": reply, "model": usage.model})
+
+    async def _stream(self, request_id: Optional[str], message: str, history: List[Dict[str, Any]], cancelled: threading.Event) -> List[str]:
+        # Gemini's client is blocking, so a worker thread reads the stream and
+        # hands chunks over through a small queue; it waits when the queue is full
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue(maxsize=WS_STREAM_BUFFER)
+
+        def produce():
+            def put(item):
+                asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+            try:
+                for text in stream_chatbot_response(message, history, cancelled):
+                    put(("chunk", text))
+                put(("end", None))
+            except Exception as e:
+                put(("error", e))
+
+        producer = asyncio.ensure_future(asyncio.to_thread(produce))
+        parts = []
+        finished = False
+        try:
+            while True:
+                kind, value = await chunks.get()
+                if kind == "end":
+                    finished = True
+                    break
+                if kind == "error":
+                    finished = True
+                    raise value
+                parts.append(value)
+                if not cancelled.is_set():
+                    await self.send({"type": "token", "id": request_id, "text": value})
+        finally:
+            if not finished:
+                # Stopped early: let the reader finish without blocking on a full queue
+                cancelled.set()
+                while not producer.done():
+                    try:
+                        chunks.get_nowait()
+                    except asyncio.QueueEmpty:
+                        await asyncio.sleep(0.05)
+        return parts
+
+
+def _bearer_token(websocket: WebSocket) -> Optional[str]:
+    scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+    return credentials if scheme.lower() == "bearer" and credentials else None
+
+
+@router.websocket("/ws/chat")
+async def chat_socket(
+    websocket: WebSocket,
+    token: Optional[str] = Query(None, description="Access token, for clients that can't set an Authorization header")
+):
+    """
+    Chat with the AI business consultant over a WebSocket, with streamed replies.
+    """
+    global _open_connections
+    if _open_connections >= WS_MAX_CONNECTIONS:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+
+    # Reserve the slot before the first await, so concurrent handshakes can't all pass the check
+    _open_connections += 1
+    try:
+        user = await asyncio.to_thread(_authenticate, token or _bearer_token(websocket))
+        if user is None:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+
+        await websocket.accept()
+        await ChatConnection(websocket, *user).run()
+    finally:
+        _open_connections -= 1
+
+
+if __name__ == "__main__":
+    print("Chat WebSocket router is running")
@@ -0,0 +1,46 @@
+# python3 -m app.routers.export
+from datetime import datetime, timezone
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+
+from app.database.models import User
+from app.auth.utils import get_active_user
+from app.services.export import ndjson_chunks, zip_chunks
+
+router = APIRouter(
+    prefix="/export",
+    tags=["Export"],
+    responses={401: {"description": "Unauthorized"}},
+)
+
+@router.get("", response_class=StreamingResponse, responses={200: {"content": {"application/x-ndjson": {}, "application/zip": {}}}})
+async def export(
+    format: Literal["ndjson", "zip"] = "ndjson",
+    since: Optional[int] = Query(
+        None, ge=0, description="The next_since of a previous export, to get only what changed after it"
+    ),
+    current_user: User = Depends(get_active_user)
+):
+    """
+    Export all of the current user's strategies, conversations and messages.
+
+    The export is streamed as NDJSON, one record per line, or as a zip
+    holding that file. Its last line is the "export" record; its next_since
+    is the `since` for an incremental export later.
+    """
+    # The request's session is closed before the body is sent; the export opens its own
+    chunks = ndjson_chunks(current_user.id, since)
+    filename = f"aspire-export-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}"
+    headers = {"Cache-Control": "no-store"}
+
+    if format == "zip":
+        headers["Content-Disposition"] = f'attachment; filename="{filename}.zip"'
+        return StreamingResponse(zip_chunks(chunks, f"{filename}.ndjson"), media_type="application/zip", headers=headers)
+
+    headers["Content-Disposition"] = f'attachment; filename="{filename}.ndjson"'
+    return StreamingResponse(chunks, media_type="application/x-ndjson", headers=headers)
+
+if __name__ == "__main__":
+    print("Export module is running")
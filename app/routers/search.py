@@ -0,0 +1,95 @@
+# python3 -m app.routers.search
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session, undefer
+from loguru import logger
+
+from app.database.replica import get_read_db
+from app.database.models import User, SavedStrategy, Message
+from app.database.search import search_ids, highlight
+from app.auth.utils import get_active_user
+from app.schemas.search import SearchResponse, SearchResult
+
+router = APIRouter(
+    prefix="/search",
+    tags=["Search"],
+    responses={401: {"description": "Unauthorized"}},
+)
+
+@router.get("", response_model=SearchResponse)
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    type: Literal["all", "strategies", "messages"] = "all",
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    current_user: User = Depends(get_active_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Search the current user's saved strategies and chat messages.
+    """
+    try:
+        # Each source returns its own top (offset + limit + 1) hits; merging
+        # those by rank gives the correct global page
+        window = offset + limit + 1
+        hits = []
+        if type in ("all", "strategies"):
+            hits += [(score, "strategy", row_id) for row_id, score in search_ids(db, SavedStrategy, current_user.id, q, window)]
+        if type in ("all", "messages"):
+            hits += [(score, "message", row_id) for row_id, score in search_ids(db, Message, current_user.id, q, window)]
+
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        page = hits[offset:offset + limit]
+
+        strategy_ids = [row_id for _, kind, row_id in page if kind == "strategy"]
+        message_ids = [row_id for _, kind, row_id in page if kind == "message"]
+        strategies = {
+            s.id: s for s in db.query(SavedStrategy).options(
+                undefer(SavedStrategy.content), undefer(SavedStrategy.document)
+            ).filter(SavedStrategy.id.in_(strategy_ids))
+        } if strategy_ids else {}
+        messages = {
+            m.id: m for m in db.query(Message).filter(Message.id.in_(message_ids))
+        } if message_ids else {}
+
+        results = []
+        for score, kind, row_id in page:
+            if kind == "strategy" and row_id in strategies:
+                strategy = strategies[row_id]
+                results.append(SearchResult(
+                    type=kind,
+                    id=row_id,
+                    title=strategy.title,
+                    snippet=highlight(strategy.content_text, q),
+                    score=score,
+                    created_at=strategy.created_at
+                ))
+            elif kind == "message" and row_id in messages:
+                message = messages[row_id]
+                results.append(SearchResult(
+                    type=kind,
+                    id=row_id,
+                    snippet=highlight(message.content, q),
+                    score=score,
+                    conversation_id=message.conversation_id,
+                    created_at=message.created_at
+                ))
+
+        return SearchResponse(
+            query=q,
+            results=results,
+            limit=limit,
+            offset=offset,
+            has_more=len(hits) > offset + limit
+        )
+
+    except Exception as e:
+        logger.error(f"Error searching for user {current_user.email}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to search. Please try again later."
+        )
+
+if __name__ == "__main__":
+    print("Search module is running")
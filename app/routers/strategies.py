@@ -1,11 +1,26 @@
 # python3 -m app.routers.strategies
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from pydantic import ValidationError
+from sqlalchemy import func
+from sqlalchemy.orm import Session, undefer
+from typing import List, Optional
 from app.database.database import get_db
-from app.database.models import User, SavedStrategy
+from app.database.replica import get_read_db
+from app.database.models import User, SavedStrategy, strategy_text
 from app.auth.utils import get_active_user
-from app.schemas.strategy import SaveStrategyRequest, SavedStrategyResponse
+from app.schemas.strategy import (
+    SaveStrategyRequest,
+    SavedStrategyResponse,
+    SavedStrategySummary,
+    SimilarStrategyResponse,
+    StrategyRequest,
+    StrategyResponse,
+    StrategySectionsResponse,
+)
+from app.services.similarity import strategy_index
+from app.services.drafts import take_draft
+from app.services.etags import make_etag, etag_matches, not_modified, set_etag
+from app.services.sync import allocate_change_numbers
 from loguru import logger
 
 router = APIRouter(
@@ -14,6 +29,40 @@ router = APIRouter(
     responses={401: {"description": "Unauthorized"}},
 )
 
+# Fields returned by the list endpoint unless ?fields= asks for others
+STRATEGY_SUMMARY_FIELDS = ["id", "title", "business_name", "industry", "excerpt", "created_at"]
+STRATEGY_LIST_FIELDS = STRATEGY_SUMMARY_FIELDS + ["content"]
+
+# Top-level sections of a structured strategy document
+STRATEGY_SECTIONS = list(StrategyResponse.model_fields)
+
+def parse_fields(fields: Optional[str], allowed: List[str], default: List[str], required: Optional[List[str]] = None) -> List[str]:
+    """Parse a comma-separated sparse fieldset; required fields (id by default) are always included."""
+    required = ["id"] if required is None else required
+    if not fields:
+        return default
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in selected if f not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}"
+        )
+    return required + [f for f in allowed if f in selected and f not in required]
+
+def parse_strategy_content(content: str):
+    """Split saved content into (text, document), validating JSON strategies once here."""
+    if not content.lstrip().startswith("{"):
+        return content, None
+    try:
+        document = StrategyResponse.model_validate_json(content)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Strategy content does not match the strategy format: {e.errors()[0]['msg']}"
+        )
+    return "", document.model_dump()
+
 @router.post("/", response_model=SavedStrategyResponse, status_code=status.HTTP_201_CREATED)
 async def save_strategy(
     strategy: SaveStrategyRequest,
@@ -22,21 +71,57 @@ async def save_strategy(
 ):
     """
     Save a generated strategy for future reference.
+
+    Send either the strategy as content, or the generation_id returned by
+    /ai/generate-strategy to save that draft without uploading it again.
     """
+    business_name = strategy.business_name
+    industry = strategy.industry
+
+    if strategy.generation_id is not None:
+        # Deleted together with the insert below, in one commit
+        draft = take_draft(db, current_user.id, strategy.generation_id)
+        if draft is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Generated strategy not found or expired. Please generate it again."
+            )
+        content, document = "", draft.document
+        business_name = business_name or draft.business_name
+        industry = industry or draft.industry
+    else:
+        content, document = parse_strategy_content(strategy.content)
+
     try:
         db_strategy = SavedStrategy(
             title=strategy.title,
-            business_name=strategy.business_name,
-            industry=strategy.industry,
-            content=strategy.content,
-            user_id=current_user.id
+            business_name=business_name,
+            industry=industry,
+            content=content,
+            document=document,
+            user_id=current_user.id,
+            change_seq=allocate_change_numbers(db, current_user.id, 1)
         )
         db.add(db_strategy)
         db.commit()
         db.refresh(db_strategy)
+
+        full_content = strategy_text(content, document)
+        strategy_index.add(
+            current_user.id, db_strategy.id, db_strategy.title,
+            db_strategy.business_name, db_strategy.industry, full_content
+        )
         
         logger.info(f"Strategy saved for user {current_user.email}, id: {db_strategy.id}")
-        return db_strategy
+        # content is deferred; reuse what we already have instead of reloading it
+        return SavedStrategyResponse(
+            id=db_strategy.id,
+            title=db_strategy.title,
+            business_name=db_strategy.business_name,
+            industry=db_strategy.industry,
+            content=strategy.content if strategy.content is not None else full_content,
+            created_at=db_strategy.created_at
+        )
     except Exception as e:
         db.rollback()
         logger.error(f"Error saving strategy: {str(e)}")
@@ -45,30 +130,102 @@ async def save_strategy(
             detail="Failed to save strategy. Please try again later."
         )
 
-@router.get("/", response_model=List[SavedStrategyResponse])
+@router.get("/", response_model=List[SavedStrategySummary], response_model_exclude_unset=True)
 async def get_user_strategies(
+    request: Request,
+    response: Response,
+    fields: Optional[str] = Query(
+        None,
+        description="Comma-separated fields to return. Defaults to a summary without content."
+    ),
     current_user: User = Depends(get_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get all strategies saved by the current user.
     """
-    strategies = db.query(SavedStrategy).filter(
+    selected = parse_fields(fields, STRATEGY_LIST_FIELDS, STRATEGY_SUMMARY_FIELDS)
+
+    # Every save takes a new change number, so the highest one changes with
+    # each save and the count with each delete; timestamps are too coarse for
+    # a delete and a save in the same second. Idle clients get a 304 without
+    # the list query
+    version = db.query(
+        func.count(SavedStrategy.id),
+        func.max(SavedStrategy.change_seq)
+    ).filter(SavedStrategy.user_id == current_user.id).one()
+    etag = make_etag("strategies", current_user.id, selected, *version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
+    # Only the selected columns are queried; content stays on disk unless asked for
+    columns = [getattr(SavedStrategy, f) for f in selected]
+    if "content" in selected:
+        columns.append(SavedStrategy.document)
+    rows = db.query(*columns).filter(
         SavedStrategy.user_id == current_user.id
     ).all()
-    
-    return strategies
+
+    results = []
+    for row in rows:
+        values = dict(row._mapping)
+        if "content" in selected:
+            values["content"] = strategy_text(values["content"], values.pop("document"))
+        results.append(SavedStrategySummary(**values))
+    return results
+
+@router.post("/similar", response_model=List[SimilarStrategyResponse])
+async def find_similar_strategies(
+    strategy_request: StrategyRequest,
+    limit: int = Query(5, ge=1, le=50),
+    current_user: User = Depends(get_active_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Find saved strategies similar to a strategy request, before generating a new one.
+    """
+    strategy_index.ensure_loaded(db, current_user.id)
+    matches = strategy_index.similar_to_request(current_user.id, strategy_request, limit=limit)
+    return strategy_index.resolve(db, current_user.id, matches)
+
+@router.get("/{strategy_id}/similar", response_model=List[SimilarStrategyResponse])
+async def get_similar_strategies(
+    strategy_id: str,
+    limit: int = Query(5, ge=1, le=50),
+    current_user: User = Depends(get_active_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get saved strategies similar to a specific saved strategy.
+    """
+    strategy_index.ensure_loaded(db, current_user.id)
+    matches = strategy_index.similar_to(current_user.id, strategy_id, limit=limit)
+
+    if not matches and not db.query(SavedStrategy.id).filter(
+        SavedStrategy.id == strategy_id,
+        SavedStrategy.user_id == current_user.id
+    ).first():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Strategy not found"
+        )
+
+    return strategy_index.resolve(db, current_user.id, matches)
 
 @router.get("/{strategy_id}", response_model=SavedStrategyResponse)
 async def get_strategy(
     strategy_id: str,
     current_user: User = Depends(get_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get a specific saved strategy.
     """
-    strategy = db.query(SavedStrategy).filter(
+    strategy = db.query(SavedStrategy).options(
+        undefer(SavedStrategy.content),
+        undefer(SavedStrategy.document)
+    ).filter(
         SavedStrategy.id == strategy_id,
         SavedStrategy.user_id == current_user.id
     ).first()
@@ -79,7 +236,52 @@ async def get_strategy(
             detail="Strategy not found"
         )
     
-    return strategy
+    return SavedStrategyResponse(
+        id=strategy.id,
+        title=strategy.title,
+        business_name=strategy.business_name,
+        industry=strategy.industry,
+        content=strategy.content_text,
+        created_at=strategy.created_at
+    )
+
+@router.get("/{strategy_id}/sections", response_model=StrategySectionsResponse)
+async def get_strategy_sections(
+    strategy_id: str,
+    names: str = Query(..., description="Comma-separated sections, e.g. action_plan,resources"),
+    current_user: User = Depends(get_active_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get selected sections of a saved strategy without loading the whole document.
+    """
+    selected = parse_fields(names, STRATEGY_SECTIONS, STRATEGY_SECTIONS, required=[])
+
+    # Extracted by the database (-> on JSONB, json_extract on SQLite)
+    row = db.query(
+        SavedStrategy.document.is_(None).label("unstructured"),
+        *[SavedStrategy.document[name].label(name) for name in selected]
+    ).filter(
+        SavedStrategy.id == strategy_id,
+        SavedStrategy.user_id == current_user.id
+    ).first()
+
+    if row is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Strategy not found"
+        )
+
+    if row.unstructured:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="This strategy has no structured sections"
+        )
+
+    return StrategySectionsResponse(
+        id=strategy_id,
+        sections={name: getattr(row, name) for name in selected}
+    )
 
 @router.delete("/{strategy_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_strategy(
@@ -101,8 +303,11 @@ async def delete_strategy(
             detail="Strategy not found"
         )
     
+    # Deletes move the user's change number too, like every other write to their data
+    allocate_change_numbers(db, current_user.id, 1)
     db.delete(strategy)
     db.commit()
+    strategy_index.remove(current_user.id, strategy_id)
     
     logger.info(f"Strategy {strategy_id} deleted by user {current_user.email}")
     return None
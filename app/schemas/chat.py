@@ -12,10 +12,13 @@ class ChatMessage(BaseModel):
     role: str  # 'user' or 'assistant'
     content: str
     created_at: Optional[datetime] = None
+    # Gemini model behind an assistant message
+    model: Optional[str] = None
 
 class ChatResponse(BaseModel):
     message: str
     conversation_id: str
+    model: Optional[str] = None
 
 class ConversationResponse(BaseModel):
     id: str
@@ -32,6 +35,20 @@ class ConversationDetailResponse(ConversationResponse):
     class Config:
         from_attributes = True
 
+class SyncMessage(ChatMessage):
+    id: str
+    conversation_id: str
+
+    class Config:
+        from_attributes = True
+
+class SyncResponse(BaseModel):
+    conversations: List[ConversationResponse]
+    messages: List[SyncMessage]
+    # Pass back as ?since= to get only what changed after this response
+    cursor: str
+    has_more: bool
+
 
 def main():
     print("Running chat chatbottt")
@@ -0,0 +1,26 @@
+# python3 -m app.schemas.search
+from pydantic import BaseModel
+from typing import Optional, List
+from datetime import datetime
+
+class SearchResult(BaseModel):
+    type: str  # 'strategy' or 'message'
+    id: str
+    title: Optional[str] = None
+    snippet: str
+    score: float
+    conversation_id: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+class SearchResponse(BaseModel):
+    query: str
+    results: List[SearchResult]
+    limit: int
+    offset: int
+    has_more: bool
+
+def main():
+    print("Search schemas")
+
+if __name__ == "__main__":
+    main()
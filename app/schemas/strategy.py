@@ -1,6 +1,6 @@
 # python3 -m app.schemas.strategy
-from pydantic import BaseModel, Field
-from typing import Optional, List
+from pydantic import BaseModel, Field, model_validator
+from typing import Any, Dict, Optional, List
 from datetime import datetime
 
 class StrategyBase(BaseModel):
@@ -42,12 +42,26 @@ class StrategyResponse(BaseModel):
     action_plan: List[str]
     resources: List[ResourceItem]
 
+class GeneratedStrategyResponse(StrategyResponse):
+    # Id of the server-side draft; pass it to POST /strategies/ to save
+    generation_id: Optional[str] = None
+    # Gemini model that generated it
+    model: Optional[str] = None
+
 class SaveStrategyRequest(BaseModel):
     title: str
-    content: str
+    # Either the strategy itself or the generation_id of a draft
+    content: Optional[str] = None
+    generation_id: Optional[str] = None
     business_name: Optional[str] = None
     industry: Optional[str] = None
 
+    @model_validator(mode="after")
+    def check_content_or_generation(self):
+        if (self.content is None) == (self.generation_id is None):
+            raise ValueError("Provide exactly one of content or generation_id")
+        return self
+
 class SavedStrategyResponse(BaseModel):
     id: str
     title: str
@@ -59,6 +73,31 @@ class SavedStrategyResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class SavedStrategySummary(BaseModel):
+    # Every field but id is optional so list endpoints can return sparse fieldsets
+    id: str
+    title: Optional[str] = None
+    business_name: Optional[str] = None
+    industry: Optional[str] = None
+    excerpt: Optional[str] = None
+    content: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class StrategySectionsResponse(BaseModel):
+    id: str
+    sections: Dict[str, Any]
+
+class SimilarStrategyResponse(BaseModel):
+    id: str
+    title: str
+    business_name: Optional[str] = None
+    industry: Optional[str] = None
+    created_at: datetime
+    score: float
+
 def main():
     print("Making Strategies")
 
@@ -0,0 +1,33 @@
+# python3 -m app.schemas.usage
+from pydantic import BaseModel
+from typing import Dict, List
+from datetime import date
+
+class UsageDay(BaseModel):
+    day: date
+    kind: str  # 'chat' or 'strategy'
+    requests: int
+    prompt_tokens: int
+    output_tokens: int
+
+class UsageTotals(BaseModel):
+    requests: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+
+class RateLimitInfo(BaseModel):
+    limit: int
+    remaining: int
+    reset_seconds: int
+
+class UsageResponse(BaseModel):
+    days: List[UsageDay]
+    totals: Dict[str, UsageTotals]
+    # Current state of each rate limit bucket; empty when rate limiting is off
+    limits: Dict[str, RateLimitInfo]
+
+def main():
+    print("Usage schemas")
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,7 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     email: Optional[str] = None
     user_id: Optional[str] = None
+    expires_at: Optional[datetime] = None
 
 class UserResponse(UserBase):
     id: str
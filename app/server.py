@@ -0,0 +1,74 @@
+# python3 -m app.server
+import importlib.util
+import os
+
+import uvicorn
+from loguru import logger
+
+# Production entry point: WEB_CONCURRENCY worker processes sharing one
+# socket, on uvloop and httptools when they are installed (they come with
+# uvicorn[standard]). For development with auto-reload use python3 -m app.main.
+#
+# Migrations run once here, before the workers start, so they don't race
+# each other (see app/database/migrations.py); the workers skip them.
+# MIGRATE_ON_STARTUP=false skips them here too, when a separate step runs
+# python3 -m app.database.migrations before deploying.
+#
+# Each worker warms up before it accepts connections and drains before it
+# exits (see app/services/lifecycle.py). A stopping worker can take
+# SHUTDOWN_DRAIN_SECONDS plus GRACEFUL_SHUTDOWN_SECONDS, so the platform's
+# termination grace period should cover both.
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30"))
+KEEPALIVE_SECONDS = int(os.getenv("KEEPALIVE_SECONDS", "75"))
+# Proxies whose X-Forwarded-For / X-Forwarded-Proto are trusted
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() == "true"
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def migrate() -> None:
+    # Imported here, so importing app.server stays cheap (benchmarks/startup_benchmark.py)
+    from app.database.database import get_engine
+    from app.database.migrations import prepare_database
+    engine = get_engine()
+    prepare_database(engine)
+    # The workers open their own connections
+    engine.dispose()
+
+
+def main() -> None:
+    if MIGRATE_ON_STARTUP:
+        migrate()
+    # Inherited by the workers
+    os.environ["MIGRATE_ON_STARTUP"] = "false"
+
+    loop = "uvloop" if _installed("uvloop") else "asyncio"
+    http = "httptools" if _installed("httptools") else "h11"
+    logger.info(f"🌟 Starting Aspire API server: {WEB_CONCURRENCY} workers on {HOST}:{PORT} ({loop}, {http})")
+    uvicorn.run(
+        "app.main:app",
+        host=HOST,
+        port=PORT,
+        workers=WEB_CONCURRENCY,
+        loop=loop,
+        http=http,
+        # A worker that fails to start should fail loudly, not serve without its startup work
+        lifespan="on",
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS,
+        # Longer than the load balancer's idle timeout, so it never reuses a closed connection
+        timeout_keep_alive=KEEPALIVE_SECONDS,
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+        # log_requests in app.main already logs every request
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 from app.services.services import (
     generate_business_strategy, 
     generate_chatbot_response, 
+    format_history,
+    stream_chatbot_response,
     GeminiQuotaExceededError, 
     GeminiAPIError,
     GeminiContentFilterError
@@ -9,6 +11,8 @@ from app.services.services import (
 __all__ = [
     'generate_business_strategy', 
     'generate_chatbot_response', 
+    'format_history',
+    'stream_chatbot_response',
     'GeminiQuotaExceededError', 
     'GeminiAPIError',
     'GeminiContentFilterError'
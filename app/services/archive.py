@@ -0,0 +1,138 @@
+# python3 -m app.services.archive
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from loguru import logger
+from sqlalchemy.orm import Session, undefer
+
+from app.database.models import Conversation, ConversationArchive, Message
+
+# Conversations untouched for this many days move to cold storage; 0 disables archiving
+MESSAGE_ARCHIVE_AFTER_DAYS = float(os.getenv("MESSAGE_ARCHIVE_AFTER_DAYS", "90"))
+MESSAGE_ARCHIVE_INTERVAL_SECONDS = float(os.getenv("MESSAGE_ARCHIVE_INTERVAL_SECONDS", "3600"))
+MESSAGE_ARCHIVE_BATCH_SIZE = 50
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+# Archiving isn't activity: updated_at is passed through so its onupdate doesn't fire
+def _set_archived_at(db: Session, conversation_id: str, value) -> None:
+    db.query(Conversation).filter(Conversation.id == conversation_id).update(
+        {Conversation.archived_at: value, Conversation.updated_at: Conversation.updated_at},
+        synchronize_session=False
+    )
+
+
+def archive_conversation(db: Session, conversation: Conversation) -> int:
+    """Move a conversation's messages into one compressed archive row.
+
+    Messages are deleted through the ORM so the search index drops them too;
+    archived messages don't show up in search until restored. The caller commits.
+    """
+    messages = db.query(Message).filter(
+        Message.conversation_id == conversation.id
+    ).order_by(Message.created_at).all()
+
+    db.add(ConversationArchive(
+        conversation_id=conversation.id,
+        messages=json.dumps([
+            {
+                "id": msg.id,
+                "role": msg.role,
+                "content": msg.content,
+                "model": msg.model,
+                "created_at": msg.created_at.isoformat() if msg.created_at else None,
+                "change_seq": msg.change_seq
+            } for msg in messages
+        ]),
+        message_count=len(messages),
+        last_message=messages[-1].content[:200] if messages else None
+    ))
+    for msg in messages:
+        db.delete(msg)
+    _set_archived_at(db, conversation.id, datetime.now(timezone.utc))
+    return len(messages)
+
+
+def archive_idle_conversations(
+    db: Session,
+    idle_days: float = MESSAGE_ARCHIVE_AFTER_DAYS,
+    batch_size: int = MESSAGE_ARCHIVE_BATCH_SIZE
+) -> int:
+    """Archive conversations idle for idle_days, one transaction per batch. Returns conversations archived."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=idle_days)
+    total = 0
+    while True:
+        conversations = db.query(Conversation).filter(
+            Conversation.archived_at.is_(None),
+            Conversation.updated_at < cutoff
+        ).order_by(Conversation.updated_at).limit(batch_size).all()
+        if not conversations:
+            return total
+
+        messages = sum(archive_conversation(db, conversation) for conversation in conversations)
+        db.commit()
+        total += len(conversations)
+        logger.info(f"Archived {len(conversations)} idle conversations ({messages} messages)")
+
+
+def restore_conversation(db: Session, conversation_id: str) -> bool:
+    """Move an archived conversation's messages back into messages and commit.
+
+    Messages keep their ids, timestamps and change numbers. Returns False if there was nothing to restore.
+    """
+    archive = db.query(ConversationArchive).options(undefer(ConversationArchive.messages)).filter(
+        ConversationArchive.conversation_id == conversation_id
+    ).first()
+    if archive is None:
+        _set_archived_at(db, conversation_id, None)
+        db.commit()
+        return False
+
+    restored = archive.message_count
+    db.add_all([
+        Message(
+            id=item["id"],
+            conversation_id=conversation_id,
+            role=item["role"],
+            content=item["content"],
+            model=item.get("model"),
+            created_at=_parse_time(item["created_at"]),
+            change_seq=item.get("change_seq", 0)
+        ) for item in json.loads(archive.messages)
+    ])
+    db.delete(archive)
+    _set_archived_at(db, conversation_id, None)
+    db.commit()
+    logger.info(f"Restored archived conversation {conversation_id} ({restored} messages)")
+    return True
+
+
+async def run_archival(session_factory, interval: float = MESSAGE_ARCHIVE_INTERVAL_SECONDS) -> None:
+    """Periodically archive idle conversations (and keep message partitions ahead) until cancelled."""
+    from app.database.partitions import ensure_message_partitions
+
+    while True:
+        await asyncio.sleep(interval)
+        db = session_factory()
+        try:
+            # Runs in a worker thread so the event loop isn't blocked on the DB
+            await asyncio.to_thread(ensure_message_partitions, db.get_bind())
+            if MESSAGE_ARCHIVE_AFTER_DAYS > 0:
+                await asyncio.to_thread(archive_idle_conversations, db)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Conversation archival failed: {str(e)}")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    from app.database.database import SessionLocal
+    session = SessionLocal()
+    print(f"Archived {archive_idle_conversations(session)} idle conversations")
+    session.close()
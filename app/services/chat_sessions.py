@@ -0,0 +1,119 @@
+# python3 -m app.services.chat_sessions
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+# Live chat sessions: the Gemini-formatted history of recently active
+# conversations, so a follow-up turn doesn't reload every message.
+#
+# An entry is only used while its version matches the conversation's
+# updated_at, which every chat turn bumps. A turn written by another worker
+# (or lost from the write-behind queue) changes the version and the history
+# is reloaded from the database.
+#
+# Each worker has its own cache. The chatbot returns the conversation id in
+# an X-Affinity-Key header; clients send it back, and a load balancer
+# hashing on that header (e.g. nginx: hash $http_x_affinity_key consistent)
+# keeps a conversation on the worker that already holds its session.
+CHAT_SESSION_CACHE_ENABLED = os.getenv("CHAT_SESSION_CACHE_ENABLED", "true").lower() == "true"
+CHAT_SESSION_CACHE_MAX_BYTES = int(os.getenv("CHAT_SESSION_CACHE_MAX_MB", "64")) * 1024 * 1024
+CHAT_SESSION_IDLE_SECONDS = float(os.getenv("CHAT_SESSION_IDLE_SECONDS", "900"))
+
+AFFINITY_HEADER = "X-Affinity-Key"
+
+# Rough per-message overhead of the dicts and list slots, on top of the text
+_MESSAGE_OVERHEAD_BYTES = 200
+
+
+def _version(updated_at: Optional[datetime]) -> Optional[datetime]:
+    # SQLite hands back naive UTC datetimes, Postgres aware ones
+    if updated_at is None or updated_at.tzinfo is None:
+        return updated_at
+    return updated_at.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _history_size(history: List[Dict[str, Any]]) -> int:
+    return sum(len(msg["parts"][0]) + _MESSAGE_OVERHEAD_BYTES for msg in history)
+
+
+@dataclass
+class ChatSession:
+    user_id: str
+    history: List[Dict[str, Any]]
+    version: Optional[datetime]
+    size: int
+    last_used: float
+
+
+class ChatSessionCache:
+    """LRU of chat histories keyed by conversation id, capped by estimated bytes."""
+
+    def __init__(self, max_bytes: int = CHAT_SESSION_CACHE_MAX_BYTES, idle_seconds: float = CHAT_SESSION_IDLE_SECONDS):
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conversation_id: str, user_id: str, updated_at: Optional[datetime]) -> Optional[List[Dict[str, Any]]]:
+        """The cached history if it is still current, else None. Don't mutate the result."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            session = self._sessions.get(conversation_id)
+            if session is None or session.user_id != user_id or session.version != _version(updated_at):
+                if session is not None:
+                    self._remove(conversation_id)
+                self.misses += 1
+                return None
+            session.last_used = now
+            self._sessions.move_to_end(conversation_id)
+            self.hits += 1
+            return session.history
+
+    def put(self, conversation_id: str, user_id: str, history: List[Dict[str, Any]], updated_at: datetime) -> None:
+        size = _history_size(history)
+        with self._lock:
+            self._remove(conversation_id)
+            if size > self.max_bytes:
+                return
+            self._sessions[conversation_id] = ChatSession(user_id, history, _version(updated_at), size, time.monotonic())
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._sessions)))
+
+    def discard(self, conversation_id: str) -> None:
+        with self._lock:
+            self._remove(conversation_id)
+
+    def _remove(self, conversation_id: str) -> None:
+        session = self._sessions.pop(conversation_id, None)
+        if session is not None:
+            self._bytes -= session.size
+
+    def _evict_idle(self, now: float) -> None:
+        # Least recently used first, so stop at the first session still in use
+        while self._sessions:
+            conversation_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self.idle_seconds:
+                break
+            self._remove(conversation_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {"sessions": len(self._sessions), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+chat_sessions = ChatSessionCache() if CHAT_SESSION_CACHE_ENABLED else None
+
+
+if __name__ == "__main__":
+    cache = ChatSessionCache(max_bytes=1000)
+    stamp = datetime.now(timezone.utc)
+    cache.put("c1", "u1", [{"role": "user", "parts": ["hello"]}], stamp)
+    print(cache.get("c1", "u1", stamp) is not None, cache.get("c1", "u2", stamp), cache.stats())
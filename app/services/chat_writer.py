@@ -0,0 +1,267 @@
+# python3 -m app.services.chat_writer
+import asyncio
+import os
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import bindparam
+from sqlalchemy.orm import Session
+
+from app.database.models import Conversation, Message, generate_uuid
+from app.database.replica import record_write
+from app.database.search import index_rows
+from app.services.idempotency import IdempotencyClaim
+from app.services.sync import allocate_change_numbers, sync_notifier
+from app.services.usage import TokenUsage, record_usage
+
+# Write-behind: chat turns are queued and written in batches by one
+# background task instead of one transaction per request. Turns still in the
+# queue are lost if the process dies, so this is off by default.
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "false").lower() == "true"
+CHAT_WRITE_BEHIND_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BEHIND_BATCH_SIZE", "100"))
+CHAT_WRITE_BEHIND_INTERVAL_SECONDS = float(os.getenv("CHAT_WRITE_BEHIND_INTERVAL_MS", "50")) / 1000
+
+
+@dataclass
+class ChatTurn:
+    """Everything one chat request writes: a user message, the reply and the conversation bump."""
+    conversation_id: str
+    user_id: str
+    user_message: str
+    reply: str
+    # Set when the turn is handed over for writing, not when the message arrived
+    reply_at: datetime
+    # Only set when the turn starts a new conversation
+    new_title: Optional[str] = None
+    # Tokens the reply cost, added to the user's usage, and the model that wrote it
+    usage: TokenUsage = field(default_factory=TokenUsage)
+    # The request's Idempotency-Key claim and response, stored with the turn
+    idempotency: Optional[IdempotencyClaim] = None
+    response: Any = None
+
+    @property
+    def user_message_at(self) -> datetime:
+        # Stamped with the reply, just before it, so the history keeps its order
+        return self.reply_at - timedelta(microseconds=1)
+
+
+def save_chat_turns(db: Session, turns: List[ChatTurn]) -> None:
+    """Write the turns in a single transaction.
+
+    Messages go in with one executemany INSERT and are indexed for search with
+    one more; existing conversations get their updated_at and change number
+    bumped with one executemany UPDATE.
+    """
+    # Two change numbers per turn: the user message, then the reply (which
+    # the conversation shares). Allocated in user id order to avoid deadlocks.
+    by_user: Dict[str, List[ChatTurn]] = {}
+    for turn in turns:
+        by_user.setdefault(turn.user_id, []).append(turn)
+    change_numbers: Dict[int, int] = {}
+    for user_id in sorted(by_user):
+        first = allocate_change_numbers(db, user_id, 2 * len(by_user[user_id]))
+        for i, turn in enumerate(by_user[user_id]):
+            change_numbers[id(turn)] = first + 2 * i
+
+    new_conversations = [
+        Conversation(
+            id=turn.conversation_id,
+            user_id=turn.user_id,
+            title=turn.new_title,
+            created_at=turn.user_message_at,
+            updated_at=turn.reply_at,
+            change_seq=change_numbers[id(turn)] + 1
+        ) for turn in turns if turn.new_title is not None
+    ]
+    if new_conversations:
+        db.add_all(new_conversations)
+        # Before the messages referencing them, which bypass the unit of work
+        db.flush()
+
+    bumps = [
+        {"row_id": turn.conversation_id, "value": turn.reply_at, "seq": change_numbers[id(turn)] + 1}
+        for turn in turns if turn.new_title is None
+    ]
+    if bumps:
+        table = Conversation.__table__
+        db.execute(
+            table.update().where(table.c.id == bindparam("row_id")).values(
+                updated_at=bindparam("value"), change_seq=bindparam("seq")
+            ),
+            bumps
+        )
+
+    messages = []
+    for turn in turns:
+        messages += [
+            {
+                "id": generate_uuid(),
+                "conversation_id": turn.conversation_id,
+                "content": turn.user_message,
+                "role": "user",
+                "model": None,
+                "created_at": turn.user_message_at,
+                "change_seq": change_numbers[id(turn)]
+            },
+            {
+                "id": generate_uuid(),
+                "conversation_id": turn.conversation_id,
+                "content": turn.reply,
+                "role": "assistant",
+                "model": turn.usage.model,
+                "created_at": turn.reply_at,
+                "change_seq": change_numbers[id(turn)] + 1
+            },
+        ]
+    db.execute(Message.__table__.insert(), messages)
+    # Core inserts skip the search index's ORM events
+    index_rows(db.connection(), "messages", [(message["id"], message["content"]) for message in messages])
+
+    # One usage upsert per user and day, however many turns the batch holds
+    usage: Dict[Tuple[str, date], List[ChatTurn]] = {}
+    for turn in turns:
+        usage.setdefault((turn.user_id, turn.reply_at.date()), []).append(turn)
+    for (user_id, day), user_turns in usage.items():
+        total = TokenUsage()
+        for turn in user_turns:
+            total.add(turn.usage)
+        record_usage(db, user_id, "chat", total, requests=len(user_turns), day=day)
+
+    for turn in turns:
+        if turn.idempotency is not None:
+            turn.idempotency.store(db, turn.response)
+    db.commit()
+    # The conversation bump and messages don't carry a user_id for the session hook
+    for user_id in {turn.user_id for turn in turns}:
+        record_write(user_id)
+
+
+class ChatWriteBehind:
+    """Batches chat turns from concurrent requests into shared transactions."""
+
+    def __init__(
+        self,
+        session_factory,
+        batch_size: int = CHAT_WRITE_BEHIND_BATCH_SIZE,
+        interval: float = CHAT_WRITE_BEHIND_INTERVAL_SECONDS
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # conversation id -> completion of its most recently queued turn
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Write everything still queued, then stop."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    def submit(self, turn: ChatTurn) -> asyncio.Future:
+        if self._task is None:
+            raise RuntimeError("Chat write-behind is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._pending[turn.conversation_id] = future
+        self._queue.put_nowait((turn, future))
+        return future
+
+    async def wait_for(self, conversation_id: str) -> None:
+        """Wait until queued turns for the conversation are written, so reads see them.
+
+        A failed write isn't raised here; the caller simply won't find the rows.
+        """
+        future = self._pending.get(conversation_id)
+        if future is not None:
+            await asyncio.wait([future])
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            # Give concurrent turns a moment to join the batch
+            await asyncio.sleep(self.interval)
+            batch = [item]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                # E.g. no session or worker thread; fail these turns, keep the writer running
+                logger.error(f"Chat write-behind could not write a batch of {len(batch)} turns: {str(e)}")
+                self._fail(batch, e)
+
+    def _fail(self, batch: List[Tuple[ChatTurn, asyncio.Future]], error: Exception) -> None:
+        for turn, future in batch:
+            if not future.done():
+                future.set_exception(error)
+                future.exception()
+            if self._pending.get(turn.conversation_id) is future:
+                del self._pending[turn.conversation_id]
+
+    async def _flush(self, batch: List[Tuple[ChatTurn, asyncio.Future]]) -> None:
+        results = await asyncio.to_thread(self._write, [turn for turn, _ in batch])
+        for (turn, future), error in zip(batch, results):
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+                # Nobody may be waiting on it; don't warn about an unretrieved exception
+                future.exception()
+            if self._pending.get(turn.conversation_id) is future:
+                del self._pending[turn.conversation_id]
+        for user_id in {turn.user_id for turn, _ in batch}:
+            sync_notifier.notify(user_id)
+
+    # Returns one error (or None) per turn
+    def _write(self, turns: List[ChatTurn]) -> List[Optional[Exception]]:
+        db = self.session_factory()
+        try:
+            try:
+                save_chat_turns(db, turns)
+                return [None] * len(turns)
+            except Exception as e:
+                db.rollback()
+                if len(turns) == 1:
+                    logger.error(f"Failed to write chat turn for conversation {turns[0].conversation_id}: {str(e)}")
+                    return [e]
+                logger.warning(f"Batched chat write failed, retrying {len(turns)} turns one by one: {str(e)}")
+
+            # One bad turn shouldn't lose the rest of the batch
+            errors = []
+            for turn in turns:
+                try:
+                    save_chat_turns(db, [turn])
+                    errors.append(None)
+                except Exception as e:
+                    db.rollback()
+                    logger.error(f"Failed to write chat turn for conversation {turn.conversation_id}: {str(e)}")
+                    errors.append(e)
+            return errors
+        finally:
+            db.close()
+
+
+chat_writer: Optional[ChatWriteBehind] = None
+if CHAT_WRITE_BEHIND:
+    from app.database.database import SessionLocal
+    chat_writer = ChatWriteBehind(SessionLocal)
+
+
+if __name__ == "__main__":
+    print(f"Chat write-behind enabled: {CHAT_WRITE_BEHIND}")
@@ -0,0 +1,145 @@
+# python3 -m app.services.deadlines
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+from fastapi import Header, Request
+
+from app.services.lifecycle import track_work
+
+# Every Gemini-backed request gets a deadline: the endpoint's default, or
+# less if the client sends X-Request-Timeout (seconds), never more than
+# REQUEST_TIMEOUT_MAX_SECONDS. Proxies in front of the API should use a
+# timeout at least as long as the endpoint's.
+#
+# The Gemini work runs in a worker thread. The router stops waiting for it
+# when the deadline passes or the client disconnects; the service functions
+# see the same deadline, cap each Gemini call's timeout to what is left and
+# don't start another call (fallback model, retry) once it is abandoned.
+# Nothing is saved for an abandoned request.
+REQUEST_TIMEOUT_HEADER = "X-Request-Timeout"
+REQUEST_TIMEOUTS = {
+    "chat": float(os.getenv("REQUEST_TIMEOUT_CHAT_SECONDS", "90")),
+    "strategy": float(os.getenv("REQUEST_TIMEOUT_STRATEGY_SECONDS", "150")),
+}
+REQUEST_TIMEOUT_MAX_SECONDS = float(os.getenv("REQUEST_TIMEOUT_MAX_SECONDS", "300"))
+
+# nginx's status for "client closed request"; nobody receives it, but it shows up in logs
+CLIENT_CLOSED_REQUEST = 499
+
+
+class RequestAbandonedError(Exception):
+    """The request stopped waiting for its result."""
+    pass
+
+class DeadlineExceededError(RequestAbandonedError, TimeoutError):
+    """Raised when a request runs past its deadline"""
+    pass
+
+class ClientDisconnectedError(RequestAbandonedError, ConnectionError):
+    """Raised when the client went away before the result was ready"""
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.disconnected = False
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self) -> None:
+        """Raise if the request has been abandoned."""
+        if self.disconnected:
+            raise ClientDisconnectedError("The client disconnected.")
+        if self.remaining() <= 0:
+            raise DeadlineExceededError(f"The request did not finish within {self.seconds:g} seconds.")
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("current_deadline", default=None)
+
+
+def check_deadline() -> None:
+    """Raise if the current request (if it has a deadline) has been abandoned."""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def call_timeout(default: float) -> float:
+    """Timeout for the next upstream call: the default, capped by the current deadline."""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return default
+    deadline.check()
+    return min(default, deadline.remaining())
+
+
+def request_deadline(endpoint: str):
+    """Dependency that starts the request's deadline."""
+    default = REQUEST_TIMEOUTS[endpoint]
+
+    def dependency(
+        timeout: Optional[float] = Header(
+            None, alias=REQUEST_TIMEOUT_HEADER, gt=0,
+            description=f"Seconds to wait for the result (at most {REQUEST_TIMEOUT_MAX_SECONDS:g})"
+        )
+    ) -> Deadline:
+        return Deadline(min(timeout or default, REQUEST_TIMEOUT_MAX_SECONDS))
+    return dependency
+
+
+async def run_with_deadline(request: Request, deadline: Deadline, func: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking call in a worker thread until it returns, the deadline passes or the client leaves.
+
+    The thread can't be interrupted; once abandoned it sees the deadline at
+    its next check and its result is dropped.
+    """
+    token = _current_deadline.set(deadline)
+    try:
+        # The task (and the thread) run in a copy of this context, deadline included
+        call = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    finally:
+        _current_deadline.reset(token)
+
+    # The body has been read, so the next message is the client's disconnect.
+    # (Request.is_disconnected can't see it through BaseHTTPMiddleware.)
+    disconnect = asyncio.ensure_future(request.receive())
+    with track_work():
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    {call, disconnect}, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED
+                )
+                if call in done:
+                    return call.result()
+                if disconnect in done:
+                    deadline.disconnected = True
+                deadline.check()
+        except BaseException:
+            if not call.done():
+                # Also stops the thread when this request itself was cancelled
+                deadline.disconnected = True
+                call.add_done_callback(_discard_result)
+            raise
+        finally:
+            disconnect.cancel()
+
+
+def _discard_result(call: asyncio.Future) -> None:
+    # Retrieve the abandoned call's exception so asyncio doesn't log it as never retrieved
+    if not call.cancelled():
+        call.exception()
+
+
+if __name__ == "__main__":
+    deadline = Deadline(0.01)
+    time.sleep(0.02)
+    try:
+        deadline.check()
+    except DeadlineExceededError as e:
+        print(e)
@@ -0,0 +1,98 @@
+# python3 -m app.services.drafts
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from loguru import logger
+from sqlalchemy.orm import Session
+
+from app.database.models import StrategyDraft
+
+STRATEGY_DRAFT_TTL_HOURS = float(os.getenv("STRATEGY_DRAFT_TTL_HOURS", "24"))
+STRATEGY_DRAFT_CLEANUP_INTERVAL_SECONDS = float(os.getenv("STRATEGY_DRAFT_CLEANUP_INTERVAL_SECONDS", "600"))
+STRATEGY_DRAFT_CLEANUP_BATCH_SIZE = 500
+
+
+def create_draft(
+    db: Session,
+    user_id: str,
+    business_name: str,
+    industry: str,
+    document: Dict[str, Any],
+    model: Optional[str] = None,
+    commit: bool = True
+) -> StrategyDraft:
+    """Store a generated strategy as a short-lived draft.
+
+    With commit=False the draft is only flushed (so it has its id) and
+    lands with the caller's commit.
+    """
+    draft = StrategyDraft(
+        user_id=user_id,
+        business_name=business_name,
+        industry=industry,
+        document=document,
+        model=model,
+        expires_at=datetime.now(timezone.utc) + timedelta(hours=STRATEGY_DRAFT_TTL_HOURS),
+    )
+    db.add(draft)
+    if commit:
+        db.commit()
+    else:
+        db.flush()
+    return draft
+
+
+def take_draft(db: Session, user_id: str, draft_id: str) -> Optional[StrategyDraft]:
+    """Return an unexpired draft owned by the user and mark it for deletion.
+
+    The deletion lands with the caller's next commit, so promoting a draft
+    to a saved strategy happens in a single transaction.
+    """
+    draft = db.query(StrategyDraft).filter(
+        StrategyDraft.id == draft_id,
+        StrategyDraft.user_id == user_id,
+        StrategyDraft.expires_at > datetime.now(timezone.utc)
+    ).first()
+    if draft is not None:
+        db.delete(draft)
+    return draft
+
+
+def purge_expired_drafts(db: Session, batch_size: int = STRATEGY_DRAFT_CLEANUP_BATCH_SIZE) -> int:
+    """Delete expired drafts in batches, committing after each batch."""
+    total = 0
+    while True:
+        expired_ids = [row[0] for row in db.query(StrategyDraft.id).filter(
+            StrategyDraft.expires_at <= datetime.now(timezone.utc)
+        ).limit(batch_size)]
+        if not expired_ids:
+            return total
+
+        db.query(StrategyDraft).filter(StrategyDraft.id.in_(expired_ids)).delete(synchronize_session=False)
+        db.commit()
+        total += len(expired_ids)
+
+
+async def run_draft_cleanup(session_factory, interval: float = STRATEGY_DRAFT_CLEANUP_INTERVAL_SECONDS) -> None:
+    """Periodically purge expired drafts until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        db = session_factory()
+        try:
+            # Runs in a worker thread so the event loop isn't blocked on the DB
+            removed = await asyncio.to_thread(purge_expired_drafts, db)
+            if removed:
+                logger.info(f"Removed {removed} expired strategy drafts")
+        except Exception as e:
+            logger.error(f"Strategy draft cleanup failed: {str(e)}")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    from app.database.database import SessionLocal
+    session = SessionLocal()
+    print(f"Removed {purge_expired_drafts(session)} expired drafts")
+    session.close()
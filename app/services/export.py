@@ -0,0 +1,212 @@
+# python3 -m app.services.export
+import json
+import os
+import zipfile
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+from loguru import logger
+from sqlalchemy.orm import Session
+
+from app.database.models import Conversation, ConversationArchive, Message, SavedStrategy, User, strategy_text
+from app.database.replica import open_read_session
+
+# A user's export, as NDJSON: one JSON record per line, tagged by "type".
+# Strategies come first, then conversations, then their messages (live and
+# archived). The last line is an "export" record. It gives the record counts
+# and a next_since value; pass next_since as `since` to get only what changed
+# after this export. An export that stops before its "export" line is
+# incomplete. Records written while the export runs may appear in the next
+# one too, so clients should de-duplicate by id.
+#
+# since and next_since are change numbers, the commit-ordered positions
+# delta sync uses (app/services/sync.py), not times: every write numbered up
+# to next_since had committed when the export started, and every later one
+# is numbered above it.
+#
+# Each query reads through a server-side cursor (yield_per) in batches of
+# EXPORT_BATCH_SIZE rows, and each batch is sent before the next is fetched.
+# Memory use depends on the batch size, not on the size of the account.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+# Each archive row holds a whole conversation, so fewer are fetched at a time
+EXPORT_ARCHIVE_BATCH_SIZE = int(os.getenv("EXPORT_ARCHIVE_BATCH_SIZE", "20"))
+EXPORT_FORMAT_VERSION = 1
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _strategies(db: Session, user_id: str, since: Optional[int]) -> Iterator[Dict[str, Any]]:
+    query = db.query(
+        SavedStrategy.id,
+        SavedStrategy.title,
+        SavedStrategy.business_name,
+        SavedStrategy.industry,
+        SavedStrategy.content,
+        SavedStrategy.document,
+        SavedStrategy.created_at
+    ).filter(SavedStrategy.user_id == user_id)
+    if since is not None:
+        query = query.filter(SavedStrategy.change_seq > since)
+
+    for row in query.order_by(SavedStrategy.change_seq, SavedStrategy.created_at).execution_options(yield_per=EXPORT_BATCH_SIZE):
+        yield {
+            "type": "strategy",
+            "id": row.id,
+            "title": row.title,
+            "business_name": row.business_name,
+            "industry": row.industry,
+            "content": strategy_text(row.content, row.document),
+            "created_at": _iso(row.created_at)
+        }
+
+
+def _conversations(db: Session, user_id: str, since: Optional[int]) -> Iterator[Dict[str, Any]]:
+    query = db.query(
+        Conversation.id,
+        Conversation.title,
+        Conversation.created_at,
+        Conversation.updated_at
+    ).filter(Conversation.user_id == user_id)
+    if since is not None:
+        query = query.filter(Conversation.change_seq > since)
+
+    for row in query.order_by(Conversation.change_seq, Conversation.updated_at).execution_options(yield_per=EXPORT_BATCH_SIZE):
+        yield {
+            "type": "conversation",
+            "id": row.id,
+            "title": row.title,
+            "created_at": _iso(row.created_at),
+            "updated_at": _iso(row.updated_at)
+        }
+
+
+def _messages(db: Session, user_id: str, since: Optional[int]) -> Iterator[Dict[str, Any]]:
+    query = db.query(
+        Message.id,
+        Message.conversation_id,
+        Message.role,
+        Message.content,
+        Message.model,
+        Message.created_at
+    ).join(Conversation, Message.conversation_id == Conversation.id).filter(Conversation.user_id == user_id)
+    if since is not None:
+        # A message's conversation is numbered at least as high (see sync.py)
+        query = query.filter(Conversation.change_seq > since, Message.change_seq > since)
+
+    for row in query.order_by(Message.change_seq, Message.created_at).execution_options(yield_per=EXPORT_BATCH_SIZE):
+        yield {
+            "type": "message",
+            "id": row.id,
+            "conversation_id": row.conversation_id,
+            "role": row.role,
+            "content": row.content,
+            "model": row.model,
+            "created_at": _iso(row.created_at)
+        }
+
+
+def _archived_messages(db: Session, user_id: str, since: Optional[int]) -> Iterator[Dict[str, Any]]:
+    query = db.query(
+        ConversationArchive.conversation_id,
+        ConversationArchive.messages
+    ).join(Conversation, ConversationArchive.conversation_id == Conversation.id).filter(Conversation.user_id == user_id)
+    if since is not None:
+        # Archiving keeps the conversation's change number, so no archived message is numbered higher
+        query = query.filter(Conversation.change_seq > since)
+
+    for row in query.execution_options(yield_per=EXPORT_ARCHIVE_BATCH_SIZE):
+        for msg in json.loads(row.messages):
+            if since is not None and msg.get("change_seq", 0) <= since:
+                continue
+            yield {
+                "type": "message",
+                "id": msg["id"],
+                "conversation_id": row.conversation_id,
+                "role": msg["role"],
+                "content": msg["content"],
+                "model": msg.get("model"),
+                "created_at": msg["created_at"]
+            }
+
+
+def export_records(db: Session, user_id: str, since: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Every record of the user's export, ending with the "export" record."""
+    # Read before the first query, so nothing written during the export is missed next time
+    next_since = db.query(User.change_seq).filter(User.id == user_id).scalar() or 0
+    counts = {"strategy": 0, "conversation": 0, "message": 0}
+
+    for source in (_strategies, _conversations, _messages, _archived_messages):
+        for record in source(db, user_id, since):
+            counts[record["type"]] += 1
+            yield record
+
+    yield {
+        "type": "export",
+        "version": EXPORT_FORMAT_VERSION,
+        "exported_at": _iso(datetime.now(timezone.utc)),
+        "since": since,
+        "next_since": next_since,
+        "counts": counts
+    }
+
+
+def ndjson_chunks(user_id: str, since: Optional[int] = None, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """The user's export as NDJSON, batch_size lines per chunk, read through its own session."""
+    db = open_read_session(user_id)
+    try:
+        lines: List[str] = []
+        for record in export_records(db, user_id, since):
+            lines.append(json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str))
+            if len(lines) >= batch_size:
+                yield ("\n".join(lines) + "\n").encode("utf-8")
+                lines = []
+        if lines:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+    except Exception as e:
+        # The response has started, so the client only sees the export stop short of its "export" line
+        logger.error(f"Export for user {user_id} failed: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+
+class _ChunkWriter:
+    """Write-only file for ZipFile; the bytes written so far are taken out between chunks."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def zip_chunks(chunks: Iterator[bytes], filename: str) -> Iterator[bytes]:
+    """A zip holding one file made of the chunks, built and sent as they arrive."""
+    writer = _ChunkWriter()
+    # The writer can't seek, so sizes go in data descriptors after the file
+    with zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        # zip64, because the size isn't known up front and may pass 4 GB
+        with archive.open(filename, "w", force_zip64=True) as entry:
+            for chunk in chunks:
+                entry.write(chunk)
+                data = writer.take()
+                if data:
+                    yield data
+    yield writer.take()
+
+
+if __name__ == "__main__":
+    import io
+    data = b"".join(zip_chunks(iter([b'{"type":"strategy"}\n'] * 3), "export.ndjson"))
+    print(zipfile.ZipFile(io.BytesIO(data)).read("export.ndjson").decode())
@@ -0,0 +1,259 @@
+# python3 -m app.services.idempotency
+import asyncio
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from loguru import logger
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.database.models import IdempotencyKey
+
+# Idempotency-Key support for POST endpoints that call the LLM. The first
+# request with a key claims it; retries with the same key get the stored
+# response, or wait for the first request while it is still running.
+#
+# The handler stores its response in the transaction of its own writes
+# (IdempotencyClaim.store), so a retry either replays the response or finds
+# nothing written and runs again. Failed requests release their key. If the
+# response can only be stored after the request's writes and that fails,
+# the key is marked failed instead: running it again could duplicate them.
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# How long a retry waits for the original request before giving up with a 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "60"))
+# A claim still running after this long belongs to a request that died
+IDEMPOTENCY_ABANDONED_SECONDS = float(os.getenv("IDEMPOTENCY_ABANDONED_SECONDS", "300"))
+IDEMPOTENCY_POLL_INTERVAL_SECONDS = 0.25
+IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS = float(os.getenv("IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS", "600"))
+IDEMPOTENCY_CLEANUP_BATCH_SIZE = 500
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_STORE_FAILED_DETAIL = (
+    "The request may have completed, but its response could not be stored. "
+    "Check before retrying with a new Idempotency-Key."
+)
+
+
+class IdempotencyKeyMismatchError(ValueError):
+    """The key was already used for a different request."""
+
+
+class IdempotencyKeyInProgressError(RuntimeError):
+    """The original request is still running."""
+
+
+def request_fingerprint(endpoint: str, payload: Any) -> str:
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{endpoint}\n{body}".encode("utf-8")).hexdigest()
+
+
+def _key_filter(user_id: str, key: str):
+    return and_(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+
+
+@dataclass
+class IdempotencyClaim:
+    """A claimed key, handed to the handler so its response commits with its writes."""
+    user_id: str
+    key: str
+    response_model: Any = None
+
+    def body(self, result: Any) -> Any:
+        # What the client got: the result validated against the response model
+        return self.response_model.model_validate(result) if self.response_model is not None else result
+
+    def store(self, db: Session, result: Any, status_code: int = 200) -> None:
+        """Record result as the response in db's open transaction; the caller commits it with its own writes."""
+        _set_response(db, self.user_id, self.key, self.body(result), status_code)
+
+
+def _replay(record: IdempotencyKey) -> JSONResponse:
+    return JSONResponse(
+        status_code=record.status_code,
+        content=json.loads(record.response),
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+
+async def claim_key(
+    db: Session,
+    user_id: str,
+    key: str,
+    request_hash: str,
+    wait: float = IDEMPOTENCY_WAIT_SECONDS
+) -> Optional[JSONResponse]:
+    """Claim the key for this request.
+
+    Returns None once claimed, or the stored response if an earlier request
+    with the same key already finished.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        now = datetime.now(timezone.utc)
+        db.add(IdempotencyKey(
+            user_id=user_id,
+            key=key,
+            request_hash=request_hash,
+            expires_at=now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+        ))
+        try:
+            db.commit()
+            return None
+        except IntegrityError:
+            db.rollback()
+
+        # Expired and abandoned claims don't count; drop them and claim again
+        stale = db.query(IdempotencyKey).filter(
+            _key_filter(user_id, key),
+            or_(
+                IdempotencyKey.expires_at <= now,
+                and_(
+                    IdempotencyKey.status_code.is_(None),
+                    IdempotencyKey.created_at <= now - timedelta(seconds=IDEMPOTENCY_ABANDONED_SECONDS)
+                )
+            )
+        ).delete(synchronize_session=False)
+        db.commit()
+        if stale:
+            continue
+
+        record = db.query(IdempotencyKey).filter(_key_filter(user_id, key)).first()
+        if record is not None:
+            if record.request_hash != request_hash:
+                raise IdempotencyKeyMismatchError("Idempotency-Key was already used for a different request.")
+            if record.status_code is not None:
+                logger.info(f"Replaying stored response for idempotency key {key}")
+                return _replay(record)
+
+        if time.monotonic() >= deadline:
+            raise IdempotencyKeyInProgressError("A request with this Idempotency-Key is still in progress.")
+        # End the transaction so the next look sees the original request's commit
+        db.rollback()
+        await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL_SECONDS)
+
+
+def _set_response(db: Session, user_id: str, key: str, body: Any, status_code: int) -> None:
+    db.query(IdempotencyKey).filter(_key_filter(user_id, key)).update(
+        {IdempotencyKey.status_code: status_code, IdempotencyKey.response: json.dumps(jsonable_encoder(body))},
+        synchronize_session=False
+    )
+
+
+def _has_response(db: Session, user_id: str, key: str) -> bool:
+    return db.query(IdempotencyKey.status_code).filter(
+        _key_filter(user_id, key),
+        IdempotencyKey.status_code.isnot(None)
+    ).first() is not None
+
+
+def store_response(db: Session, user_id: str, key: str, body: Any, status_code: int = 200) -> None:
+    _set_response(db, user_id, key, body, status_code)
+    db.commit()
+
+
+def mark_failed(db: Session, user_id: str, key: str) -> None:
+    """Keep the key claimed with an error response, so a retry can't run the request again."""
+    try:
+        db.rollback()
+        store_response(db, user_id, key, {"detail": IDEMPOTENCY_STORE_FAILED_DETAIL}, 500)
+    except Exception as e:
+        db.rollback()
+        # Left as an unfinished claim; retries get a 409 until it is abandoned
+        logger.error(f"Failed to mark idempotency key {key} as failed: {str(e)}")
+
+
+def release_key(db: Session, user_id: str, key: str) -> None:
+    """Drop an unfinished claim so a retry can run the request again. A stored response is kept."""
+    try:
+        db.rollback()
+        db.query(IdempotencyKey).filter(
+            _key_filter(user_id, key),
+            IdempotencyKey.status_code.is_(None)
+        ).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to release idempotency key {key}: {str(e)}")
+
+
+async def run_idempotent(
+    db: Session,
+    user_id: str,
+    key: Optional[str],
+    endpoint: str,
+    payload: Any,
+    handler: Callable[[Optional[IdempotencyClaim]], Awaitable[Any]],
+    response_model=None
+) -> Any:
+    """Run handler at most once per (user, Idempotency-Key).
+
+    The handler gets the claim (None without a key) and should call
+    claim.store() in the transaction that commits its writes. Responses it
+    didn't store are stored here once it returns.
+    """
+    if not key:
+        return await handler(None)
+
+    replay = await claim_key(db, user_id, key, request_fingerprint(endpoint, payload))
+    if replay is not None:
+        return replay
+
+    claim = IdempotencyClaim(user_id, key, response_model)
+    try:
+        result = await handler(claim)
+    except BaseException:
+        release_key(db, user_id, key)
+        raise
+
+    try:
+        if not _has_response(db, user_id, key):
+            store_response(db, user_id, key, claim.body(result))
+    except Exception as e:
+        logger.error(f"Failed to store response for idempotency key {key}: {str(e)}")
+        mark_failed(db, user_id, key)
+    return result
+
+
+def purge_expired_keys(db: Session, batch_size: int = IDEMPOTENCY_CLEANUP_BATCH_SIZE) -> int:
+    """Delete expired idempotency keys in batches, committing after each batch."""
+    total = 0
+    while True:
+        expired_ids = [row[0] for row in db.query(IdempotencyKey.id).filter(
+            IdempotencyKey.expires_at <= datetime.now(timezone.utc)
+        ).limit(batch_size)]
+        if not expired_ids:
+            return total
+
+        db.query(IdempotencyKey).filter(IdempotencyKey.id.in_(expired_ids)).delete(synchronize_session=False)
+        db.commit()
+        total += len(expired_ids)
+
+
+async def run_idempotency_cleanup(session_factory, interval: float = IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS) -> None:
+    """Periodically purge expired idempotency keys until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        db = session_factory()
+        try:
+            # Runs in a worker thread so the event loop isn't blocked on the DB
+            removed = await asyncio.to_thread(purge_expired_keys, db)
+            if removed:
+                logger.info(f"Removed {removed} expired idempotency keys")
+        except Exception as e:
+            logger.error(f"Idempotency key cleanup failed: {str(e)}")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    from app.database.database import SessionLocal
+    session = SessionLocal()
+    print(f"Removed {purge_expired_keys(session)} expired idempotency keys")
+    session.close()
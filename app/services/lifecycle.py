@@ -0,0 +1,172 @@
+# python3 -m app.services.lifecycle
+import asyncio
+import importlib
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# Worker start and stop.
+#
+# Warm-up runs in the startup event, which uvicorn finishes before the worker
+# accepts connections, so the first requests after a deploy don't pay for
+# it: the database pool is filled, the Gemini client and model objects are
+# built, and the heavy modules the request paths import lazily are loaded.
+#
+# Draining starts at the first SIGTERM or SIGINT. The worker reports not
+# ready and refuses new Gemini work (chat and strategy requests, new
+# WebSocket turns), but keeps serving reads. The Gemini calls and streamed
+# replies already running get up to SHUTDOWN_DRAIN_SECONDS to finish. After
+# that, uvicorn's own graceful shutdown closes the listening socket and waits
+# for the remaining requests. A second signal skips the wait.
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", "5"))
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "60"))
+
+# Imported on first use by the request paths; cheap to load here instead
+WARMUP_MODULES = ("google.generativeai", "passlib.context", "numpy", "scipy.sparse")
+
+_draining = False
+_in_flight = 0
+_drain_task: Optional[asyncio.Task] = None
+
+
+def is_draining() -> bool:
+    return _draining
+
+
+def start_draining() -> None:
+    global _draining
+    if not _draining:
+        _draining = True
+        logger.info(f"Draining: refusing new Gemini work, {_in_flight} calls still running")
+
+
+@contextmanager
+def track_work():
+    """Count a Gemini call or streamed reply that draining should wait for. Event loop only."""
+    global _in_flight
+    _in_flight += 1
+    try:
+        yield
+    finally:
+        _in_flight -= 1
+
+
+async def wait_for_drain(timeout: float = SHUTDOWN_DRAIN_SECONDS) -> bool:
+    """Wait for tracked work to finish; False if some was still running at the timeout."""
+    deadline = time.monotonic() + timeout
+    while _in_flight and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if _in_flight:
+        logger.warning(f"Drain timed out with {_in_flight} Gemini calls still running")
+        return False
+    return True
+
+
+def install_drain_handlers() -> None:
+    """Wrap the server's SIGTERM/SIGINT handlers so draining comes first.
+
+    Call from the startup event, after uvicorn has installed its handlers.
+    """
+    # Signal handlers can only be set from the main thread (not under TestClient)
+    if threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        server_handler = signal.getsignal(sig)
+        if not callable(server_handler):
+            continue
+
+        def handler(signum, frame, server_handler=server_handler):
+            if _draining:
+                server_handler(signum, frame)
+                return
+            start_draining()
+            loop.call_soon_threadsafe(_schedule_drain, loop, server_handler, signum, frame)
+
+        signal.signal(sig, handler)
+
+
+def _schedule_drain(loop: asyncio.AbstractEventLoop, server_handler, signum, frame) -> None:
+    global _drain_task
+    _drain_task = loop.create_task(_drain_then(server_handler, signum, frame))
+
+
+async def _drain_then(server_handler, signum, frame) -> None:
+    # Then let the server shut down as if the signal had just arrived
+    await wait_for_drain()
+    server_handler(signum, frame)
+
+
+def _fill_pool(engine: Engine, connections: int) -> int:
+    # Hold them all at once, so the pool really opens that many
+    size = getattr(engine.pool, "size", lambda: connections)()
+    opened = []
+    try:
+        for _ in range(min(connections, size)):
+            connection = engine.connect()
+            connection.execute(text("SELECT 1"))
+            opened.append(connection)
+    finally:
+        for connection in opened:
+            connection.close()
+    return len(opened)
+
+
+def warm_up() -> None:
+    """Pay the worker's cold-start costs before it serves requests. Failures are logged, not raised."""
+    if not WARMUP_ENABLED:
+        return
+    start = time.perf_counter()
+
+    for module in WARMUP_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            logger.warning(f"Warm-up could not import {module}: {e}")
+
+    from app.database.database import get_engine, get_replica_engine
+    try:
+        targets = (("primary", get_engine()), ("replica", get_replica_engine()))
+    except ValueError as e:
+        logger.error(f"Warm-up could not configure the database: {str(e)}")
+        targets = ()
+    for name, target in targets:
+        if target is None:
+            continue
+        try:
+            opened = _fill_pool(target, WARMUP_DB_CONNECTIONS)
+            logger.debug(f"Warm-up opened {opened} {name} database connections")
+        except Exception as e:
+            logger.error(f"Warm-up could not connect to the {name} database: {str(e)}")
+
+    try:
+        from google.generativeai import client as genai_client
+        from app.services.model_router import model_router
+        from app.services.services import get_model
+        for model_name in {model_router.quality_model, model_router.fast_model}:
+            get_model(model_name)
+        genai_client.get_default_generative_client()
+    except Exception as e:
+        logger.error(f"Warm-up could not build the Gemini client: {str(e)}")
+
+    try:
+        # passlib loads the bcrypt backend on first use, i.e. the first login
+        from app.auth.utils import password_context
+        password_context().handler("bcrypt").get_backend()
+    except Exception as e:
+        logger.error(f"Warm-up could not load the bcrypt backend: {str(e)}")
+
+    logger.info(f"Worker warmed up in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    warm_up()
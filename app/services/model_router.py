@@ -0,0 +1,140 @@
+# python3 -m app.services.model_router
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# Picks the Gemini model for each call. Rules are checked in order and the
+# first match wins; without a match the quality model is used.
+#
+# Rule fields (all optional except model):
+#   endpoint             "chat" or "strategy"
+#   max_prompt_tokens    matches prompts estimated at or below this size
+#   min_in_flight        matches when at least this many Gemini calls are running in this process
+#   min_latency_seconds  matches when the quality model's recent latency is at least this
+#   model                "fast", "quality" or a model name
+#
+# The defaults send short chat turns to the fast model and degrade everything
+# to it under load, before requests start timing out. Override them with
+# GEMINI_ROUTING_RULES (a JSON list of rules).
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
+GEMINI_FAST_MODEL = os.getenv("GEMINI_FAST_MODEL", "gemini-1.5-flash")
+
+DEFAULT_ROUTING_RULES = [
+    {"endpoint": "chat", "max_prompt_tokens": 300, "model": "fast"},
+    {"min_in_flight": 8, "model": "fast"},
+    {"min_latency_seconds": 20, "model": "fast"},
+]
+
+# Weight of the newest call in the latency moving average
+LATENCY_SMOOTHING = 0.2
+# Latency measured longer ago than this is forgotten, so a model that was
+# slow (and stopped getting traffic because of it) gets another chance
+LATENCY_MAX_AGE_SECONDS = 60
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough token count (about four characters per token); good enough for routing."""
+    return sum(len(text or "") for text in texts) // 4 + 1
+
+
+@dataclass
+class RoutingRule:
+    model: str
+    endpoint: Optional[str] = None
+    max_prompt_tokens: Optional[int] = None
+    min_in_flight: Optional[int] = None
+    min_latency_seconds: Optional[float] = None
+
+    def matches(self, endpoint: str, prompt_tokens: int, in_flight: int, latency: Optional[float]) -> bool:
+        if self.endpoint is not None and self.endpoint != endpoint:
+            return False
+        if self.max_prompt_tokens is not None and prompt_tokens > self.max_prompt_tokens:
+            return False
+        if self.min_in_flight is not None and in_flight < self.min_in_flight:
+            return False
+        if self.min_latency_seconds is not None and (latency is None or latency < self.min_latency_seconds):
+            return False
+        return True
+
+
+class ModelRouter:
+    """Chooses between the fast and quality models from the rules and current load."""
+
+    def __init__(self, rules: List[Dict], quality_model: str = GEMINI_MODEL, fast_model: str = GEMINI_FAST_MODEL):
+        self.rules = [RoutingRule(**rule) for rule in rules]
+        self.quality_model = quality_model
+        self.fast_model = fast_model
+        self._in_flight = 0
+        # model -> (moving average in seconds, when it was last updated)
+        self._latency: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def _resolve(self, model: str) -> str:
+        return {"fast": self.fast_model, "quality": self.quality_model}.get(model, model)
+
+    def recent_latency(self, model: str) -> Optional[float]:
+        average, updated_at = self._latency.get(model, (None, 0.0))
+        if average is None or time.monotonic() - updated_at > LATENCY_MAX_AGE_SECONDS:
+            return None
+        return average
+
+    def choose(self, endpoint: str, prompt_tokens: int) -> str:
+        in_flight = self._in_flight
+        latency = self.recent_latency(self.quality_model)
+        for rule in self.rules:
+            if rule.matches(endpoint, prompt_tokens, in_flight, latency):
+                model = self._resolve(rule.model)
+                if model != self.quality_model and (rule.min_in_flight or rule.min_latency_seconds):
+                    logger.info(f"Degrading {endpoint} to {model}: {in_flight} calls in flight, latency {latency}")
+                return model
+        return self.quality_model
+
+    @contextmanager
+    def track(self, model: str):
+        """Count a Gemini call as in flight and time it."""
+        with self._lock:
+            self._in_flight += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            now = time.monotonic()
+            elapsed = now - start
+            with self._lock:
+                self._in_flight -= 1
+                previous = self.recent_latency(model)
+                average = elapsed if previous is None else previous + LATENCY_SMOOTHING * (elapsed - previous)
+                self._latency[model] = (average, now)
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self._in_flight,
+            "latency_seconds": {model: self.recent_latency(model) for model in self._latency},
+        }
+
+
+def _load_rules() -> List[Dict]:
+    configured = os.getenv("GEMINI_ROUTING_RULES")
+    if not configured:
+        return DEFAULT_ROUTING_RULES
+    try:
+        rules = json.loads(configured)
+        ModelRouter(rules)
+        return rules
+    except (ValueError, TypeError) as e:
+        logger.error(f"Invalid GEMINI_ROUTING_RULES, using the defaults: {e}")
+        return DEFAULT_ROUTING_RULES
+
+
+model_router = ModelRouter(_load_rules())
+
+
+if __name__ == "__main__":
+    for endpoint, text in [("chat", "hi there"), ("chat", "x" * 4000), ("strategy", "plan")]:
+        print(endpoint, model_router.choose(endpoint, estimate_tokens(text)))
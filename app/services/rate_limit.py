@@ -0,0 +1,250 @@
+# python3 -m app.services.rate_limit
+import math
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Response, status
+from loguru import logger
+
+from app.auth.utils import get_active_user
+from app.database.models import User
+
+# Per-user sliding-window limits on the /ai endpoints. Each bucket has its own
+# budget, written as comma-separated "<count>/<second|minute|hour|day>" rules:
+#   chat      POST /ai/chatbot
+#   strategy  POST /ai/generate-strategy
+#   ai        every other /ai endpoint (reads; far more generous)
+#
+# Counters live in process memory, so each worker enforces its own limits.
+# Point RATE_LIMIT_STORE_PATH at a SQLite file to share the counters between
+# the workers on one host instead.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_STORE_PATH = os.getenv("RATE_LIMIT_STORE_PATH")
+RATE_LIMITS = {
+    "chat": os.getenv("RATE_LIMIT_CHAT", "20/minute,300/day"),
+    "strategy": os.getenv("RATE_LIMIT_STRATEGY", "5/minute,50/day"),
+    "ai": os.getenv("RATE_LIMIT_AI", "300/minute"),
+}
+
+_UNIT_SECONDS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+@dataclass(frozen=True)
+class Rule:
+    limit: int
+    window: int  # seconds
+
+    @classmethod
+    def parse_all(cls, spec: str) -> List["Rule"]:
+        rules = []
+        for part in filter(None, (item.strip() for item in spec.split(","))):
+            count, _, unit = part.partition("/")
+            rules.append(cls(int(count), _UNIT_SECONDS[unit.strip().rstrip("s")]))
+        return rules
+
+
+@dataclass
+class RateLimitStatus:
+    """The tightest rule after a check: what the X-RateLimit-* headers report."""
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_seconds: int
+    retry_after: int = 0
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(self.reset_seconds),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+# Sliding window counter: the previous fixed window's count, weighted by how
+# much of it still overlaps the sliding window, plus the current window's.
+# Two integers per rule instead of a timestamp per request.
+def _estimate(previous: int, current: int, window: int, elapsed: float) -> float:
+    return previous * (window - elapsed) / window + current
+
+
+def _retry_after(previous: int, current: int, limit: int, window: int, elapsed: float) -> float:
+    if current >= limit:
+        # Has to wait for the next window, and for the carried-over weight to fade
+        return window - elapsed + max(0.0, 1 - (limit - 1) / current) * window
+    if previous == 0:
+        return 0.0
+    return max(0.0, window - elapsed - (limit - current - 1) * window / previous)
+
+
+class MemoryStore:
+    """Counters in this process only."""
+
+    def __init__(self):
+        self._counts: Dict[Tuple[str, int, int], int] = {}
+        self._lock = threading.Lock()
+
+    def counts(self, key: str, window: int, start: int) -> Tuple[int, int]:
+        return self._counts.get((key, window, start - window), 0), self._counts.get((key, window, start), 0)
+
+    def increment(self, keys: List[Tuple[str, int, int]]) -> None:
+        for key in keys:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def transaction(self):
+        return self._lock
+
+    def prune(self, now: float) -> None:
+        with self._lock:
+            self._counts = {
+                (key, window, start): count for (key, window, start), count in self._counts.items()
+                if start + 2 * window > now
+            }
+
+
+class SQLiteStore:
+    """Counters in a SQLite file shared by every worker on the host."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_counts ("
+                "key TEXT NOT NULL, window INTEGER NOT NULL, start INTEGER NOT NULL, count INTEGER NOT NULL, "
+                "PRIMARY KEY (key, window, start)) WITHOUT ROWID"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def counts(self, key: str, window: int, start: int) -> Tuple[int, int]:
+        rows = dict(self._connect().execute(
+            "SELECT start, count FROM rate_limit_counts WHERE key = ? AND window = ? AND start IN (?, ?)",
+            (key, window, start - window, start)
+        ).fetchall())
+        return rows.get(start - window, 0), rows.get(start, 0)
+
+    def increment(self, keys: List[Tuple[str, int, int]]) -> None:
+        self._connect().executemany(
+            "INSERT INTO rate_limit_counts (key, window, start, count) VALUES (?, ?, ?, 1) "
+            "ON CONFLICT (key, window, start) DO UPDATE SET count = count + 1",
+            keys
+        )
+
+    def transaction(self):
+        return _SQLiteTransaction(self._connect())
+
+    def prune(self, now: float) -> None:
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM rate_limit_counts WHERE start + 2 * window <= ?", (now,))
+
+
+class _SQLiteTransaction:
+    # BEGIN IMMEDIATE takes the write lock up front, so check-then-increment is atomic across processes
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, tb):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+class RateLimiter:
+    def __init__(self, limits: Dict[str, str], store=None):
+        self.rules = {bucket: Rule.parse_all(spec) for bucket, spec in limits.items()}
+        self.store = store or MemoryStore()
+        self._last_pruned = time.time()
+
+    def check(self, user_id: str, bucket: str, consume: bool = True) -> Optional[RateLimitStatus]:
+        """Count one request against every rule of the bucket, unless any rule is exhausted.
+
+        Returns None for buckets without rules. consume=False only reports.
+        """
+        rules = self.rules.get(bucket)
+        if not rules:
+            return None
+        now = time.time()
+        key = f"{bucket}:{user_id}"
+        results = []
+        with self.store.transaction():
+            for rule in rules:
+                start = int(now // rule.window * rule.window)
+                elapsed = now - start
+                previous, current = self.store.counts(key, rule.window, start)
+                estimate = _estimate(previous, current, rule.window, elapsed)
+                results.append((rule, start, elapsed, previous, current, estimate))
+
+            allowed = all(estimate + 1 <= rule.limit for rule, _, _, _, _, estimate in results)
+            if allowed and consume:
+                self.store.increment([(key, rule.window, start) for rule, start, _, _, _, _ in results])
+
+        statuses = []
+        for rule, start, elapsed, previous, current, estimate in results:
+            used = estimate + (1 if allowed and consume else 0)
+            statuses.append(RateLimitStatus(
+                allowed=estimate + 1 <= rule.limit,
+                limit=rule.limit,
+                remaining=max(0, math.floor(rule.limit - used)),
+                reset_seconds=math.ceil(rule.window - elapsed),
+                retry_after=math.ceil(_retry_after(previous, current, rule.limit, rule.window, elapsed)),
+            ))
+
+        if now - self._last_pruned > 3600:
+            self._last_pruned = now
+            self.store.prune(now)
+
+        # Report the rule closest to running out (or the one that refused)
+        tightest = min(statuses, key=lambda s: (s.allowed, s.remaining / s.limit))
+        if not allowed:
+            tightest.retry_after = max(s.retry_after for s in statuses if not s.allowed)
+        tightest.allowed = allowed
+        return tightest
+
+    def status(self, user_id: str) -> Dict[str, RateLimitStatus]:
+        return {bucket: self.check(user_id, bucket, consume=False) for bucket in self.rules if self.rules[bucket]}
+
+
+rate_limiter = None
+if RATE_LIMIT_ENABLED:
+    rate_limiter = RateLimiter(RATE_LIMITS, SQLiteStore(RATE_LIMIT_STORE_PATH) if RATE_LIMIT_STORE_PATH else None)
+
+
+def rate_limit(bucket: str):
+    """Dependency that counts the request against the user's bucket, or answers 429."""
+    def dependency(response: Response, current_user: User = Depends(get_active_user)) -> None:
+        if rate_limiter is None:
+            return
+        result = rate_limiter.check(current_user.id, bucket)
+        if result is None:
+            return
+        if not result.allowed:
+            logger.warning(f"Rate limit hit: {bucket} for user {current_user.email}")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"Too many {bucket} requests. Try again in {result.retry_after} seconds.",
+                headers=result.headers()
+            )
+        response.headers.update(result.headers())
+    return dependency
+
+
+if __name__ == "__main__":
+    limiter = RateLimiter({"demo": "3/second"})
+    print([limiter.check("user", "demo").allowed for _ in range(5)])
@@ -0,0 +1,170 @@
+# python3 -m app.services.semantic_cache
+import os
+import threading
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+
+class SemanticCache:
+    """In-process vector index mapping message embeddings to cached answers.
+
+    Vectors live in one preallocated float32 matrix so a lookup is a single
+    matrix product. Entries expire after ttl_seconds and the least recently
+    used entry is evicted once max_entries is reached.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        max_entries: int = 1000,
+        ttl_seconds: float = 86400,
+        path: Optional[str] = None,
+        save_interval: float = 60,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.save_interval = save_interval
+
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._expires_at = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._questions: List[str] = [""] * max_entries
+        self._answers: List[str] = [""] * max_entries
+        self._last_saved = time.time()
+
+        if path and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _live_mask(self, now: float) -> np.ndarray:
+        return self._valid & (self._expires_at > now)
+
+    # Returns the cached answer for each query vector, or None below the threshold
+    def lookup_many(self, vectors: Sequence[Sequence[float]]) -> List[Optional[str]]:
+        queries = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1))
+        now = time.time()
+
+        with self._lock:
+            results: List[Optional[str]] = [None] * len(queries)
+            if self._vectors is None or queries.shape[1] != self._vectors.shape[1]:
+                return results
+
+            live = np.flatnonzero(self._live_mask(now))
+            if live.size == 0:
+                return results
+
+            # Cosine similarity of every query against every live entry at once
+            scores = queries @ self._vectors[live].T
+            best = scores.argmax(axis=1)
+            for i, column in enumerate(best):
+                if scores[i, column] >= self.threshold:
+                    slot = live[column]
+                    self._last_used[slot] = now
+                    results[i] = self._answers[slot]
+            return results
+
+    def lookup(self, vector: Sequence[float]) -> Optional[str]:
+        return self.lookup_many([vector])[0]
+
+    def add(self, vector: Sequence[float], question: str, answer: str) -> None:
+        query = self._normalize(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        now = time.time()
+
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != query.shape[0]:
+                # First entry, or the embedding model changed - start over
+                self._vectors = np.zeros((self.max_entries, query.shape[0]), dtype=np.float32)
+                self._valid[:] = False
+
+            free = np.flatnonzero(~self._live_mask(now))
+            if free.size:
+                slot = free[0]
+            else:
+                slot = int(self._last_used.argmin())
+
+            self._vectors[slot] = query
+            self._expires_at[slot] = now + self.ttl_seconds
+            self._last_used[slot] = now
+            self._valid[slot] = True
+            self._questions[slot] = question
+            self._answers[slot] = answer
+
+            should_save = self.path and now - self._last_saved >= self.save_interval
+
+        if should_save:
+            self.save()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(self._live_mask(time.time()).sum())
+
+    # Writes the index to disk as a single .npz file
+    def save(self) -> None:
+        if not self.path:
+            return
+
+        with self._lock:
+            if self._vectors is None:
+                return
+            live = np.flatnonzero(self._live_mask(time.time()))
+            payload = {
+                "vectors": self._vectors[live],
+                "expires_at": self._expires_at[live],
+                "last_used": self._last_used[live],
+                "questions": np.array([self._questions[i] for i in live], dtype=str),
+                "answers": np.array([self._answers[i] for i in live], dtype=str),
+            }
+            self._last_saved = time.time()
+
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez_compressed(f, **payload)
+            os.replace(tmp_path, self.path)
+            logger.debug(f"Semantic cache saved: {len(live)} entries")
+        except OSError as e:
+            logger.error(f"Failed to save semantic cache: {e}")
+
+    def load(self) -> None:
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                vectors = data["vectors"]
+                expires_at = data["expires_at"]
+                last_used = data["last_used"]
+                questions = data["questions"].tolist()
+                answers = data["answers"].tolist()
+        except (OSError, KeyError, ValueError) as e:
+            logger.error(f"Failed to load semantic cache from {self.path}: {e}")
+            return
+
+        # Keep the most recently used entries if the file holds more than fits
+        keep = np.argsort(last_used)[::-1][: self.max_entries]
+        with self._lock:
+            if len(keep):
+                self._vectors = np.zeros((self.max_entries, vectors.shape[1]), dtype=np.float32)
+            for slot, i in enumerate(keep):
+                self._vectors[slot] = vectors[i]
+                self._expires_at[slot] = expires_at[i]
+                self._last_used[slot] = last_used[i]
+                self._valid[slot] = True
+                self._questions[slot] = questions[i]
+                self._answers[slot] = answers[i]
+        logger.info(f"Semantic cache loaded: {len(keep)} entries from {self.path}")
+
+
+if __name__ == "__main__":
+    cache = SemanticCache(threshold=0.9, max_entries=2)
+    cache.add([1.0, 0.0], "How do I grow my Instagram following?", "Post consistently.")
+    print(cache.lookup([0.99, 0.05]))
@@ -2,11 +2,16 @@
 # source .venv/bin/activate
 import os
 import sys
+import threading
 from dotenv import load_dotenv, find_dotenv
 from loguru import logger
-from typing import List, Dict, Any, Optional
-import google.generativeai as genai
-from app.schemas.strategy import StrategyRequest
+from typing import List, Dict, Any, Iterator, Optional
+from app.schemas.strategy import StrategyRequest, StrategyResponse
+from app.services.structured_output import gemini_response_schema, parse_strategy_response
+from app.services.semantic_cache import SemanticCache
+from app.services.usage import add_token_usage
+from app.services.model_router import model_router, estimate_tokens
+from app.services.deadlines import call_timeout, check_deadline, RequestAbandonedError
 
 # Custom exceptions
 class GeminiQuotaExceededError(Exception):
@@ -34,13 +39,77 @@ class GeminiContentFilterError(Exception):
 # Get API key from environment variable
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
+# Calls slower than this give up; a timed-out quality model call is retried on the fast model
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "60"))
 
-if __name__ == "__main__":
-    # ... keep existing code (API key checking and logging)
+# Gemini enforces this schema on the generated strategy JSON
+STRATEGY_RESPONSE_SCHEMA = gemini_response_schema(StrategyResponse)
+
+# Opt-in semantic cache for first chatbot messages
+GEMINI_EMBEDDING_MODEL = os.getenv("GEMINI_EMBEDDING_MODEL", "models/text-embedding-004")
+CHAT_SEMANTIC_CACHE_ENABLED = os.getenv("CHAT_SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+
+chat_response_cache = None
+if CHAT_SEMANTIC_CACHE_ENABLED:
+    chat_response_cache = SemanticCache(
+        threshold=float(os.getenv("CHAT_SEMANTIC_CACHE_THRESHOLD", "0.92")),
+        max_entries=int(os.getenv("CHAT_SEMANTIC_CACHE_MAX_ENTRIES", "1000")),
+        ttl_seconds=float(os.getenv("CHAT_SEMANTIC_CACHE_TTL_SECONDS", "86400")),
+        path=os.getenv("CHAT_SEMANTIC_CACHE_PATH") or None,
+    )
+
+# The Gemini SDK is the slowest import in the app, so it is loaded (and
+# configured) on first use rather than when this module is imported
+genai = None
+_genai_lock = threading.Lock()
+
+def _genai():
+    """The configured google.generativeai module."""
+    global genai
+    if genai is None:
+        with _genai_lock:
+            if genai is None:
+                import google.generativeai as sdk
+                if GEMINI_API_KEY:
+                    sdk.configure(api_key=GEMINI_API_KEY)
+                genai = sdk
+    return genai
+
+# GenerativeModel objects are reusable across requests; build each one once
+_models: Dict[str, Any] = {}
+_models_lock = threading.Lock()
+
+def get_model(name: str):
+    """The shared GenerativeModel for a model name."""
+    model = _models.get(name)
+    if model is None:
+        with _models_lock:
+            model = _models.get(name)
+            if model is None:
+                model = _models[name] = _genai().GenerativeModel(name)
+    return model
+
+def _is_timeout(error: Exception) -> bool:
+    text = f"{type(error).__name__} {error}".lower()
+    return "deadline" in text or "timeout" in text or "timed out" in text
 
-# Configure Gemini
-    if GEMINI_API_KEY:
-        genai.configure(api_key=GEMINI_API_KEY)
+def _call_model(model_name: str, call):
+    """Run call(model_name) as a tracked Gemini call; returns (response, model that answered).
+
+    The model router sees every call's latency. If anything but the fast
+    model times out, the call is retried once on the fast model.
+    """
+    try:
+        with model_router.track(model_name):
+            return call(model_name), model_name
+    except Exception as e:
+        if model_name == model_router.fast_model or not _is_timeout(e):
+            raise
+        # No second call for a request that has run out of time
+        check_deadline()
+        logger.warning(f"{model_name} timed out; retrying on {model_router.fast_model}")
+    with model_router.track(model_router.fast_model):
+        return call(model_router.fast_model), model_router.fast_model
 
 def generate_business_strategy(strategy_request: StrategyRequest) -> Dict[str, Any]:
     """Generate a business strategy using Gemini API."""
@@ -73,18 +142,12 @@ def generate_business_strategy(strategy_request: StrategyRequest) -> Dict[str, A
         4. A specific action plan with steps
         5. Resource recommendations
         
-        Format your response as a valid JSON object with these keys:
-        - title
-        - summary
-        - strategies (array)
-        - action_plan (array)
-        - resources (array)
-        
-        Very important: Return ONLY the JSON object with no additional text, markdown formatting, or code block syntax.
+        Each action plan step should be a single sentence that includes its timeline and budget.
+        Each resource needs a name and the purpose it serves.
         """
 
-        # Configure the model
-        model = genai.GenerativeModel(GEMINI_MODEL)
+        # Pick the model for this prompt and the current load
+        model_name = model_router.choose("strategy", estimate_tokens(prompt))
         
         try:
             # Handle rate limits and quotas for free tier
@@ -97,7 +160,7 @@ def generate_business_strategy(strategy_request: StrategyRequest) -> Dict[str, A
 
             
             # Generate content with retry logic for free tier limitations
-            response = model.generate_content(
+            response, model_name = _call_model(model_name, lambda name: get_model(name).generate_content(
                 prompt,
                 generation_config={
                     "temperature": 0.7,
@@ -105,53 +168,28 @@ def generate_business_strategy(strategy_request: StrategyRequest) -> Dict[str, A
                     "top_k": 40,
                     "max_output_tokens": 2048,
                     "response_mime_type": "application/json",
+                    "response_schema": STRATEGY_RESPONSE_SCHEMA,
                 },
                 safety_settings=safety_settings,
-            )
+                request_options={"timeout": call_timeout(GEMINI_TIMEOUT_SECONDS)},
+            ))
             
+            add_token_usage(response, model_name)
+
             # Extract the generated content
             strategy_content = response.text
             
             # Log successful API call
             logger.info(f"Successfully generated strategy for {strategy_request.business_name}")
             
-            import json
-            # Parse JSON response
+            # Schema-constrained output normally parses as-is; the tolerant
+            # parser recovers fences, trailing commas and truncated responses.
             try:
-                # Clean up markdown code blocks if present
-                cleaned_content = strategy_content
-                
-                # Remove markdown code block markers if they exist
-                if cleaned_content.startswith("```"):
-                    # Find the first closing code block
-                    cleaned_content = cleaned_content.replace("```json", "", 1)
-                    cleaned_content = cleaned_content.replace("```", "", 1)
-                    
-                # Remove trailing code block markers if they exist
-                if cleaned_content.endswith("```"):
-                    cleaned_content = cleaned_content[:-3]
-                    
-                # Trim whitespace
-                cleaned_content = cleaned_content.strip()
-                
-                logger.debug(f"Cleaned JSON content: {cleaned_content[:200]}...")
-                
-                return json.loads(cleaned_content)
-            except json.JSONDecodeError as e:
+                return parse_strategy_response(strategy_content, strategy_request.business_name)
+            except ValueError as e:
                 logger.error(f"Failed to parse Gemini response as JSON: {strategy_content[:100]}...")
                 logger.error(f"JSON parse error: {str(e)}")
-                
-                # Attempt to extract JSON if Gemini returned text with JSON inside
-                import re
-                json_match = re.search(r'({.*})', strategy_content, re.DOTALL)
-                if json_match:
-                    try:
-                        extracted_json = json_match.group(1)
-                        logger.info(f"Successfully extracted JSON from text response")
-                        return json.loads(extracted_json)
-                    except json.JSONDecodeError:
-                        logger.error(f"Failed to parse extracted JSON")
-                        
+
                 # Fallback response
                 return {
                     "title": f"Strategic Plan for {strategy_request.business_name}",
@@ -161,7 +199,10 @@ def generate_business_strategy(strategy_request: StrategyRequest) -> Dict[str, A
                     "resources": []
                 }
                 
+        except RequestAbandonedError:
+            raise
         except Exception as e:
+            check_deadline()
             error_message = str(e)
             logger.error(f"Gemini API error: {error_message}")
             
@@ -193,7 +234,7 @@ def generate_business_strategy(strategy_request: StrategyRequest) -> Dict[str, A
             # Handle other API errors
             raise GeminiAPIError(f"Gemini API error: {error_message}")
         
-    except GeminiQuotaExceededError:
+    except (GeminiQuotaExceededError, RequestAbandonedError):
         # Re-raise quota errors
         raise
     except GeminiContentFilterError:
@@ -206,8 +247,33 @@ def generate_business_strategy(strategy_request: StrategyRequest) -> Dict[str, A
         logger.error(f"Error generating strategy: {e}")
         raise
 
-def generate_chatbot_response(message: str, conversation_history: List[Dict[str, str]] = None) -> str:
-    """Generate a chatbot response using Gemini API."""
+def embed_text(text: str) -> List[float]:
+    """Embed text with the Gemini embedding model."""
+    result = _genai().embed_content(
+        model=GEMINI_EMBEDDING_MODEL,
+        content=text,
+        task_type="semantic_similarity",
+    )
+    return result["embedding"]
+
+CHAT_SYSTEM_PROMPT = """You are an expert business consultant for Aspire, 
+        providing practical advice and strategies for small and medium-sized businesses. 
+        Keep your responses concise, actionable, and evidence-based. When appropriate, use 
+        examples and case studies to illustrate your points. Your goal is to help businesses 
+        grow and overcome challenges with practical, implementable advice."""
+
+def format_history(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Convert {"role", "content"} messages to Gemini chat history; formatted entries pass through."""
+    return [
+        msg if "parts" in msg else {"role": "user" if msg["role"] == "user" else "model", "parts": [msg["content"]]}
+        for msg in messages
+    ]
+
+def generate_chatbot_response(message: str, conversation_history: List[Dict[str, Any]] = None) -> str:
+    """Generate a chatbot response using Gemini API.
+
+    The history may be plain messages or already formatted with format_history.
+    """
     
     if not GEMINI_API_KEY:
         logger.error("Gemini API key not found in environment variables")
@@ -219,43 +285,63 @@ def generate_chatbot_response(message: str, conversation_history: List[Dict[str,
     
     if conversation_history is None:
         conversation_history = []
+
+    # Only context-free turns may be answered from the cache, so
+    # personalized follow-ups always reach the model
+    cache_vector = None
+    if chat_response_cache is not None and not conversation_history:
+        try:
+            cache_vector = embed_text(message)
+            cached_response = chat_response_cache.lookup(cache_vector)
+            if cached_response is not None:
+                logger.info("Chatbot response served from semantic cache")
+                return cached_response
+        except Exception as e:
+            logger.error(f"Semantic cache lookup failed: {e}")
+            cache_vector = None
         
     try:
-        # Configure the model
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        
         # Format conversation history for Gemini
-        formatted_history = []
-        if conversation_history:
-            for msg in conversation_history:
-                role = "user" if msg["role"] == "user" else "model"
-                formatted_history.append({"role": role, "parts": [msg["content"]]})
-        
-        # Create a new chat session
-        chat = model.start_chat(history=formatted_history)
+        formatted_history = format_history(conversation_history)
+
+        # Short turns go to the fast model, as does everything under load
+        model_name = model_router.choose(
+            "chat", estimate_tokens(message, *(msg["parts"][0] for msg in formatted_history))
+        )
         
         # System prompt
-        system_prompt = """You are an expert business consultant for Aspire, 
-        providing practical advice and strategies for small and medium-sized businesses. 
-        Keep your responses concise, actionable, and evidence-based. When appropriate, use 
-        examples and case studies to illustrate your points. Your goal is to help businesses 
-        grow and overcome challenges with practical, implementable advice."""
+        system_prompt = CHAT_SYSTEM_PROMPT
         
-        # Add system prompt if this is the first message
-        if not conversation_history:
-            try:
-                chat.send_message(system_prompt)
-            except Exception as e:
-                logger.error(f"Error sending system prompt: {e}")
-                # Continue with user message even if system prompt fails
+        def converse(name):
+            # Create a new chat session
+            chat = get_model(name).start_chat(history=formatted_history)
+
+            # Add system prompt if this is the first message
+            if not conversation_history:
+                try:
+                    add_token_usage(chat.send_message(system_prompt, request_options={"timeout": call_timeout(GEMINI_TIMEOUT_SECONDS)}), name)
+                except Exception as e:
+                    logger.error(f"Error sending system prompt: {e}")
+                    # Continue with user message even if system prompt fails
+
+            # Send user message
+            return chat.send_message(message, request_options={"timeout": call_timeout(GEMINI_TIMEOUT_SECONDS)})
         
         try:
-            # Send user message
-            response = chat.send_message(message)
+            response, model_name = _call_model(model_name, converse)
+            add_token_usage(response, model_name)
             response_text = response.text
+
+            if cache_vector is not None:
+                chat_response_cache.add(cache_vector, message, response_text)
+
             return response_text
             
+        except RequestAbandonedError:
+            raise
         except Exception as e:
+            # A call cut short by the deadline isn't worth a fallback
+            check_deadline()
             error_message = str(e)
             logger.error(f"Gemini API error in chatbot: {error_message}")
             
@@ -267,18 +353,65 @@ def generate_chatbot_response(message: str, conversation_history: List[Dict[str,
             try:
                 # Simplified prompt
                 simple_prompt = f"{system_prompt}\n\nUser: {message}"
-                simple_response = model.generate_content(simple_prompt)
+                simple_response = get_model(model_name).generate_content(
+                    simple_prompt, request_options={"timeout": call_timeout(GEMINI_TIMEOUT_SECONDS)}
+                )
+                add_token_usage(simple_response, model_name)
                 return simple_response.text
             except:
                 # All attempts failed
                 return "I'm sorry, I encountered an error while processing your request. Please try again later."
             
-    except GeminiQuotaExceededError:
+    except (GeminiQuotaExceededError, RequestAbandonedError):
         # Re-raise quota errors for proper handling at the router level
         raise
     except Exception as e:
         logger.error(f"Error generating chatbot response: {e}")
         return "I'm sorry, I encountered an error while processing your request. Please try again later."
 
+def stream_chatbot_response(
+    message: str,
+    conversation_history: List[Dict[str, Any]] = None,
+    cancelled: Optional[threading.Event] = None
+) -> Iterator[str]:
+    """Generate a chatbot response, yielding text chunks as Gemini produces them.
+
+    Stops early once cancelled is set. Unlike generate_chatbot_response there
+    is no semantic cache and no retry: part of the reply may already be sent.
+    """
+    if not GEMINI_API_KEY or GEMINI_API_KEY == "your-gemini-api-key":
+        logger.error("Gemini API key not configured")
+        raise ValueError("Gemini API key not configured")
+
+    formatted_history = format_history(conversation_history or [])
+    model_name = model_router.choose(
+        "chat", estimate_tokens(message, *(msg["parts"][0] for msg in formatted_history))
+    )
+    chat = get_model(model_name).start_chat(history=formatted_history)
+    if not formatted_history:
+        try:
+            add_token_usage(chat.send_message(CHAT_SYSTEM_PROMPT, request_options={"timeout": call_timeout(GEMINI_TIMEOUT_SECONDS)}), model_name)
+        except Exception as e:
+            logger.error(f"Error sending system prompt: {e}")
+
+    last_chunk = None
+    with model_router.track(model_name):
+        try:
+            for chunk in chat.send_message(message, stream=True, request_options={"timeout": call_timeout(GEMINI_TIMEOUT_SECONDS)}):
+                if cancelled is not None and cancelled.is_set():
+                    break
+                last_chunk = chunk
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            error_message = str(e)
+            logger.error(f"Gemini API error in streaming chatbot: {error_message}")
+            if "quota" in error_message.lower() or "rate limit" in error_message.lower():
+                raise GeminiQuotaExceededError("Gemini API quota exceeded or rate limited. This may be due to free tier limitations.")
+            raise GeminiAPIError(f"Gemini API error: {error_message}")
+        finally:
+            # The last chunk carries the usage of the whole response so far
+            add_token_usage(last_chunk, model_name)
+
 if __name__ == "__main__":
     print("AI Router script is running")
\ No newline at end of file
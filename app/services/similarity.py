@@ -0,0 +1,286 @@
+# python3 -m app.services.similarity
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from loguru import logger
+from sqlalchemy.orm import Session
+
+from app.database.models import SavedStrategy, strategy_text
+from app.schemas.strategy import StrategyRequest
+
+_TOKEN_RE = re.compile(r"[a-z0-9]{2,}")
+
+# Users whose strategies are kept in memory; the least recently used go
+# first, and so does anyone idle for longer than STRATEGY_INDEX_IDLE_SECONDS.
+# An evicted user is loaded again from the database on their next lookup.
+STRATEGY_INDEX_MAX_USERS = int(os.getenv("STRATEGY_INDEX_MAX_USERS", "10000"))
+STRATEGY_INDEX_IDLE_SECONDS = float(os.getenv("STRATEGY_INDEX_IDLE_SECONDS", "3600"))
+
+
+class _UserDocuments:
+    """Term-frequency rows for one user's saved strategies."""
+
+    def __init__(self):
+        self.rows: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.loaded_at = 0.0
+        self.last_used = time.monotonic()
+        self._matrix: Optional[sparse.csr_matrix] = None
+        self._squared: Optional[sparse.csr_matrix] = None
+        self._ids: List[str] = []
+
+    def invalidate(self) -> None:
+        self._matrix = None
+
+    # Assembles (and caches) the user's rows into one CSR matrix, along with
+    # its element-wise square used for the IDF-weighted row norms
+    def matrix(self, n_features: int) -> Tuple[List[str], sparse.csr_matrix, sparse.csr_matrix]:
+        if self._matrix is None:
+            self._ids = list(self.rows)
+            indptr = [0]
+            indices, data = [], []
+            for doc_id in self._ids:
+                columns, values = self.rows[doc_id]
+                indices.append(columns)
+                data.append(values)
+                indptr.append(indptr[-1] + len(columns))
+            self._matrix = sparse.csr_matrix(
+                (
+                    np.concatenate(data) if data else np.zeros(0, dtype=np.float32),
+                    np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32),
+                    np.asarray(indptr, dtype=np.int64),
+                ),
+                shape=(len(self._ids), n_features),
+            )
+            self._squared = self._matrix.multiply(self._matrix).tocsr()
+        return self._ids, self._matrix, self._squared
+
+
+class StrategyIndex:
+    """Incremental TF-IDF index over saved strategies.
+
+    Terms are hashed into a fixed feature space, so adding a document never
+    reshapes existing rows. Document frequencies are global and IDF weights are
+    applied at query time, which keeps inserts and deletes O(document length).
+    Each user's rows form their own small CSR matrix, so lookups only ever
+    score that user's strategies. Users are kept in an LRU capped at
+    max_users, and dropped after idle_seconds without use.
+    """
+
+    def __init__(
+        self,
+        n_features: int = 2 ** 18,
+        refresh_seconds: float = 300,
+        field_weight: int = 3,
+        max_users: int = STRATEGY_INDEX_MAX_USERS,
+        idle_seconds: float = STRATEGY_INDEX_IDLE_SECONDS
+    ):
+        self.n_features = n_features
+        self.refresh_seconds = refresh_seconds
+        self.field_weight = field_weight
+        self.max_users = max_users
+        self.idle_seconds = idle_seconds
+
+        self._lock = threading.Lock()
+        self._doc_freq = np.zeros(n_features, dtype=np.int32)
+        self._n_docs = 0
+        self._users: "OrderedDict[str, _UserDocuments]" = OrderedDict()
+
+    def _vectorize(self, title: str, business_name: str, industry: str, content: str) -> Tuple[np.ndarray, np.ndarray]:
+        counts: Dict[int, float] = {}
+        # Short fields say a lot about what a strategy is for, so weight them up
+        fields = [
+            (f"{title or ''} {business_name or ''} {industry or ''}", self.field_weight),
+            (content or "", 1),
+        ]
+        for text, weight in fields:
+            for token in _TOKEN_RE.findall(text.lower()):
+                column = zlib.crc32(token.encode()) % self.n_features
+                counts[column] = counts.get(column, 0.0) + weight
+
+        columns = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+        order = np.argsort(columns)
+        values = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        return columns[order], values[order].astype(np.float32)
+
+    # Marks the user's documents as just used (creating them if asked), and
+    # evicts whoever is idle or over the cap
+    def _use_locked(self, user_id: str, create: bool = False) -> Optional[_UserDocuments]:
+        documents = self._users.get(user_id)
+        if documents is None:
+            if not create:
+                return None
+            documents = self._users[user_id] = _UserDocuments()
+        documents.last_used = time.monotonic()
+        self._users.move_to_end(user_id)
+        self._evict_locked(documents.last_used)
+        return documents
+
+    def _evict_locked(self, now: float) -> None:
+        # Least recently used first, so stop at the first user still in use
+        while self._users:
+            user_id, documents = next(iter(self._users.items()))
+            if len(self._users) <= self.max_users and now - documents.last_used <= self.idle_seconds:
+                break
+            del self._users[user_id]
+            for columns, _ in documents.rows.values():
+                self._doc_freq[columns] -= 1
+            self._n_docs -= len(documents.rows)
+
+    def _add_locked(self, user_id: str, doc_id: str, row: Tuple[np.ndarray, np.ndarray]) -> None:
+        documents = self._use_locked(user_id, create=True)
+        self._remove_locked(user_id, doc_id)
+        documents.rows[doc_id] = row
+        documents.invalidate()
+        self._doc_freq[row[0]] += 1
+        self._n_docs += 1
+
+    def _remove_locked(self, user_id: str, doc_id: str) -> None:
+        documents = self._users.get(user_id)
+        if documents is None or doc_id not in documents.rows:
+            return
+        columns, _ = documents.rows.pop(doc_id)
+        documents.invalidate()
+        self._doc_freq[columns] -= 1
+        self._n_docs -= 1
+
+    def add(self, user_id: str, doc_id: str, title: str, business_name: str, industry: str, content: str) -> None:
+        row = self._vectorize(title, business_name, industry, content)
+        with self._lock:
+            self._add_locked(user_id, doc_id, row)
+
+    def remove(self, user_id: str, doc_id: str) -> None:
+        with self._lock:
+            self._remove_locked(user_id, doc_id)
+
+    # Loads a user's strategies from the DB on first use and refreshes them
+    # periodically, so writes made by other workers are picked up.
+    def ensure_loaded(self, db: Session, user_id: str) -> None:
+        with self._lock:
+            documents = self._use_locked(user_id)
+        if documents is not None and time.time() - documents.loaded_at < self.refresh_seconds:
+            return
+
+        strategies = db.query(
+            SavedStrategy.id,
+            SavedStrategy.title,
+            SavedStrategy.business_name,
+            SavedStrategy.industry,
+            SavedStrategy.content,
+            SavedStrategy.document,
+        ).filter(SavedStrategy.user_id == user_id).all()
+        rows = {
+            s.id: self._vectorize(s.title, s.business_name, s.industry, strategy_text(s.content, s.document))
+            for s in strategies
+        }
+
+        with self._lock:
+            existing = self._users.get(user_id)
+            for doc_id in list(existing.rows) if existing else []:
+                self._remove_locked(user_id, doc_id)
+            for doc_id, row in rows.items():
+                self._add_locked(user_id, doc_id, row)
+            self._use_locked(user_id, create=True).loaded_at = time.time()
+
+        logger.debug(f"Strategy index loaded {len(rows)} strategies for user {user_id}")
+
+    def _query(self, user_id: str, row: Tuple[np.ndarray, np.ndarray], limit: int, exclude_id: Optional[str]) -> List[Tuple[str, float]]:
+        with self._lock:
+            documents = self._use_locked(user_id)
+            if documents is None or not documents.rows:
+                return []
+            ids, matrix, squared = documents.matrix(self.n_features)
+            idf = (np.log((1.0 + self._n_docs) / (1.0 + self._doc_freq)) + 1.0).astype(np.float32)
+
+        columns, values = row
+        if len(columns) == 0:
+            return []
+        query = values * idf[columns]
+        query /= np.linalg.norm(query) or 1.0
+
+        # Cosine similarity of the query against every row in one sparse product:
+        # score = (D * idf) . q / |D * idf|
+        weighted_query = np.zeros(self.n_features, dtype=np.float32)
+        weighted_query[columns] = query * idf[columns]
+        norms = np.sqrt(squared @ (idf * idf))
+        norms[norms == 0] = 1.0
+        scores = (matrix @ weighted_query) / norms
+
+        if exclude_id is not None and exclude_id in ids:
+            scores[ids.index(exclude_id)] = -1.0
+
+        k = min(limit, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(ids[i], float(scores[i])) for i in top if scores[i] > 0]
+
+    # Returns (strategy_id, score) pairs most similar to a saved strategy
+    def similar_to(self, user_id: str, doc_id: str, limit: int = 5) -> List[Tuple[str, float]]:
+        with self._lock:
+            documents = self._users.get(user_id)
+            row = documents.rows.get(doc_id) if documents else None
+        if row is None:
+            return []
+        return self._query(user_id, row, limit, exclude_id=doc_id)
+
+    # Returns (strategy_id, score) pairs most similar to free text
+    def search(self, user_id: str, title: str, business_name: str, industry: str, content: str, limit: int = 5) -> List[Tuple[str, float]]:
+        row = self._vectorize(title, business_name, industry, content)
+        return self._query(user_id, row, limit, exclude_id=None)
+
+    # Returns (strategy_id, score) pairs similar to a strategy generation request
+    def similar_to_request(self, user_id: str, strategy_request: StrategyRequest, limit: int = 5) -> List[Tuple[str, float]]:
+        details = [strategy_request.challenges, strategy_request.goals, strategy_request.target_audience]
+        return self.search(
+            user_id,
+            title="",
+            business_name=strategy_request.business_name,
+            industry=strategy_request.industry,
+            content=" ".join(filter(None, details)),
+            limit=limit,
+        )
+
+    # Turns (strategy_id, score) pairs into response dicts, dropping ids that
+    # no longer exist (e.g. deleted by another worker)
+    def resolve(self, db: Session, user_id: str, matches: List[Tuple[str, float]]) -> List[Dict]:
+        if not matches:
+            return []
+        strategies = db.query(
+            SavedStrategy.id,
+            SavedStrategy.title,
+            SavedStrategy.business_name,
+            SavedStrategy.industry,
+            SavedStrategy.created_at,
+        ).filter(
+            SavedStrategy.user_id == user_id,
+            SavedStrategy.id.in_([doc_id for doc_id, _ in matches])
+        ).all()
+        by_id = {s.id: s for s in strategies}
+
+        return [
+            {
+                "id": doc_id,
+                "title": by_id[doc_id].title,
+                "business_name": by_id[doc_id].business_name,
+                "industry": by_id[doc_id].industry,
+                "created_at": by_id[doc_id].created_at,
+                "score": round(score, 4),
+            }
+            for doc_id, score in matches if doc_id in by_id
+        ]
+
+
+strategy_index = StrategyIndex()
+
+
+if __name__ == "__main__":
+    index = StrategyIndex()
+    index.add("u1", "a", "Grow Instagram", "Bloom Cafe", "Food", "social media instagram followers growth")
+    index.add("u1", "b", "Cut costs", "Bloom Cafe", "Food", "supplier negotiation and inventory")
+    print(index.search("u1", "", "Bloom Cafe", "Food", "grow instagram followers"))
@@ -0,0 +1,212 @@
+# python3 -m app.services.structured_output
+import json
+from typing import Any, Dict, List, Type
+
+from pydantic import BaseModel
+
+# Keys of a pydantic JSON schema that Gemini's response_schema understands
+_SCHEMA_PASSTHROUGH_KEYS = ("description", "enum", "format")
+
+
+# Builds a Gemini-compatible response_schema from a pydantic model.
+# Gemini doesn't accept $ref/$defs, titles or anyOf, so refs are inlined and
+# Optional[X] is turned into a nullable X.
+def gemini_response_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    schema = model.model_json_schema()
+    definitions = schema.get("$defs", {})
+
+    def convert(node: Dict[str, Any]) -> Dict[str, Any]:
+        if "$ref" in node:
+            node = definitions[node["$ref"].rsplit("/", 1)[-1]]
+
+        if "anyOf" in node:
+            options = [option for option in node["anyOf"] if option.get("type") != "null"]
+            converted = convert(options[0])
+            if len(options) < len(node["anyOf"]):
+                converted["nullable"] = True
+            return converted
+
+        converted: Dict[str, Any] = {}
+        if "type" in node:
+            converted["type"] = node["type"].upper()
+        for key in _SCHEMA_PASSTHROUGH_KEYS:
+            if key in node:
+                converted[key] = node[key]
+        if "properties" in node:
+            converted["properties"] = {
+                name: convert(child) for name, child in node["properties"].items()
+            }
+        if "required" in node:
+            converted["required"] = list(node["required"])
+        if "items" in node:
+            converted["items"] = convert(node["items"])
+        return converted
+
+    return convert(schema)
+
+
+def _drop_trailing_comma(out: List[str]) -> None:
+    i = len(out) - 1
+    while i >= 0 and out[i].isspace():
+        i -= 1
+    if i >= 0 and out[i] == ",":
+        del out[i]
+
+
+def _close_dangling_value(out: List[str]) -> None:
+    i = len(out) - 1
+    while i >= 0 and out[i].isspace():
+        i -= 1
+    if i >= 0 and out[i] == ":":
+        out.append("null")
+
+
+# Repairs raw model output into a JSON document in a single scan.
+# Skips leading prose and code fences, escapes raw control characters inside
+# strings, drops trailing commas, ignores anything after the top-level value
+# and closes strings/brackets left open by a truncated response.
+def repair_json(text: str) -> str:
+    start = next((i for i, ch in enumerate(text) if ch in "{["), -1)
+    if start < 0:
+        raise ValueError("No JSON object found in model output")
+
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+
+    for ch in text[start:]:
+        if in_string:
+            if escaped:
+                escaped = False
+                out.append(ch)
+            elif ch == "\\":
+                escaped = True
+                out.append(ch)
+            elif ch == '"':
+                in_string = False
+                out.append(ch)
+            elif ch == "\n":
+                out.append("\\n")
+            elif ch == "\r":
+                out.append("\\r")
+            elif ch == "\t":
+                out.append("\\t")
+            elif ord(ch) < 0x20:
+                out.append(f"\\u{ord(ch):04x}")
+            else:
+                out.append(ch)
+            continue
+
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch == "{":
+            stack.append("}")
+            out.append(ch)
+        elif ch == "[":
+            stack.append("]")
+            out.append(ch)
+        elif ch in "}]":
+            if ch not in stack:
+                # Stray closer, e.g. from a fence or prose - ignore it
+                continue
+            # Close anything the model forgot to close before this one
+            while stack:
+                _close_dangling_value(out)
+                _drop_trailing_comma(out)
+                closer = stack.pop()
+                out.append(closer)
+                if closer == ch:
+                    break
+            if not stack:
+                break
+        else:
+            out.append(ch)
+
+    if in_string:
+        if escaped:
+            out.pop()
+        out.append('"')
+
+    # Truncated output: close whatever is still open
+    while stack:
+        _close_dangling_value(out)
+        _drop_trailing_comma(out)
+        out.append(stack.pop())
+
+    return "".join(out)
+
+
+def _as_list(value: Any) -> List[Any]:
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _as_text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        title = value.get("title") or value.get("name")
+        description = value.get("description") or value.get("details")
+        if title and description:
+            return f"{title}: {description}"
+        if title or description:
+            return str(title or description)
+        return json.dumps(value)
+    return str(value)
+
+
+def _format_step(step: Any) -> str:
+    if not isinstance(step, dict):
+        return _as_text(step)
+
+    action = _as_text(step.get("action") or step.get("description"))
+    text = f"Step {step['step']}: {action}" if step.get("step") else action
+    details = []
+    if step.get("timeline"):
+        details.append(f"Timeline: {step['timeline']}")
+    if step.get("budget"):
+        details.append(f"Budget: {step['budget']}")
+    if details:
+        text += f" ({', '.join(details)})"
+    return text
+
+
+def _format_resource(resource: Any) -> Dict[str, str]:
+    if isinstance(resource, dict):
+        name = resource.get("name") or resource.get("type") or "Unknown Resource"
+        purpose = resource.get("purpose") or resource.get("description") or f"Purpose for {name}"
+    else:
+        name = _as_text(resource) or "Unknown Resource"
+        purpose = f"Purpose for {name}"
+    return {"name": _as_text(name), "purpose": _as_text(purpose)}
+
+
+# Coerces a parsed strategy into the StrategyResponse shape
+def normalize_strategy(data: Any, business_name: str) -> Dict[str, Any]:
+    if not isinstance(data, dict):
+        raise ValueError("Strategy output is not a JSON object")
+
+    return {
+        "title": _as_text(data.get("title")) or f"Strategic Plan for {business_name}",
+        "summary": _as_text(data.get("summary")),
+        "strategies": [_as_text(item) for item in _as_list(data.get("strategies"))],
+        "action_plan": [_format_step(step) for step in _as_list(data.get("action_plan"))],
+        "resources": [_format_resource(resource) for resource in _as_list(data.get("resources"))],
+    }
+
+
+# Parses raw Gemini output into a StrategyResponse-shaped dict.
+# Raises ValueError if the output can't be recovered.
+def parse_strategy_response(text: str, business_name: str) -> Dict[str, Any]:
+    return normalize_strategy(json.loads(repair_json(text)), business_name)
+
+
+if __name__ == "__main__":
+    print(repair_json('```json\n{"title": "Plan", "strategies": ["a", "b",],\n"summary": "line one\nline two'))
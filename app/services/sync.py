@@ -0,0 +1,163 @@
+# python3 -m app.services.sync
+import asyncio
+import base64
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, true
+from sqlalchemy.orm import Session
+
+from app.database.models import Conversation, Message, User
+
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "200"))
+SYNC_MAX_WAIT_SECONDS = float(os.getenv("SYNC_MAX_WAIT_SECONDS", "30"))
+# Long-polls re-check the database this often, so changes written by other
+# worker processes (which can't wake this one) are still picked up
+SYNC_POLL_INTERVAL_SECONDS = float(os.getenv("SYNC_POLL_INTERVAL_SECONDS", "2"))
+
+# Rows are ordered by change number, not by timestamp. Every write to a
+# user's conversations or messages takes its numbers from a counter on the
+# user's row, in the write's own transaction (allocate_change_numbers). The
+# UPDATE keeps that row locked until commit, so a user's writes commit in
+# the order of their numbers: once a row is visible, every row with a lower
+# number is too, and a cursor never passes a write that is still in flight.
+# Timestamps are set by the app before commit and can't promise that.
+#
+# A position is (change number, id) of the last row the client has seen.
+# Rows from before change numbers all have 0; the id orders those.
+Position = Optional[Tuple[int, str]]
+
+CURSOR_VERSION = 2
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(conversations: Position, messages: Position) -> str:
+    data = {
+        "v": CURSOR_VERSION,
+        "c": [conversations[0], conversations[1]] if conversations else None,
+        "m": [messages[0], messages[1]] if messages else None,
+    }
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: Optional[str]) -> Tuple[Position, Position]:
+    """Inverse of encode_cursor. An empty cursor means "from the beginning"."""
+    if not cursor:
+        return None, None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if "v" not in data and ("c" in data or "m" in data):
+            # Timestamp cursor from before change numbers: sync again from the beginning
+            return None, None
+        if data["v"] != CURSOR_VERSION:
+            raise ValueError(f"Unknown cursor version {data['v']}")
+        positions = []
+        for key in ("c", "m"):
+            value = data.get(key)
+            if value and (type(value[0]) is not int or value[0] < 0):
+                raise ValueError("Change numbers are non-negative integers")
+            positions.append((value[0], str(value[1])) if value else None)
+        return positions[0], positions[1]
+    except (ValueError, TypeError, KeyError, IndexError, AttributeError) as e:
+        raise InvalidCursorError("Invalid sync cursor.") from e
+
+
+def allocate_change_numbers(db: Session, user_id: str, count: int) -> int:
+    """Reserve count change numbers for rows this transaction writes for the user. Returns the first.
+
+    Locks the user's row until the transaction ends. Writes covering several
+    users should allocate in user id order, so they can't deadlock.
+    """
+    table = User.__table__
+    last = db.execute(
+        table.update().where(table.c.id == user_id).values(
+            change_seq=table.c.change_seq + count,
+            # Not a profile change; keeps the column's onupdate from firing
+            updated_at=table.c.updated_at
+        ).returning(table.c.change_seq)
+    ).scalar_one()
+    return last - count + 1
+
+
+def _after(timestamp_column, id_column, position: Position):
+    if position is None:
+        return true()
+    timestamp, row_id = position
+    return or_(timestamp_column > timestamp, and_(timestamp_column == timestamp, id_column > row_id))
+
+
+def fetch_changes(
+    db: Session, user_id: str, cursor: Optional[str], limit: int = SYNC_PAGE_SIZE
+) -> Tuple[List[Conversation], List[Message], str, bool]:
+    """Return conversations updated and messages created after the cursor.
+
+    Returns (conversations, messages, next_cursor, has_more). The cursor only
+    moves forward; passing next_cursor back resumes exactly where this page
+    stopped.
+    """
+    conversation_position, message_position = decode_cursor(cursor)
+
+    # Uses ix_conversations_user_id_change_seq
+    conversations = db.query(Conversation).filter(
+        Conversation.user_id == user_id,
+        _after(Conversation.change_seq, Conversation.id, conversation_position)
+    ).order_by(Conversation.change_seq, Conversation.id).limit(limit + 1).all()
+
+    # A new message's conversation gets a change number at least as high in
+    # the same transaction, so only conversations changed since the cursor
+    # need their messages scanned (ix_messages_conversation_id_change_seq does the rest)
+    message_query = db.query(Message).join(Conversation, Message.conversation_id == Conversation.id).filter(
+        Conversation.user_id == user_id,
+        _after(Message.change_seq, Message.id, message_position)
+    )
+    if message_position is not None:
+        message_query = message_query.filter(Conversation.change_seq >= message_position[0])
+    messages = message_query.order_by(Message.change_seq, Message.id).limit(limit + 1).all()
+
+    has_more = len(conversations) > limit or len(messages) > limit
+    conversations, messages = conversations[:limit], messages[:limit]
+
+    if conversations:
+        conversation_position = (conversations[-1].change_seq, conversations[-1].id)
+    if messages:
+        message_position = (messages[-1].change_seq, messages[-1].id)
+    return conversations, messages, encode_cursor(conversation_position, message_position), has_more
+
+
+class SyncNotifier:
+    """Wakes long-polling sync requests in this process when a user's data changes."""
+
+    def __init__(self):
+        self._waiters: Dict[str, List[asyncio.Event]] = {}
+
+    def notify(self, user_id: str) -> None:
+        for event in self._waiters.pop(user_id, []):
+            event.set()
+
+    async def wait(self, user_id: str, timeout: float) -> bool:
+        """Wait up to timeout seconds for a notification. Returns True if notified."""
+        event = asyncio.Event()
+        self._waiters.setdefault(user_id, []).append(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters = self._waiters.get(user_id)
+            if waiters and event in waiters:
+                waiters.remove(event)
+                if not waiters:
+                    del self._waiters[user_id]
+
+
+sync_notifier = SyncNotifier()
+
+
+if __name__ == "__main__":
+    cursor = encode_cursor((42, "conversation-id"), None)
+    print(cursor, decode_cursor(cursor))
@@ -0,0 +1,91 @@
+# python3 -m app.services.usage
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.database.models import UserUsage
+
+# Token counts reported by Gemini, collected per request: the router starts
+# tracking, the service functions add each response's usage metadata, and the
+# router writes the total to user_usage in the same transaction as its results.
+
+
+@dataclass
+class TokenUsage:
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    # The model that produced the final response; None when nothing was generated (cache hits)
+    model: Optional[str] = None
+
+    def add(self, other: "TokenUsage") -> None:
+        self.prompt_tokens += other.prompt_tokens
+        self.output_tokens += other.output_tokens
+
+
+# Holds a mutable TokenUsage, so additions made in worker threads
+# (which run in a copy of the context) still reach the request
+_current_usage: ContextVar[Optional[TokenUsage]] = ContextVar("current_usage", default=None)
+
+
+def track_usage() -> TokenUsage:
+    """Start collecting token usage for the current request."""
+    usage = TokenUsage()
+    _current_usage.set(usage)
+    return usage
+
+
+def add_token_usage(response, model: Optional[str] = None) -> None:
+    """Add a Gemini response's usage metadata to the current request, if tracked."""
+    usage = _current_usage.get()
+    if usage is None:
+        return
+    if model is not None:
+        usage.model = model
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is None:
+        return
+    usage.add(TokenUsage(
+        prompt_tokens=getattr(metadata, "prompt_token_count", 0) or 0,
+        output_tokens=getattr(metadata, "candidates_token_count", 0) or 0
+    ))
+
+
+def record_usage(db: Session, user_id: str, kind: str, usage: TokenUsage, requests: int = 1, day: Optional[date] = None) -> None:
+    """Add to the user's usage row for the day. The caller commits."""
+    dialect = db.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    table = UserUsage.__table__
+    statement = insert(table).values(
+        user_id=user_id,
+        day=day or datetime.now(timezone.utc).date(),
+        kind=kind,
+        requests=requests,
+        prompt_tokens=usage.prompt_tokens,
+        output_tokens=usage.output_tokens
+    )
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.day, table.c.kind],
+        set_={
+            "requests": table.c.requests + statement.excluded.requests,
+            "prompt_tokens": table.c.prompt_tokens + statement.excluded.prompt_tokens,
+            "output_tokens": table.c.output_tokens + statement.excluded.output_tokens,
+        }
+    ))
+
+
+def get_usage(db: Session, user_id: str, days: int) -> List[UserUsage]:
+    since = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    return db.query(UserUsage).filter(
+        UserUsage.user_id == user_id,
+        UserUsage.day >= since
+    ).order_by(UserUsage.day.desc(), UserUsage.kind).all()
+
+
+if __name__ == "__main__":
+    usage = TokenUsage()
+    usage.add(TokenUsage(prompt_tokens=10, output_tokens=5))
+    print(usage)
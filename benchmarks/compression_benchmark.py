@@ -0,0 +1,103 @@
+# python3 -m benchmarks.compression_benchmark
+# Storage saved vs CPU spent by CompressedText for typical payloads.
+# Pass --db to also sample real rows from DATABASE_URL.
+import json
+import random
+import sys
+import time
+
+import zstandard
+
+from app.database.types import COMPRESSION_LEVEL, COMPRESSION_MIN_BYTES, decode_text, encode_text
+
+WORDS = (
+    "growth market customer retention revenue pricing channel social media campaign brand "
+    "budget timeline quarter launch partnership inventory supplier margin audience content "
+    "engagement conversion funnel loyalty referral analytics retail online store local community"
+).split()
+
+
+def _sentence(rng: random.Random, length: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + "."
+
+
+def synthetic_payloads(rng: random.Random) -> dict:
+    strategy = {
+        "title": _sentence(rng, 6),
+        "summary": " ".join(_sentence(rng, 18) for _ in range(5)),
+        "strategies": [_sentence(rng, 25) for _ in range(5)],
+        "action_plan": [f"Step {i}: {_sentence(rng, 20)} (Timeline: Q{i % 4 + 1}, Budget: ${rng.randint(1, 50)}k)" for i in range(1, 9)],
+        "resources": [{"name": _sentence(rng, 3), "purpose": _sentence(rng, 12)} for _ in range(5)],
+    }
+    return {
+        "strategy JSON": [json.dumps(strategy) for _ in range(50)],
+        "long assistant reply": ["\n\n".join(_sentence(rng, 30) for _ in range(12)) for _ in range(50)],
+        "short user message": [_sentence(rng, 12) for _ in range(50)],
+    }
+
+
+def db_payloads(limit: int = 500) -> dict:
+    from app.database.database import SessionLocal
+    from app.database.models import SavedStrategy, Message
+
+    db = SessionLocal()
+    try:
+        return {
+            "db saved_strategies": [row[0] for row in db.query(SavedStrategy.content).limit(limit)],
+            "db messages": [row[0] for row in db.query(Message.content).limit(limit)],
+        }
+    finally:
+        db.close()
+
+
+def measure(name: str, values: list, level: int, repeat: int = 5) -> None:
+    if not values:
+        return
+    compressor = zstandard.ZstdCompressor(level=level)
+    decompressor = zstandard.ZstdDecompressor()
+    raw = [v.encode("utf-8") for v in values]
+    compressed = [compressor.compress(r) for r in raw]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for r in raw:
+            compressor.compress(r)
+    compress_us = (time.perf_counter() - start) / (repeat * len(raw)) * 1e6
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for c in compressed:
+            decompressor.decompress(c)
+    decompress_us = (time.perf_counter() - start) / (repeat * len(raw)) * 1e6
+
+    raw_bytes = sum(len(r) for r in raw)
+    print(
+        f"{name:<24} level={level:<3} avg={raw_bytes // len(raw):>6}B "
+        f"ratio={raw_bytes / sum(len(c) for c in compressed):>5.2f}x "
+        f"compress={compress_us:>7.1f}us decompress={decompress_us:>6.1f}us"
+    )
+
+
+def main():
+    rng = random.Random(42)
+    payloads = synthetic_payloads(rng)
+    if "--db" in sys.argv:
+        payloads.update(db_payloads())
+
+    sample = payloads["strategy JSON"][0]
+    assert decode_text(encode_text(sample)) == sample
+
+    print(f"COMPRESSION_MIN_BYTES={COMPRESSION_MIN_BYTES} COMPRESSION_LEVEL={COMPRESSION_LEVEL}")
+    for name, values in payloads.items():
+        if not values:
+            continue
+        # What CompressedText actually stores (threshold + tag byte)
+        raw_bytes = sum(len(v.encode("utf-8")) for v in values)
+        stored_bytes = sum(len(encode_text(v)) for v in values)
+        print(f"{name:<24} stored {stored_bytes / raw_bytes:.1%} of {raw_bytes} bytes")
+        for level in (1, 3, 9, 19):
+            measure(name, values, level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# python3 -m benchmarks.response_compression_benchmark
+# Bytes saved vs CPU spent by CompressionMiddleware for typical
+# GET /ai/conversations/{id} payloads, whole-body and streamed per line.
+import json
+import random
+import time
+
+from app.middleware.compression import ENCODERS, GzipEncoder, ZstdEncoder, BrotliEncoder, brotli
+from benchmarks.compression_benchmark import _sentence
+
+LEVELS = {
+    "gzip": [(GzipEncoder, level) for level in (1, 6, 9)],
+    "zstd": [(ZstdEncoder, level) for level in (1, 3, 9)],
+    "br": [(BrotliEncoder, quality) for quality in (1, 4, 9)] if brotli is not None else [],
+}
+
+
+def conversation_payload(rng: random.Random, turns: int) -> bytes:
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": _sentence(rng, 15), "created_at": f"2024-05-01T10:{i % 60:02d}:00"})
+        messages.append({
+            "role": "assistant",
+            "content": "\n\n".join(_sentence(rng, 30) for _ in range(rng.randint(3, 10))),
+            "created_at": f"2024-05-01T10:{i % 60:02d}:05",
+        })
+    return json.dumps(messages).encode("utf-8")
+
+
+def measure_body(name: str, body: bytes, encoder_class, level: int, repeat: int = 20) -> None:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encoder = encoder_class(level)
+        compressed = encoder.compress(body) + encoder.finish()
+    compress_us = (time.perf_counter() - start) / repeat * 1e6
+    print(
+        f"{name:<18} {encoder_class.encoding:<5} level={level:<2} {len(body):>8}B -> {len(compressed):>7}B "
+        f"({len(body) / len(compressed):>5.2f}x) {compress_us:>8.1f}us"
+    )
+
+
+# NDJSON/SSE: one flush per line, as the middleware does for streams
+def measure_stream(name: str, lines: list, encoder_class, level: int, repeat: int = 20) -> None:
+    raw = sum(len(line) for line in lines)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encoder = encoder_class(level)
+        sent = sum(len(encoder.compress(line) + encoder.flush()) for line in lines) + len(encoder.finish())
+    compress_us = (time.perf_counter() - start) / repeat * 1e6
+    print(
+        f"{name:<18} {encoder_class.encoding:<5} level={level:<2} {raw:>8}B -> {sent:>7}B "
+        f"({raw / sent:>5.2f}x) {compress_us:>8.1f}us"
+    )
+
+
+def main():
+    rng = random.Random(42)
+    print(f"Encoders available: {', '.join(ENCODERS)}")
+    for turns in (2, 10, 50, 200):
+        body = conversation_payload(rng, turns)
+        for encoder_class, level in [option for options in LEVELS.values() for option in options]:
+            measure_body(f"{turns * 2} messages", body, encoder_class, level)
+
+    messages = json.loads(conversation_payload(rng, 50))
+    lines = [(json.dumps(message) + "\n").encode("utf-8") for message in messages]
+    print("\nStreamed, flushed per line:")
+    for encoder_class, level in [option for options in LEVELS.values() for option in options]:
+        measure_stream(f"{len(lines)} lines", lines, encoder_class, level)
+
+
+if __name__ == "__main__":
+    main()
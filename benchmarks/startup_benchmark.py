@@ -0,0 +1,78 @@
+# python3 -m benchmarks.startup_benchmark
+# Import time of each entry point, from python -X importtime, against a budget.
+# Exits 1 if any entry point is over budget. Pass --top N to list more of the
+# slowest imports, --budget-only to skip the list.
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Milliseconds, best of RUNS, on a developer laptop. Importing an entry point
+# must not need DATABASE_URL, a database or the Gemini SDK, so any of them
+# sneaking back into an import path shows up here first.
+BUDGETS_MS = {
+    "app.main": 1500,
+    "app.server": 250,
+    "db": 1000,
+    "app.database.models": 500,
+}
+RUNS = 5
+# Imported only when first used; loading any of these at import is a regression
+LAZY_MODULES = ("google.generativeai", "passlib.context")
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_times(module: str) -> List[Tuple[str, int, int]]:
+    """(module, self us, cumulative us) for everything importing `module` loads."""
+    env = {k: v for k, v in os.environ.items() if k not in ("DATABASE_URL", "DATABASE_REPLICA_URL")}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            times.append((match.group(4), int(match.group(1)), int(match.group(2))))
+    return times
+
+
+def measure(module: str, runs: int = RUNS) -> List[Tuple[str, int, int]]:
+    """The run with the lowest total, which is the least disturbed by the rest of the machine."""
+    return min((import_times(module) for _ in range(runs)), key=lambda times: _total_us(module, times))
+
+
+def _total_us(module: str, times: List[Tuple[str, int, int]]) -> int:
+    return next(cumulative for name, _, cumulative in times if name == module)
+
+
+def main():
+    top = int(sys.argv[sys.argv.index("--top") + 1]) if "--top" in sys.argv else 5
+    over_budget: Dict[str, str] = {}
+
+    for module, budget_ms in BUDGETS_MS.items():
+        times = measure(module)
+        total_ms = _total_us(module, times) / 1000
+        status = "ok" if total_ms <= budget_ms else "OVER"
+        print(f"{module:<22} {total_ms:>7.0f}ms  budget {budget_ms:>5}ms  {status}")
+        if total_ms > budget_ms:
+            over_budget[module] = f"{total_ms:.0f}ms > {budget_ms}ms"
+
+        loaded = [name for name, _, _ in times if name in LAZY_MODULES]
+        if loaded:
+            print(f"    imports {', '.join(loaded)} eagerly")
+            over_budget[module] = f"imports {', '.join(loaded)}"
+
+        if "--budget-only" not in sys.argv:
+            for name, self_us, _ in sorted(times, key=lambda t: t[1], reverse=True)[:top]:
+                print(f"    {self_us / 1000:>7.1f}ms  {name}")
+
+    if over_budget:
+        print(f"Over budget: {over_budget}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
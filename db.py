@@ -3,8 +3,9 @@ import sys
 import os
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.dialects.postgresql import UUID
-from app.database.database import Base, engine
+from app.database.database import Base, get_engine
 from app.database.models import User, SavedStrategy, Conversation, Message
+from app.database.migrations import run_migrations
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -14,8 +15,12 @@ def init_db():
     """Create all database tables defined in the models."""
     try:
         logger.info("Creating database tables...")
+        engine = get_engine()
         Base.metadata.create_all(bind=engine)
         logger.info("✅ Database tables created successfully!")
+
+        run_migrations(engine)
+        logger.info("✅ Schema updates, excerpts and search indexes ready!")
         
         # List the tables that were created
         table_names = Base.metadata.tables.keys()
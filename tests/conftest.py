@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+os.environ.setdefault("SECRET_KEY", "test-secret")
+
+from app.database.database import SessionLocal, configure_database
+from app.database.migrations import run_migrations
+from app.database.models import User
+
+
+@pytest.fixture
+def db():
+    # A fresh in-memory database per test; every session shares its one connection
+    engine = configure_database("sqlite://")
+    run_migrations(engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
+
+
+@pytest.fixture
+def user(db):
+    user = User(email="user@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    return user
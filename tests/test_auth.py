@@ -0,0 +1,41 @@
+import pytest
+from sqlalchemy import inspect
+
+from app.auth.utils import create_access_token, get_current_user
+from app.database.database import DatabaseSettings, SessionLocal, configure_database, get_replica_engine
+from app.database.migrations import run_migrations
+from app.database.models import User
+from app.database.replica import recent_writes, replica_monitor
+
+
+@pytest.fixture
+def replica(tmp_path):
+    # The replica is the same file, so it sees every write at once
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = configure_database(DatabaseSettings(url=url, replica_url=url))
+    run_migrations(engine)
+    replica_monitor.check()
+    yield get_replica_engine()
+    engine.dispose()
+    get_replica_engine().dispose()
+    configure_database("sqlite://")
+    replica_monitor.check()
+
+
+def test_user_lookup_does_not_hold_a_replica_connection(replica):
+    db = SessionLocal()
+    user = User(email="user@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    recent_writes._until.clear()
+
+    token = create_access_token({"sub": "user@example.com", "user_id": str(user_id)})
+    current = get_current_user(token, db)
+
+    assert current.id == user_id
+    # Read on the replica, in a session that has already ended
+    assert inspect(current).detached
+    assert current.email == "user@example.com" and current.is_active
+    assert replica.pool.checkedout() == 0
+    db.close()
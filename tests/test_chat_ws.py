@@ -0,0 +1,56 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from app.auth.utils import ALGORITHM, SECRET_KEY, create_access_token
+from app.main import app
+
+
+@pytest.fixture
+def client(db):
+    return TestClient(app)
+
+
+def _token(user, expires_in: timedelta = None) -> str:
+    if expires_in is None:
+        return create_access_token({"sub": user.email, "user_id": str(user.id)})
+    expires_at = datetime.now(timezone.utc) + expires_in
+    return jwt.encode({"sub": user.email, "user_id": str(user.id), "exp": expires_at}, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def test_ping(client, user):
+    with client.websocket_connect(f"/ai/ws/chat?token={_token(user)}") as ws:
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+
+
+def test_binary_frame_closes_with_unsupported_data(client, user):
+    with client.websocket_connect(f"/ai/ws/chat?token={_token(user)}") as ws:
+        ws.send_bytes(b"\x00\x01")
+        message = ws.receive()
+        assert message["type"] == "websocket.close"
+        assert message["code"] == 1003
+
+
+def test_socket_closes_when_the_token_expires(client, user):
+    with client.websocket_connect(f"/ai/ws/chat?token={_token(user, timedelta(seconds=2))}") as ws:
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+        started = time.monotonic()
+        message = ws.receive()
+        assert message["type"] == "websocket.close"
+        assert message["code"] == 1008
+        assert time.monotonic() - started < 5
+
+
+def test_deactivated_user_is_disconnected(client, db, user):
+    with client.websocket_connect(f"/ai/ws/chat?token={_token(user)}") as ws:
+        user.is_active = False
+        db.commit()
+        ws.send_json({"type": "message", "id": "1", "message": "hello"})
+        message = ws.receive()
+        assert message["type"] == "websocket.close"
+        assert message["code"] == 1008
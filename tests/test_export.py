@@ -0,0 +1,53 @@
+import io
+import json
+import uuid
+import zipfile
+from datetime import datetime, timezone
+
+from app.services.chat_writer import ChatTurn, save_chat_turns
+from app.services.export import export_records, ndjson_chunks, zip_chunks
+
+
+def _chat(db, user, text):
+    save_chat_turns(db, [ChatTurn(
+        conversation_id=str(uuid.uuid4()),
+        user_id=user.id,
+        user_message=text,
+        reply=f"re: {text}",
+        reply_at=datetime.now(timezone.utc),
+        new_title=text
+    )])
+
+
+def test_zip_chunks_round_trip():
+    chunks = [b'{"type":"strategy"}\n' * 100, b"", b'{"type":"export"}\n']
+    data = b"".join(zip_chunks(iter(chunks), "export.ndjson"))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == ["export.ndjson"]
+        assert archive.read("export.ndjson") == b"".join(chunks)
+
+
+def test_zip_chunks_empty():
+    data = b"".join(zip_chunks(iter([]), "export.ndjson"))
+    assert zipfile.ZipFile(io.BytesIO(data)).read("export.ndjson") == b""
+
+
+def test_incremental_export(db, user):
+    _chat(db, user, "first")
+    records = list(export_records(db, user.id))
+    trailer = records[-1]
+    assert trailer["type"] == "export"
+    assert trailer["counts"] == {"strategy": 0, "conversation": 1, "message": 2}
+
+    assert list(export_records(db, user.id, trailer["next_since"]))[-1]["counts"]["message"] == 0
+
+    _chat(db, user, "second")
+    records = list(export_records(db, user.id, trailer["next_since"]))
+    assert [r.get("content") or r.get("title") for r in records[:-1]] == ["second", "second", "re: second"]
+
+
+def test_ndjson_chunks(db, user):
+    _chat(db, user, "hello")
+    lines = b"".join(ndjson_chunks(user.id, batch_size=2)).decode("utf-8").splitlines()
+    assert [json.loads(line)["type"] for line in lines] == ["conversation", "message", "message", "export"]
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from app.database.models import IdempotencyKey
+from app.services.idempotency import IDEMPOTENCY_STORE_FAILED_DETAIL, run_idempotent
+
+
+def _run(db, user, handler, key="key-1", payload=None):
+    return asyncio.run(run_idempotent(db, user.id, key, "/test", payload or {"n": 1}, handler))
+
+
+def test_response_is_stored_and_replayed(db, user):
+    calls = []
+
+    async def handler(claim):
+        calls.append(claim)
+        result = {"n": len(calls)}
+        claim.store(db, result)
+        db.commit()
+        return result
+
+    assert _run(db, user, handler) == {"n": 1}
+    replay = _run(db, user, handler)
+    assert len(calls) == 1
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.body == b'{"n":1}'
+
+
+def test_failed_handler_releases_the_key(db, user):
+    async def failing(claim):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        _run(db, user, failing)
+    assert db.query(IdempotencyKey).count() == 0
+
+    async def handler(claim):
+        return {"ok": True}
+
+    assert _run(db, user, handler) == {"ok": True}
+    assert db.query(IdempotencyKey.status_code).scalar() == 200
+
+
+def test_failure_after_storing_keeps_the_response(db, user):
+    async def handler(claim):
+        claim.store(db, {"ok": True})
+        db.commit()
+        raise RuntimeError("after commit")
+
+    with pytest.raises(RuntimeError):
+        _run(db, user, handler)
+    assert db.query(IdempotencyKey.status_code).scalar() == 200
+
+
+def test_unstorable_response_is_marked_failed(db, user):
+    async def handler(claim):
+        return {"not json": object()}
+
+    _run(db, user, handler)
+    record = db.query(IdempotencyKey).one()
+    assert record.status_code == 500
+    assert IDEMPOTENCY_STORE_FAILED_DETAIL in record.response
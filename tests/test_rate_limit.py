@@ -0,0 +1,87 @@
+import pytest
+
+from app.services import rate_limit
+from app.services.rate_limit import RateLimiter, RateLimitStatus, Rule, SQLiteStore
+
+
+class Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(600_000.0)  # The start of a minute
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+def test_parse_rules():
+    assert Rule.parse_all("20/minute, 300/days") == [Rule(20, 60), Rule(300, 86400)]
+
+
+def test_refuses_past_the_limit(clock):
+    limiter = RateLimiter({"chat": "3/minute"})
+    statuses = [limiter.check("user", "chat") for _ in range(4)]
+
+    assert [s.allowed for s in statuses] == [True, True, True, False]
+    assert [s.remaining for s in statuses] == [2, 1, 0, 0]
+    assert statuses[0].reset_seconds == 60
+    assert statuses[3].retry_after > 0
+    assert limiter.check("other", "chat").allowed
+    assert limiter.check("user", "unknown") is None
+
+
+def test_window_slides(clock):
+    limiter = RateLimiter({"chat": "3/minute"})
+    for _ in range(3):
+        assert limiter.check("user", "chat").allowed
+
+    # Halfway into the next minute, half of the last one's 3 requests still count
+    clock.now += 90
+    assert limiter.check("user", "chat").allowed
+    assert not limiter.check("user", "chat").allowed
+
+    clock.now += 60
+    assert limiter.check("user", "chat").allowed
+
+
+def test_report_only_check_does_not_count(clock):
+    limiter = RateLimiter({"chat": "1/minute", "ai": "10/minute"})
+    assert limiter.check("user", "chat", consume=False).remaining == 1
+    assert limiter.status("user")["chat"].allowed
+    assert limiter.check("user", "chat").allowed
+    assert not limiter.status("user")["chat"].allowed
+
+
+def test_tightest_rule_is_reported(clock):
+    limiter = RateLimiter({"chat": "100/minute,2/day"})
+    status = limiter.check("user", "chat")
+    assert (status.limit, status.remaining) == (2, 1)
+
+    limiter.check("user", "chat")
+    status = limiter.check("user", "chat")
+    assert not status.allowed
+    assert status.limit == 2
+    assert status.retry_after > 60
+
+
+def test_sqlite_store_is_shared(clock, tmp_path):
+    path = str(tmp_path / "rate_limit.db")
+    first = RateLimiter({"chat": "2/minute"}, SQLiteStore(path))
+    second = RateLimiter({"chat": "2/minute"}, SQLiteStore(path))
+
+    assert first.check("user", "chat").allowed
+    assert second.check("user", "chat").allowed
+    assert not first.check("user", "chat").allowed
+
+
+def test_headers():
+    allowed = RateLimitStatus(allowed=True, limit=20, remaining=19, reset_seconds=42)
+    assert allowed.headers() == {"X-RateLimit-Limit": "20", "X-RateLimit-Remaining": "19", "X-RateLimit-Reset": "42"}
+
+    refused = RateLimitStatus(allowed=False, limit=20, remaining=0, reset_seconds=42, retry_after=7)
+    assert refused.headers()["Retry-After"] == "7"
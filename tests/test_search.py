@@ -0,0 +1,58 @@
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from app.database.models import Conversation, Message
+from app.database.search import highlight, index_existing_rows, search_ids
+from app.services.chat_writer import ChatTurn, save_chat_turns
+
+
+@pytest.fixture
+def conversation(db, user):
+    conversation = Conversation(id=str(uuid.uuid4()), user_id=user.id, title="Growth")
+    db.add(conversation)
+    db.commit()
+    return conversation
+
+
+def test_new_rows_are_indexed(db, user, conversation):
+    message = Message(conversation_id=conversation.id, role="user", content="How do I grow my Instagram following?")
+    db.add(message)
+    db.commit()
+    assert [row_id for row_id, _ in search_ids(db, Message, user.id, "instagram", 10)] == [message.id]
+
+
+def test_existing_rows_are_indexed_in_batches(db, user, conversation):
+    # Core inserts skip the ORM hooks, like rows written before search existed
+    now = datetime.now(timezone.utc)
+    db.execute(Message.__table__.insert(), [
+        {"id": str(uuid.uuid4()), "conversation_id": conversation.id, "role": "user", "content": f"bakery idea {i}", "created_at": now}
+        for i in range(5)
+    ])
+    db.commit()
+    assert search_ids(db, Message, user.id, "bakery", 10) == []
+
+    assert index_existing_rows(db.get_bind(), batch_size=2, pause=0) == {"saved_strategies": 0, "messages": 5}
+    db.commit()
+    assert len(search_ids(db, Message, user.id, "bakery", 10)) == 5
+    assert index_existing_rows(db.get_bind(), batch_size=2, pause=0)["messages"] == 0
+
+
+def test_highlight():
+    assert highlight("How do I grow my Instagram following quickly?", "instagram growing") == (
+        "How do I <mark>grow</mark> my <mark>Instagram</mark> following quickly?"
+    )
+
+
+def test_chat_turns_are_indexed(db, user):
+    save_chat_turns(db, [ChatTurn(
+        conversation_id=str(uuid.uuid4()),
+        user_id=user.id,
+        user_message="Pricing for a flower shop?",
+        reply="Price bouquets by stem count.",
+        reply_at=datetime.now(timezone.utc),
+        new_title="Pricing"
+    )])
+    assert len(search_ids(db, Message, user.id, "bouquets", 10)) == 1
+    assert len(search_ids(db, Message, user.id, "flower", 10)) == 1
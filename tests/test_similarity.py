@@ -0,0 +1,85 @@
+import pytest
+
+from app.database.models import SavedStrategy
+from app.services import similarity
+from app.services.similarity import StrategyIndex
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(similarity, "time", clock)
+    return clock
+
+
+def _add(index, user_id, doc_id, content):
+    index.add(user_id, doc_id, "", "Bloom Cafe", "Food", content)
+
+
+def test_most_similar_first():
+    index = StrategyIndex(n_features=2 ** 12)
+    _add(index, "u1", "a", "social media instagram followers growth")
+    _add(index, "u1", "b", "supplier negotiation and inventory")
+    _add(index, "u2", "c", "instagram followers")
+
+    matches = index.search("u1", "", "Bloom Cafe", "Food", "grow instagram followers")
+    assert [doc_id for doc_id, _ in matches] == ["a", "b"]
+    assert [doc_id for doc_id, _ in index.similar_to("u1", "a")] == ["b"]
+
+    index.remove("u1", "a")
+    assert [doc_id for doc_id, _ in index.search("u1", "", "", "", "instagram")] == []
+
+
+def test_least_recently_used_user_is_evicted(clock):
+    index = StrategyIndex(n_features=2 ** 12, max_users=2)
+    _add(index, "u1", "a", "instagram")
+    _add(index, "u2", "b", "instagram")
+    clock.now += 1
+    index.search("u1", "", "", "", "instagram")
+    _add(index, "u3", "c", "instagram")
+
+    assert list(index._users) == ["u1", "u3"]
+    assert index.search("u2", "", "", "", "instagram") == []
+    # Document frequencies forget the evicted user's strategies
+    assert index._n_docs == 2
+    assert index._doc_freq.sum() == sum(len(columns) for d in index._users.values() for columns, _ in d.rows.values())
+
+
+def test_idle_user_is_evicted(clock):
+    index = StrategyIndex(n_features=2 ** 12, idle_seconds=60)
+    _add(index, "u1", "a", "instagram")
+    clock.now += 61
+    _add(index, "u2", "b", "instagram")
+
+    assert list(index._users) == ["u2"]
+    assert index._n_docs == 1
+
+
+def test_evicted_user_is_loaded_again(db, user, clock):
+    db.add_all([
+        SavedStrategy(user_id=user.id, title="Grow", business_name="Bloom", industry="Cafe", content="instagram followers"),
+        SavedStrategy(user_id=user.id, title="Costs", business_name="Bloom", industry="Cafe", content="supplier inventory"),
+    ])
+    db.commit()
+    index = StrategyIndex(n_features=2 ** 12, max_users=1)
+
+    index.ensure_loaded(db, user.id)
+    assert len(index.search(user.id, "", "", "", "instagram")) == 1
+
+    _add(index, "other", "x", "instagram")
+    assert index.search(user.id, "", "", "", "instagram") == []
+
+    index.ensure_loaded(db, user.id)
+    assert len(index.search(user.id, "", "", "", "instagram")) == 1
+    assert list(index._users) == [user.id]
@@ -0,0 +1,46 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.auth.utils import get_active_user
+from app.main import app
+
+
+@pytest.fixture
+def client(db, user):
+    app.dependency_overrides[get_active_user] = lambda: user
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def _save(client, title):
+    response = client.post("/strategies/", json={
+        "title": title, "business_name": "Bloom", "industry": "Cafe", "content": f"{title} plan"
+    })
+    assert response.status_code == 201
+    return response.json()["id"]
+
+
+def test_list_etag_changes_with_every_write(client, db, user):
+    first = _save(client, "First")
+    listed = client.get("/strategies/")
+    etag = listed.headers["ETag"]
+    assert client.get("/strategies/", headers={"If-None-Match": etag}).status_code == 304
+
+    # Within the same second: the count and every timestamp end up as they were
+    assert client.delete(f"/strategies/{first}").status_code == 204
+    _save(client, "Second")
+
+    listed = client.get("/strategies/", headers={"If-None-Match": etag})
+    assert listed.status_code == 200
+    assert [s["title"] for s in listed.json()] == ["Second"]
+    assert listed.headers["ETag"] != etag
+
+
+def test_delete_takes_a_change_number(client, db, user):
+    strategy_id = _save(client, "First")
+    db.refresh(user)
+    before = user.change_seq
+
+    client.delete(f"/strategies/{strategy_id}")
+    db.refresh(user)
+    assert user.change_seq == before + 1
@@ -0,0 +1,26 @@
+import json
+
+import pytest
+
+from app.services.structured_output import repair_json
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": 1}', {"a": 1}),
+    ('Here you go:\n```json\n{"a": [1, 2,],}\n```', {"a": [1, 2]}),
+    ('{"a": "line\nbreak\tand tab"}', {"a": "line\nbreak\tand tab"}),
+    ('{"a": "x\\"}"}', {"a": 'x"}'}),
+    ('[1, 2] and more text {"x": 1}', [1, 2]),
+])
+def test_repair_json(text, expected):
+    assert json.loads(repair_json(text)) == expected
+
+
+def test_repair_json_closes_truncated_output():
+    assert json.loads(repair_json('{"a": "line", "b": [1, {"c": "tru')) == {"a": "line", "b": [1, {"c": "tru"}]}
+    assert json.loads(repair_json('{"a": 1, "b":')) == {"a": 1, "b": None}
+
+
+def test_repair_json_without_json():
+    with pytest.raises(ValueError):
+        repair_json("Sorry, I can't help with that.")
@@ -0,0 +1,94 @@
+import base64
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.services.chat_writer import ChatTurn, save_chat_turns
+from app.services.sync import InvalidCursorError, allocate_change_numbers, decode_cursor, encode_cursor, fetch_changes
+
+
+def _turn(user, text, reply_at, conversation_id=None, new=True):
+    return ChatTurn(
+        conversation_id=conversation_id or str(uuid.uuid4()),
+        user_id=user.id,
+        user_message=text,
+        reply=f"re: {text}",
+        reply_at=reply_at,
+        new_title=text if new else None
+    )
+
+
+def _encode(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode("utf-8")).decode("ascii")
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor((3, "conversation"), (4, "message"))
+    assert decode_cursor(cursor) == ((3, "conversation"), (4, "message"))
+    assert decode_cursor(encode_cursor(None, (0, "m"))) == (None, (0, "m"))
+    assert decode_cursor(None) == (None, None)
+    assert decode_cursor("") == (None, None)
+
+
+def test_timestamp_cursor_syncs_from_the_beginning():
+    legacy = _encode({"c": None, "m": [datetime.now(timezone.utc).isoformat(), "message"]})
+    assert decode_cursor(legacy) == (None, None)
+
+
+@pytest.mark.parametrize("cursor", [
+    "junk",
+    _encode({"v": 1, "c": None, "m": None}),
+    _encode({"v": 2, "c": ["2024-01-01T00:00:00", "x"], "m": None}),
+    _encode({"v": 2, "c": [-1, "x"], "m": None}),
+    _encode({"v": 2, "c": [1], "m": None}),
+])
+def test_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor)
+
+
+def test_change_numbers_are_consecutive(db, user):
+    assert allocate_change_numbers(db, user.id, 2) == 1
+    assert allocate_change_numbers(db, user.id, 3) == 3
+    db.commit()
+    db.refresh(user)
+    assert user.change_seq == 5
+
+
+def test_pages_follow_change_numbers(db, user):
+    now = datetime.now(timezone.utc)
+    conversation_id = str(uuid.uuid4())
+    save_chat_turns(db, [_turn(user, "0", now)])
+    save_chat_turns(db, [_turn(user, "first", now, conversation_id)])
+    for i in range(1, 5):
+        save_chat_turns(db, [_turn(user, str(i), now + timedelta(seconds=i), conversation_id, new=False)])
+
+    seen, cursor, has_more = [], None, True
+    while has_more:
+        _, messages, cursor, has_more = fetch_changes(db, user.id, cursor, limit=3)
+        seen.extend(messages)
+
+    assert [m.content for m in seen] == [
+        "0", "re: 0", "first", "re: first", "1", "re: 1", "2", "re: 2", "3", "re: 3", "4", "re: 4"
+    ]
+    assert [m.change_seq for m in seen] == sorted(m.change_seq for m in seen)
+    assert fetch_changes(db, user.id, cursor)[:2] == ([], [])
+
+
+def test_turn_committed_out_of_timestamp_order_is_synced(db, user):
+    now = datetime.now(timezone.utc)
+    earlier = _turn(user, "earlier", now)
+    later = _turn(user, "later", now + timedelta(seconds=5))
+
+    save_chat_turns(db, [later])
+    conversations, messages, cursor, _ = fetch_changes(db, user.id, None)
+    assert [m.content for m in messages] == ["later", "re: later"]
+
+    # Stamped before the other turn, committed after the client synced it
+    save_chat_turns(db, [earlier])
+    conversations, messages, cursor, has_more = fetch_changes(db, user.id, cursor)
+    assert [c.title for c in conversations] == ["earlier"]
+    assert [m.content for m in messages] == ["earlier", "re: earlier"]
+    assert not has_more
@@ -0,0 +1,50 @@
+import time
+import uuid
+from datetime import datetime, timezone
+
+from app.database.models import Conversation, Message
+from app.database.types import CODEC_RAW, CODEC_ZSTD, COMPRESSION_MIN_BYTES, decode_text, encode_text, uuid7
+
+
+def test_uuid7_is_time_ordered():
+    before = time.time_ns() // 1_000_000
+    ids = [uuid7() for _ in range(5000)]
+    after = time.time_ns() // 1_000_000
+
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert all(value.version == 7 and value.variant == uuid.RFC_4122 for value in ids)
+    assert before <= ids[0].int >> 80 <= ids[-1].int >> 80 <= after + 1
+
+
+def test_short_text_is_stored_raw():
+    encoded = encode_text("héllo")
+    assert encoded[:1] == CODEC_RAW
+    assert decode_text(encoded) == "héllo"
+
+
+def test_long_text_is_compressed():
+    text = "A strategy worth repeating. " * COMPRESSION_MIN_BYTES
+    encoded = encode_text(text)
+    assert encoded[:1] == CODEC_ZSTD
+    assert len(encoded) < len(text)
+    assert decode_text(encoded) == text
+
+
+def test_plain_text_rows_still_read():
+    assert decode_text("written before compression") == "written before compression"
+
+
+def test_compressed_text_round_trip(db, user):
+    conversation = Conversation(id=str(uuid.uuid4()), user_id=user.id, title="t")
+    texts = ["", "short ✓", "long ✓ " * 1000]
+    db.add(conversation)
+    db.add_all([
+        Message(conversation_id=conversation.id, role="user", content=text, created_at=datetime.now(timezone.utc))
+        for text in texts
+    ])
+    db.commit()
+    db.expunge_all()
+
+    stored = db.query(Message.content).order_by(Message.id).all()
+    assert sorted(row.content for row in stored) == sorted(texts)